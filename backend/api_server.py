@@ -3,21 +3,80 @@
 Simple API server to serve data from SQLite database to the frontend
 """
 
-import sqlite3
+import asyncio
 import json
+import os
 from datetime import datetime, timedelta
 import random
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Union
+
+import db
+import storage
+from cache import DataVersion, ResponseCache, ResponseCacheMiddleware
+from capture import open_capture
+from ingest import TelemetryReading, reading_to_row
+from columnar import encode_columns, negotiate_format, read_columns, rows_to_columns
+from downsampling import douglas_peucker, lttb
+from geo import bbox_for_radius, cluster_locations, encode_polyline, haversine_km, route_tolerance
+from migrations import run_migrations
+from rollups import RESOLUTIONS, bucket_floor, choose_resolution
+from serialization import FastJSONResponse
+from stream import StreamBroadcaster
+from timestamps import MILLISECOND, time_of_day, to_epoch_ms, to_iso
 
 
 # Database configuration
-DB_FILE = 'chisifai.db'
+DB_FILE = db.DB_FILE
+
+# Embedded MQTT ingestion (disabled unless a broker is configured)
+MQTT_BROKER = os.getenv('CHISIFAI_MQTT_BROKER')
+MQTT_PORT = int(os.getenv('CHISIFAI_MQTT_PORT', '1883'))
+MQTT_TOPIC = os.getenv('CHISIFAI_MQTT_TOPIC', 'chisifai/trackers/telemetry')
+mqtt_worker = None
+
+# Records ingested traffic for replay when CHISIFAI_CAPTURE_DIR is set
+capture = open_capture()
+
+# History endpoint page sizes
+HISTORY_LIMIT = 500
+MAX_HISTORY_LIMIT = 5000
+
+# Aggregated chart series
+SERIES_DEFAULT_RANGE = timedelta(hours=24) // MILLISECOND  # milliseconds
+SERIES_DEFAULT_POINTS = 200
+ROUTE_DEFAULT_ZOOM = 14
+
+# Maximum rows pushed per stream event
+STREAM_BATCH_LIMIT = 1000
+# Newest open alerts the stream watches to push their resolution
+STREAM_OPEN_ALERTS = 100
+
+# Read endpoints served through the response cache
+CACHED_PATHS = (
+    "/api/telemetry", "/api/location", "/api/kpis", "/api/alerts",
+    "/api/temperature", "/api/gforce", "/api/packages/",
+)
 
 app = FastAPI(title="Chisifai API", description="API for Chisifai dashboard data")
 
+# Cache the read endpoints. Registered before CORS so cached responses never
+# carry per-origin headers.
+response_cache = ResponseCache()
+data_version = DataVersion(DB_FILE)
+app.add_middleware(
+    ResponseCacheMiddleware,
+    cache=response_cache,
+    version=data_version,
+    paths=CACHED_PATHS,
+)
+
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -25,9 +84,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-Since", "ETag"],
 )
 
 
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    """FastAPI's 422 without echoing the input, which may be NaN or infinity and not valid JSON"""
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors(), exclude={"input"})})
+
+
 class TelemetryRecord(BaseModel):
     id: int
     packageId: str
@@ -40,6 +106,15 @@ class TelemetryRecord(BaseModel):
     signalStrength: Optional[int]
 
 
+class IngestAck(BaseModel):
+    accepted: int
+    alerts: int
+    resolved: int = 0
+    firstId: Optional[int]
+    lastId: Optional[int]
+    receivedAt: Optional[str] = None
+
+
 class KPIs(BaseModel):
     temperatureCompliance: float
     productConditionRate: float
@@ -67,6 +142,28 @@ class LocationData(BaseModel):
     timestamp: str
 
 
+class LocationCluster(BaseModel):
+    latitude: float
+    longitude: float
+    count: int
+    packageId: Optional[str] = None
+
+
+class RoutePoint(BaseModel):
+    latitude: float
+    longitude: float
+    timestamp: str
+
+
+class PackageRoute(BaseModel):
+    packageId: str
+    start: Optional[str]
+    end: Optional[str]
+    rawPoints: int
+    points: Optional[List[RoutePoint]] = None
+    polyline: Optional[str] = None
+
+
 class TemperatureData(BaseModel):
     timestamp: str
     value: float
@@ -79,223 +176,675 @@ class GForceData(BaseModel):
     packageId: str
 
 
+class SeriesBucket(BaseModel):
+    timestamp: str
+    packageId: str
+    min: float
+    max: float
+    avg: float
+    count: int
+
+
+# Per-thread connection pool shared by every endpoint
+db_pool = db.ConnectionPool(DB_FILE)
+
+
+# Telemetry, alert and latest-state backend (CHISIFAI_STORAGE)
+store = storage.open_store()
+
+
+# Dedicated, bounded reader threads for the async read endpoints
+reader_pool = db.ReaderPool(db_pool, client_errors=(HTTPException,))
+
+
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """Borrow the calling thread's pooled database connection"""
+    return db_pool.connection()
+
+
+async def run_read(fn, *args):
+    """
+    Run `fn(conn, *args)` on the reader pool. A full pool answers 503 and a
+    read past CHISIFAI_READ_TIMEOUT is interrupted and answers 504.
+    """
+    try:
+        return await reader_pool.run(fn, *args)
+    except db.ReaderSaturated:
+        raise HTTPException(status_code=503, detail="Database readers are saturated, retry later")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Database read timed out")
+
+
+def telemetry_record(record):
+    """Map a telemetry row to its API fields (the TelemetryRecord schema)"""
+    return {
+        "id": record['id'],
+        "packageId": record['package_id'],
+        "temperature": record['temperature'],
+        "gForce": record['g_force'],
+        "latitude": record['latitude'],
+        "longitude": record['longitude'],
+        "timestamp": to_iso(record['timestamp']),
+        "batteryLevel": record['battery_level'],
+        "signalStrength": record['signal_strength']
+    }
+
+
+def alert_record(alert):
+    """Map an alerts row to its API fields (the Alert schema)"""
+    return {
+        "id": alert['id'],
+        "packageId": alert['package_id'],
+        "type": alert['alert_type'],
+        "message": alert['message'],
+        "timestamp": time_of_day(alert['timestamp']),
+        "severity": alert['severity']
+    }
+
+
+# API names of the telemetry columns, for the columnar formats
+TELEMETRY_COLUMNS = {
+    "id": "id",
+    "package_id": "packageId",
+    "temperature": "temperature",
+    "g_force": "gForce",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "timestamp": "timestamp",
+    "battery_level": "batteryLevel",
+    "signal_strength": "signalStrength",
+}
+
+
+def iso_timestamps(columns):
+    """Format the timestamp column of a columnar response as ISO 8601"""
+    columns["timestamp"] = [to_iso(timestamp) for timestamp in columns["timestamp"]]
+    return columns
+
+
+def read_telemetry(conn, media_type):
+    """Latest reading of every package, as row JSON or in a columnar format"""
+    records = store.latest(conn)
+
+    if media_type is not None:
+        columns = iso_timestamps(read_columns(records, TELEMETRY_COLUMNS))
+        return Response(encode_columns(columns, media_type), media_type=media_type, headers={"Vary": "Accept"})
+
+    return FastJSONResponse([telemetry_record(record) for record in records], headers={"Vary": "Accept"})
 
 
 @app.get("/api/telemetry", response_model=List[TelemetryRecord])
-def get_telemetry_data():
+async def get_telemetry_data(request: Request):
     """Get latest telemetry data for all packages"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    return await run_read(read_telemetry, negotiate_format(request.headers.get('accept')))
+
+
+def parse_telemetry_payload(body: bytes, content_type: str):
+    """Parse a JSON object, JSON array or NDJSON body into telemetry readings"""
     try:
-        # Get the latest reading for each package
-        cursor.execute("""
-            SELECT t1.* FROM telemetry t1
-            INNER JOIN (
-                SELECT package_id, MAX(timestamp) as max_timestamp
-                FROM telemetry
-                GROUP BY package_id
-            ) t2 ON t1.package_id = t2.package_id AND t1.timestamp = t2.max_timestamp
-            ORDER BY t1.timestamp DESC
-        """)
-        
-        records = cursor.fetchall()
-        result = []
-        for record in records:
-            result.append(TelemetryRecord(
-                id=record['id'],
-                packageId=record['package_id'],
-                temperature=record['temperature'],
-                gForce=record['g_force'],
-                latitude=record['latitude'],
-                longitude=record['longitude'],
-                timestamp=record['timestamp'],
-                batteryLevel=record['battery_level'],
-                signalStrength=record['signal_strength']
-            ))
-        
-        return result
-    finally:
-        conn.close()
+        text = body.decode('utf-8')
+        if 'ndjson' in content_type or 'jsonlines' in content_type:
+            items = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            items = json.loads(text)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid telemetry payload: {e}")
+
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Telemetry payload must be an object or an array")
+
+    readings = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=422, detail=f"Record {index} is not an object")
+        try:
+            readings.append(TelemetryReading(**item))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"record": index, "errors": e.errors(include_context=False, include_input=False)})
+
+    return readings
+
+
+def ingest_readings(readings):
+    """Write a batch of readings in one transaction and acknowledge it"""
+    if capture is not None:
+        for reading in readings:
+            capture.record(reading.model_dump_json(exclude_none=True))
+    with get_db_connection() as conn:
+        ack = store.insert_batch(conn, [reading_to_row(reading) for reading in readings])
+        data_version.bump()
+        return IngestAck(**ack)
+
+
+@app.post("/api/telemetry", response_model=IngestAck)
+def post_telemetry_data(reading: TelemetryReading):
+    """Store a single telemetry reading (used by the Node-RED flow)"""
+    return ingest_readings([reading])
+
+
+@app.post("/api/telemetry/batch", response_model=IngestAck)
+async def post_telemetry_batch(request: Request):
+    """Store a batch of telemetry readings sent as a JSON array or NDJSON"""
+    body = await request.body()
+    readings = parse_telemetry_payload(body, request.headers.get('content-type', ''))
+    if not readings:
+        return IngestAck(accepted=0, alerts=0, firstId=None, lastId=None)
+
+    # Run the blocking insert on the threadpool like the sync endpoints
+    return await run_in_threadpool(ingest_readings, readings)
+
+
+def compute_kpis(conn):
+    """Calculate the Key Performance Indicators from the incrementally maintained KPI state"""
+    state = store.kpi_state(conn)
+    total_packages = state["packages"] or 1
+
+    # Calculate metrics
+    sla_percentage = (total_packages - state["breachedPackages"]) / total_packages * 100
+    temperature_compliance = 100 - (state["temperatureBreaches"] / total_packages * 100)
+    product_condition_rate = 100 - (state["gForceBreaches"] / total_packages * 100)
+    avg_delivery_time = round(25 + random.random() * 15, 1)  # Placeholder
+    customer_satisfaction = round(4.0 + random.random() * 0.8, 1)  # Placeholder
+
+    # Mean time from reading to alert, for alerts raised by the ingest path
+    mtt_detection = round(state["detectionSeconds"] / state["detections"]) if state["detections"] else 0
+
+    return {
+        "temperatureCompliance": round(temperature_compliance, 1),
+        "productConditionRate": round(product_condition_rate, 1),
+        "avgDeliveryTime": avg_delivery_time,
+        "customerSatisfaction": round(customer_satisfaction, 1),
+        "slaPercentage": round(sla_percentage, 1),
+        "mttDetection": mtt_detection,
+        "alertCount": state["activeAlerts"]
+    }
 
 
 @app.get("/api/kpis", response_model=KPIs)
-def get_kpis():
+async def get_kpis():
     """Get Key Performance Indicators"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Get total packages
-        cursor.execute("SELECT COUNT(DISTINCT package_id) FROM telemetry")
-        total_packages = cursor.fetchone()[0] or 1
-        
-        # Get packages with temperature issues
-        cursor.execute("SELECT COUNT(DISTINCT package_id) FROM telemetry WHERE temperature > 26.0")
-        temp_violations = cursor.fetchone()[0]
-        
-        # Get packages with g-force issues
-        cursor.execute("SELECT COUNT(DISTINCT package_id) FROM telemetry WHERE g_force > 2.5")
-        gforce_violations = cursor.fetchone()[0]
-        
-        # Calculate metrics
-        packages_with_issues = temp_violations + gforce_violations
-        sla_percentage = ((total_packages - packages_with_issues) / total_packages) * 100 if total_packages > 0 else 100
-        temperature_compliance = 100 - (temp_violations / total_packages * 100) if total_packages > 0 else 100
-        avg_delivery_time = round(25 + random.random() * 15, 1)  # Placeholder
-        product_condition_rate = round(94 + random.random() * 5, 1)  # Placeholder
-        customer_satisfaction = round(4.0 + random.random() * 0.8, 1)  # Placeholder
-        
-        # Get active alerts count
-        cursor.execute("SELECT COUNT(*) FROM alerts WHERE is_resolved = 0 OR is_resolved IS NULL")
-        active_alerts = cursor.fetchone()[0]
-        
-        return KPIs(
-            temperatureCompliance=round(temperature_compliance, 1),
-            productConditionRate=round(product_condition_rate, 1),
-            avgDeliveryTime=avg_delivery_time,
-            customerSatisfaction=round(customer_satisfaction, 1),
-            slaPercentage=round(sla_percentage, 1),
-            mttDetection=30,  # Placeholder
-            alertCount=active_alerts
-        )
-    finally:
-        conn.close()
+    return FastJSONResponse(await run_read(compute_kpis))
+
+
+def read_alerts(conn):
+    """The ten most recent unresolved alerts"""
+    return [alert_record(alert) for alert in store.active_alerts(conn, 10)]
 
 
 @app.get("/api/alerts", response_model=List[Alert])
-def get_alerts():
+async def get_alerts():
     """Get active alerts"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("""
-            SELECT * FROM alerts 
-            WHERE is_resolved = 0 OR is_resolved IS NULL
-            ORDER BY timestamp DESC 
-            LIMIT 10
-        """)
-        alerts = cursor.fetchall()
-        
-        result = []
-        for alert in alerts:
-            # Format timestamp to match expected format
-            try:
-                # Try to parse the timestamp and format it properly
-                dt = datetime.fromisoformat(alert['timestamp'].replace('Z', '+00:00'))
-                formatted_time = dt.strftime("%H:%M:%S")
-            except:
-                formatted_time = alert['timestamp']
-                
-            result.append(Alert(
-                id=alert['id'],
-                packageId=alert['package_id'],
-                type=alert['alert_type'],
-                message=alert['message'],
-                timestamp=formatted_time,
-                severity=alert['severity']
-            ))
-        
-        return result
-    finally:
-        conn.close()
-
-
-@app.get("/api/location", response_model=List[LocationData])
-def get_location_data():
-    """Get location data for all packages"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Get latest location for each package
-        cursor.execute("""
-            SELECT t1.id, t1.package_id, t1.latitude, t1.longitude, t1.timestamp 
-            FROM telemetry t1
-            INNER JOIN (
-                SELECT package_id, MAX(timestamp) as max_timestamp
-                FROM telemetry
-                GROUP BY package_id
-            ) t2 ON t1.package_id = t2.package_id AND t1.timestamp = t2.max_timestamp
-            ORDER BY t1.timestamp DESC
-        """)
-        locations = cursor.fetchall()
-        
-        result = []
-        for loc in locations:
-            result.append(LocationData(
-                id=loc['id'],
-                packageId=loc['package_id'],
-                latitude=loc['latitude'],
-                longitude=loc['longitude'],
-                timestamp=loc['timestamp']
-            ))
-        
-        return result
-    finally:
-        conn.close()
-
-
-@app.get("/api/temperature", response_model=List[TemperatureData])
-def get_temperature_data():
-    """Get temperature history"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    return FastJSONResponse(await run_read(read_alerts))
+
+
+def parse_bbox_param(value):
+    """Parse a 'min_lng,min_lat,max_lng,max_lat' viewport (the order Leaflet's toBBoxString uses)"""
     try:
-        # Get recent temperature readings
-        cursor.execute("""
-            SELECT timestamp, temperature, package_id FROM telemetry 
-            ORDER BY timestamp DESC 
-            LIMIT 500
-        """)
-        temp_data = cursor.fetchall()
-        
-        result = []
-        for data in temp_data:
-            result.append(TemperatureData(
-                timestamp=data['timestamp'],
-                value=data['temperature'],
-                packageId=data['package_id']
-            ))
-        
-        return result
-    finally:
-        conn.close()
-
-
-@app.get("/api/gforce", response_model=List[GForceData])
-def get_gforce_data():
-    """Get g-force history"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+        min_lng, min_lat, max_lng, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {value}")
+    if min_lng > max_lng or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {value}")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def query_locations(conn, bbox=None):
+    """Latest position of every package, or only those inside a bbox"""
+    return store.latest(conn, bbox).fetchall()
+
+
+@app.get("/api/location", response_model=Union[List[LocationData], List[LocationCluster]])
+async def get_location_data(
+    bbox: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0),
+    cluster: bool = False,
+    zoom: Optional[int] = Query(None, ge=0, le=22)
+):
+    """
+    Get the latest location of each package, optionally limited to a viewport
+    (bbox) or to a radius around a point, and optionally grid-clustered for
+    a map zoom level
+    """
+    radius_params = (lat, lng, radius_km)
+    if any(param is not None for param in radius_params) and None in radius_params:
+        raise HTTPException(status_code=400, detail="lat, lng and radius_km must be given together")
+    if bbox is not None and radius_km is not None:
+        raise HTTPException(status_code=400, detail="Use either bbox or lat/lng/radius_km, not both")
+    if cluster and zoom is None:
+        raise HTTPException(status_code=400, detail="cluster=true requires zoom")
+
+    if radius_km is not None:
+        area = bbox_for_radius(lat, lng, radius_km)
+    else:
+        area = parse_bbox_param(bbox) if bbox is not None else None
+
+    locations = await run_read(query_locations, area)
+
+    # Trim the radius prefilter's box to the circle
+    if radius_km is not None:
+        locations = [
+            loc for loc in locations
+            if haversine_km(lat, lng, loc['latitude'], loc['longitude']) <= radius_km
+        ]
+
+    if cluster:
+        clusters = cluster_locations(
+            ((loc['package_id'], loc['latitude'], loc['longitude']) for loc in locations), zoom
+        )
+        return FastJSONResponse(clusters)
+
+    return FastJSONResponse([
+        {
+            "id": loc['id'],
+            "packageId": loc['package_id'],
+            "latitude": loc['latitude'],
+            "longitude": loc['longitude'],
+            "timestamp": to_iso(loc['timestamp'])
+        }
+        for loc in locations
+    ])
+
+
+def read_route(conn, package_id, start, end):
+    """
+    Resolve the route's time range and read its positions in order. Returns
+    (start, end, rows), or None when the package is unknown.
+    """
+    # Default the range to end at the package's latest reading
+    if end is None:
+        end = store.latest_timestamp(conn, package_id)
+        if end is None:
+            return None
+    if start is None:
+        start = end - SERIES_DEFAULT_RANGE
+
+    return start, end, store.route(conn, package_id, start, end)
+
+
+@app.get("/api/packages/{package_id}/route", response_model=PackageRoute, response_model_exclude_none=True)
+async def get_package_route(
+    package_id: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    zoom: int = Query(ROUTE_DEFAULT_ZOOM, ge=0, le=22),
+    encoding: Optional[str] = None
+):
+    """
+    Get a package's GPS trace for a time range (by default the 24 hours up
+    to its latest reading), simplified with Douglas–Peucker to about one
+    screen pixel at `zoom`. `encoding=polyline` returns a Google encoded
+    polyline instead of a list of points.
+    """
+    if encoding is not None and encoding != 'polyline':
+        raise HTTPException(status_code=400, detail="encoding must be 'polyline'")
+
+    start = parse_timestamp_param('start', start)
+    end = parse_timestamp_param('end', end)
+
+    route_range = await run_read(read_route, package_id, start, end)
+    if route_range is None:
+        raise HTTPException(status_code=404, detail=f"Package {package_id} not found")
+    start, end, rows = route_range
+
+    keep = douglas_peucker([(row['longitude'], row['latitude']) for row in rows], route_tolerance(zoom))
+    route = PackageRoute(packageId=package_id, start=to_iso(start), end=to_iso(end), rawPoints=len(rows))
+
+    if encoding == 'polyline':
+        route.polyline = encode_polyline((rows[i]['latitude'], rows[i]['longitude']) for i in keep)
+    else:
+        route.points = [
+            RoutePoint(latitude=rows[i]['latitude'], longitude=rows[i]['longitude'], timestamp=to_iso(rows[i]['timestamp']))
+            for i in keep
+        ]
+
+    return route
+
+
+def parse_timestamp_param(name, value):
+    """Validate an ISO timestamp query parameter and convert it to UTC epoch milliseconds"""
+    if value is None:
+        return None
     try:
-        # Get recent g-force readings
-        cursor.execute("""
-            SELECT timestamp, g_force, package_id FROM telemetry 
-            ORDER BY timestamp DESC 
-            LIMIT 500
-        """)
-        gforce_data = cursor.fetchall()
-        
-        result = []
-        for data in gforce_data:
-            result.append(GForceData(
-                timestamp=data['timestamp'],
-                value=data['g_force'],
-                packageId=data['package_id']
-            ))
-        
-        return result
-    finally:
-        conn.close()
+        return to_epoch_ms(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} timestamp: {value}")
+
+
+def execute_history(conn, column, since_id=None, since=None, package_id=None, start=None, end=None, limit=HISTORY_LIMIT):
+    """
+    Run the history query for one telemetry column. Returns the rows (an
+    iterable the caller drains) and the newest telemetry id, read from the
+    same snapshot as the rows.
+    """
+    since = parse_timestamp_param('since', since)
+    start = parse_timestamp_param('start', start)
+    end = parse_timestamp_param('end', end)
+    return store.history(conn, column, since_id, since, package_id, start, end, limit)
+
+
+def next_history_cursor(since_id, since, limit, count, last_id, head):
+    """
+    A timestamp cursor resumes after its last row, whose (timestamp, id) the
+    client sends back as `since` and `since_id`. A full page of id cursor
+    results resumes after its last row; otherwise everything up to the head
+    has been seen.
+    """
+    if since is not None and count:
+        return last_id
+    if since_id is not None and count == limit:
+        return last_id
+    return head
+
+
+def query_history(conn, column, since_id=None, since=None, package_id=None, start=None, end=None, limit=HISTORY_LIMIT):
+    """
+    Fetch one telemetry column as a history series.
+
+    Without a cursor this returns the newest `limit` readings, newest first,
+    as before. With `since_id` (or `since`, paired with `since_id` to break
+    timestamp ties) it returns only readings after the cursor, oldest first,
+    so a client can keep appending. Returns the rows and the id cursor to send
+    next time.
+    """
+    rows, head = execute_history(conn, column, since_id, since, package_id, start, end, limit)
+    rows = list(rows)
+
+    last_id = rows[-1]['id'] if rows else None
+    return rows, next_history_cursor(since_id, since, limit, len(rows), last_id, head)
+
+
+def set_cursor_headers(headers, timestamps, next_cursor):
+    """Expose the next cursors without changing the list response schema"""
+    headers["X-Next-Cursor"] = str(next_cursor)
+    if timestamps:
+        headers["X-Next-Since"] = to_iso(max(timestamps))
+
+
+def resolve_series_range(conn, start, end):
+    """
+    Default an aggregated series to end at the newest reading and to cover
+    the 24 hours before `end`. Bounding both sides keeps the range on an index.
+    """
+    start = parse_timestamp_param('start', start)
+    end = parse_timestamp_param('end', end)
+
+    if end is None:
+        end = store.newest_timestamp(conn)
+    if start is None and end is not None:
+        start = end - SERIES_DEFAULT_RANGE
+
+    return start, end
+
+
+def query_buckets(conn, column, bucket, points, package_id=None, start=None, end=None):
+    """
+    Aggregate one telemetry column into min/max/avg/count per package per
+    time bucket. Reads the rollup tables, so ranges older than the raw
+    telemetry retention still return data; bucket=auto picks the resolution.
+    """
+    start, end = resolve_series_range(conn, start, end)
+    if bucket == 'auto':
+        bucket = choose_resolution(start, end, points)
+    if bucket not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"bucket must be auto or one of {', '.join(RESOLUTIONS)}")
+    resolution = RESOLUTIONS[bucket]
+    seconds = resolution["seconds"]
+
+    # Include the bucket that contains `start`
+    if start is not None:
+        start = bucket_floor(start, seconds)
+    rows = store.buckets(conn, column, resolution["table"], seconds, package_id, start, end)
+
+    return [
+        {
+            "timestamp": to_iso(row['bucket_start']),
+            "packageId": row['package_id'],
+            "min": row['min_value'],
+            "max": row['max_value'],
+            "avg": round(row['avg_value'], 3),
+            "count": row['count']
+        }
+        for row in rows
+    ]
+
+
+def query_downsampled(conn, column, points, package_id=None, start=None, end=None):
+    """Downsample each package's series to at most `points` readings with LTTB"""
+    start, end = resolve_series_range(conn, start, end)
+
+    series = {}
+    for row in store.series(conn, column, package_id, start, end):
+        series.setdefault(row['package_id'], []).append(row)
+
+    result = []
+    for rows in series.values():
+        xy = [(row['timestamp'], row[column]) for row in rows]
+        result.extend(rows[i] for i in lttb(xy, points))
+
+    # Newest first, like the raw history
+    result.sort(key=lambda row: row['timestamp'], reverse=True)
+    return result
+
+
+def get_columnar_series(conn, column, media_type, since_id, since, package_id, start, end, limit, downsample, points):
+    """Serve raw, cursor or downsampled history as columns, without a model per row"""
+    names = {"timestamp": "timestamp", column: "value", "package_id": "packageId"}
+    headers = {"Vary": "Accept"}
+
+    if downsample is not None:
+        rows = query_downsampled(conn, column, points, package_id, start, end)
+        columns = rows_to_columns(rows, names)
+    else:
+        rows, head = execute_history(conn, column, since_id, since, package_id, start, end, limit)
+        columns = read_columns(rows, {"id": "id", **names})
+        ids = columns.pop("id")
+        next_cursor = next_history_cursor(since_id, since, limit, len(ids), ids[-1] if ids else None, head)
+        set_cursor_headers(headers, columns["timestamp"], next_cursor)
+
+    return Response(encode_columns(iso_timestamps(columns), media_type), media_type=media_type, headers=headers)
+
+
+def read_series(conn, column, media_type, since_id, since, package_id, start, end, limit, bucket, downsample, points):
+    """Build a history response in raw, cursor, bucketed or downsampled mode"""
+    headers = {"Vary": "Accept"}
+
+    if bucket is not None:
+        return FastJSONResponse(query_buckets(conn, column, bucket, points, package_id, start, end),
+                                headers=headers)
+
+    if media_type is not None:
+        return get_columnar_series(conn, column, media_type, since_id, since, package_id,
+                                   start, end, limit, downsample, points)
+
+    if downsample is not None:
+        rows = query_downsampled(conn, column, points, package_id, start, end)
+    else:
+        rows, next_cursor = query_history(conn, column, since_id, since, package_id, start, end, limit)
+        set_cursor_headers(headers, [row['timestamp'] for row in rows], next_cursor)
+
+    return FastJSONResponse([
+        {"timestamp": to_iso(row['timestamp']), "value": row[column], "packageId": row['package_id']}
+        for row in rows
+    ], headers=headers)
+
+
+async def get_series(column, request, since_id, since, package_id, start, end, limit, bucket, downsample, points):
+    """Serve a history endpoint in raw, cursor, bucketed or downsampled mode"""
+    if bucket is not None and downsample is not None:
+        raise HTTPException(status_code=400, detail="bucket and downsample cannot be combined")
+    if downsample is not None and downsample != 'lttb':
+        raise HTTPException(status_code=400, detail="downsample must be 'lttb'")
+
+    media_type = negotiate_format(request.headers.get('accept'))
+    return await run_read(read_series, column, media_type, since_id, since, package_id,
+                          start, end, limit, bucket, downsample, points)
+
+
+@app.get("/api/temperature", response_model=Union[List[TemperatureData], List[SeriesBucket]])
+async def get_temperature_data(
+    request: Request,
+    since_id: Optional[int] = None,
+    since: Optional[str] = None,
+    package_id: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = Query(HISTORY_LIMIT, ge=1, le=MAX_HISTORY_LIMIT),
+    bucket: Optional[str] = None,
+    downsample: Optional[str] = None,
+    points: int = Query(SERIES_DEFAULT_POINTS, ge=3, le=MAX_HISTORY_LIMIT)
+):
+    """Get temperature history: raw, after a cursor, bucketed or LTTB-downsampled"""
+    return await get_series('temperature', request, since_id, since, package_id,
+                            start, end, limit, bucket, downsample, points)
+
+
+@app.get("/api/gforce", response_model=Union[List[GForceData], List[SeriesBucket]])
+async def get_gforce_data(
+    request: Request,
+    since_id: Optional[int] = None,
+    since: Optional[str] = None,
+    package_id: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = Query(HISTORY_LIMIT, ge=1, le=MAX_HISTORY_LIMIT),
+    bucket: Optional[str] = None,
+    downsample: Optional[str] = None,
+    points: int = Query(SERIES_DEFAULT_POINTS, ge=3, le=MAX_HISTORY_LIMIT)
+):
+    """Get g-force history: raw, after a cursor, bucketed or LTTB-downsampled"""
+    return await get_series('g_force', request, since_id, since, package_id,
+                            start, end, limit, bucket, downsample, points)
+
+
+def poll_stream_deltas(stream_cursor):
+    """
+    Collect telemetry, alert and KPI changes since the stream cursor and
+    advance it. Runs once per producer tick no matter how many dashboards
+    are subscribed.
+    """
+    with get_db_connection() as conn:
+        telemetry_head = store.telemetry_head(conn)
+        alerts_head = store.alerts_head(conn)
+
+        # First tick only records where the stream starts and which alerts are open
+        if not stream_cursor:
+            open_alerts = {alert['id'] for alert in store.active_alerts(conn, STREAM_OPEN_ALERTS)}
+            stream_cursor.update(telemetry=telemetry_head, alerts=alerts_head, open_alerts=open_alerts)
+            return []
+
+        deltas = []
+        if telemetry_head > stream_cursor['telemetry']:
+            records = store.telemetry_since(conn, stream_cursor['telemetry'], STREAM_BATCH_LIMIT)
+            # Rows past the cursor may already be gone to retention
+            stream_cursor['telemetry'] = records[-1]['id'] if records else telemetry_head
+            if records:
+                deltas.append(("telemetry", [telemetry_record(record) for record in records]))
+
+        open_alerts = stream_cursor['open_alerts']
+        if alerts_head > stream_cursor['alerts']:
+            alerts = store.alerts_since(conn, stream_cursor['alerts'], STREAM_BATCH_LIMIT)
+            # Resolved alerts are skipped, so only a full page stops short of the head
+            if len(alerts) == STREAM_BATCH_LIMIT:
+                stream_cursor['alerts'] = alerts[-1]['id']
+            else:
+                stream_cursor['alerts'] = max(alerts_head, alerts[-1]['id'] if alerts else 0)
+            if alerts:
+                deltas.append(("alerts", [alert_record(alert) for alert in alerts]))
+                open_alerts.update(alert['id'] for alert in alerts)
+                if len(open_alerts) > STREAM_OPEN_ALERTS:
+                    stream_cursor['open_alerts'] = open_alerts = set(sorted(open_alerts)[-STREAM_OPEN_ALERTS:])
+
+        if open_alerts:
+            resolved = store.resolved_alerts(conn, sorted(open_alerts))
+            if resolved:
+                open_alerts.difference_update(resolved)
+                deltas.append(("resolved", resolved))
+
+        # KPIs only change when new rows arrive
+        if deltas:
+            deltas.append(("kpis", compute_kpis(conn)))
+
+        return deltas
+
+
+broadcaster = StreamBroadcaster(poll_stream_deltas)
+
+
+@app.get("/api/stream")
+async def stream_updates(request: Request):
+    """Push telemetry, alert and KPI deltas to the dashboard as Server-Sent Events"""
+    return StreamingResponse(
+        broadcaster.events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/stream/metrics")
+def get_stream_metrics():
+    """Get subscriber count and producer state of the push stream"""
+    return broadcaster.metrics()
+
+
+@app.on_event("startup")
+def init_database():
+    """Apply any pending schema migrations"""
+    run_migrations(DB_FILE)
+
+
+@app.on_event("startup")
+def start_mqtt_ingest():
+    """Start the embedded MQTT ingestion worker when a broker is configured"""
+    global mqtt_worker
+    if not MQTT_BROKER:
+        return
+
+    from mqtt_ingest import TelemetryIngestWorker
+    mqtt_worker = TelemetryIngestWorker(db_file=DB_FILE, broker=MQTT_BROKER, port=MQTT_PORT, topic=MQTT_TOPIC,
+                                        store=store, capture=capture)
+    mqtt_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_mqtt_ingest():
+    """Drain the embedded MQTT ingestion worker"""
+    if mqtt_worker is not None:
+        mqtt_worker.stop()
+
+
+@app.on_event("shutdown")
+def close_database():
+    """Stop the reader threads and close every pooled database connection"""
+    reader_pool.shutdown()
+    db_pool.close_all()
+    store.close()
+    data_version.close()
+    if capture is not None:
+        capture.close()
+
+
+@app.get("/api/cache/metrics")
+def get_cache_metrics():
+    """Get hit, miss, 304 and eviction counts of the response cache"""
+    return response_cache.metrics()
+
+
+@app.get("/api/db/metrics")
+def get_db_metrics():
+    """Get saturation, wait times, timeouts and cancellations of the reader pool"""
+    return {**reader_pool.metrics(), "connections": db_pool.size()}
+
+
+@app.get("/api/ingest/metrics")
+def get_ingest_metrics():
+    """Get queue depth and backpressure metrics of the embedded MQTT worker"""
+    if mqtt_worker is None:
+        return {"running": False}
+    return mqtt_worker.metrics()
 
 
 @app.get("/")
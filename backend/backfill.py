@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Bulk telemetry backfill for capacity testing
+
+Generates a fleet's history column by column with NumPy and streams it into
+the configured storage backend in large chunks:
+
+- GPS positions follow a random walk from a start point around Madrid;
+- temperature reverts to 21 °C with noise, plus heat excursions of a few
+  readings each;
+- g-force stays near 1 G, with occasional impacts of 2.6-4.0 G;
+- batteries drain faster as they empty and are swapped for a full one at 5%.
+
+populate_database.py goes through the ingest path, which updates the latest
+state, KPIs and every rollup once per reading. The backfill instead writes
+each chunk's readings to its day partitions with one executemany. Latest
+state, KPIs and rollups are aggregated per chunk with NumPy and merged in
+one statement per package or bucket. Alerts come from the same rule engine
+as ingest (--no-alerts skips it); they have no detected_at, so they do not
+count towards the time-to-detection KPI.
+
+    python backfill.py --days 30 --packages 10000 --interval 300 --seed 42
+
+Requires numpy. The next cleanup drops raw telemetry older than
+CHISIFAI_RAW_RETENTION_HOURS, so raise it to keep a long backfill.
+"""
+
+import argparse
+import sqlite3
+import time
+
+import db
+from ingest import write_alerts
+from migrations import kpi_package_merge, latest_upsert, rollup_merge, run_migrations
+from rollups import ROLLUP_TABLES
+from rules import GFORCE_THRESHOLD, TEMPERATURE_THRESHOLD, RuleEngine
+from storage import TELEMETRY_FIELDS, open_store
+from timestamps import DAY_MS, MILLISECOND, day_of, now_ms, to_epoch_ms
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Database configuration
+DB_FILE = db.DB_FILE
+
+# Backfill defaults
+DEFAULT_DAYS = 30
+DEFAULT_PACKAGES = 1000
+DEFAULT_INTERVAL = 300  # seconds between a package's readings
+DEFAULT_CHUNK_SIZE = 200000  # readings per transaction
+PROGRESS_INTERVAL = 10.0  # seconds between progress lines
+
+# Generation model
+START_LAT, START_LNG = 40.4168, -3.7038  # Madrid
+START_SPREAD = 0.1  # degrees around the start point
+GPS_STEP = 0.0005  # standard deviation of each move, in degrees
+BASE_TEMPERATURE = 21.0
+TEMPERATURE_REVERSION = 0.9  # share of the deviation kept from one reading to the next
+TEMPERATURE_NOISE = 0.3
+HEAT_PROBABILITY = 0.001  # chance per reading that a heat excursion starts
+HEAT_MEAN_READINGS = 6
+HEAT_RISE = (6.0, 12.0)  # °C above the normal temperature during an excursion
+GFORCE_NOISE = 0.08
+IMPACT_PROBABILITY = 0.002
+IMPACT_RANGE = (2.6, 4.0)
+BATTERY_DRAIN = (0.005, 0.02)  # % per reading, drawn per package
+BATTERY_LOW = 20.0  # below this the drain triples
+BATTERY_SWAP = 5.0
+SIGNAL_RANGE = (-80, -40)
+
+
+def generate_chunks(packages, days, interval, chunk_size, end, seed=None):
+    """
+    Yield the fleet's readings as (steps, packages) NumPy arrays, oldest
+    step first, in chunks of about chunk_size readings. Every package
+    reports once per step at its own fixed offset within the interval, so
+    a package's readings are in time order within and across chunks.
+    """
+    rng = np.random.default_rng(seed)
+    interval_ms = interval * 1000
+    steps = days * 86400 // interval
+    start = end - steps * interval_ms
+    steps_per_chunk = max(1, chunk_size // packages)
+
+    # Per-package state carried from one step to the next
+    offsets = rng.integers(0, interval_ms, packages)
+    lat = START_LAT + (rng.random(packages) - 0.5) * START_SPREAD
+    lng = START_LNG + (rng.random(packages) - 0.5) * START_SPREAD
+    deviation = rng.normal(0, TEMPERATURE_NOISE, packages)
+    heat_left = np.zeros(packages, dtype=np.int64)
+    heat_rise = np.zeros(packages)
+    battery = 100 - rng.random(packages) * 20
+    drain = rng.uniform(*BATTERY_DRAIN, packages)
+
+    for first in range(0, steps, steps_per_chunk):
+        count = min(steps_per_chunk, steps - first)
+        chunk = {
+            "timestamp": start + (np.arange(first, first + count) * interval_ms)[:, None] + offsets,
+            "latitude": np.empty((count, packages)),
+            "longitude": np.empty((count, packages)),
+            "temperature": np.empty((count, packages)),
+            "g_force": np.empty((count, packages)),
+            "battery_level": np.empty((count, packages)),
+            "signal_strength": rng.integers(SIGNAL_RANGE[0], SIGNAL_RANGE[1] + 1, (count, packages)),
+        }
+        for step in range(count):
+            # Random-walk GPS
+            lat += rng.normal(0, GPS_STEP, packages)
+            lng += rng.normal(0, GPS_STEP, packages)
+
+            # Mean-reverting temperature with heat excursions
+            deviation = TEMPERATURE_REVERSION * deviation + rng.normal(0, TEMPERATURE_NOISE, packages)
+            starting = (heat_left == 0) & (rng.random(packages) < HEAT_PROBABILITY)
+            heat_left[starting] = rng.geometric(1 / HEAT_MEAN_READINGS, starting.sum())
+            heat_rise[starting] = rng.uniform(*HEAT_RISE, starting.sum())
+            heating = heat_left > 0
+            heat_left[heating] -= 1
+            temperature = BASE_TEMPERATURE + deviation + np.where(heating, heat_rise, 0.0)
+
+            # G-force around 1 G with occasional impacts
+            g_force = 1.0 + rng.normal(0, GFORCE_NOISE, packages)
+            impacts = rng.random(packages) < IMPACT_PROBABILITY
+            g_force[impacts] = rng.uniform(*IMPACT_RANGE, impacts.sum())
+
+            # Battery drain curve, faster when low, swapped when nearly empty
+            battery -= np.where(battery < BATTERY_LOW, drain * 3, drain)
+            battery[battery < BATTERY_SWAP] = 100.0
+
+            chunk["latitude"][step] = lat
+            chunk["longitude"][step] = lng
+            chunk["temperature"][step] = temperature
+            chunk["g_force"][step] = g_force
+            chunk["battery_level"][step] = battery
+
+        chunk["latitude"] = chunk["latitude"].round(6)
+        chunk["longitude"] = chunk["longitude"].round(6)
+        chunk["temperature"] = np.clip(chunk["temperature"], 15.0, 35.0).round(2)
+        chunk["g_force"] = np.clip(chunk["g_force"], 0.1, None).round(2)
+        chunk["battery_level"] = chunk["battery_level"].round(2)
+        yield chunk
+
+
+def aggregate_buckets(package_index, bucket, temperature, g_force):
+    """Min/max/sum/count per (package, bucket) of flat arrays, as positional rollup rows"""
+    order = np.lexsort((bucket, package_index))
+    package_index, bucket = package_index[order], bucket[order]
+    temperature, g_force = temperature[order], g_force[order]
+    starts = np.flatnonzero(np.r_[True, (package_index[1:] != package_index[:-1]) | (bucket[1:] != bucket[:-1])])
+    counts = np.diff(np.r_[starts, len(bucket)])
+    return (
+        package_index[starts], bucket[starts],
+        np.minimum.reduceat(temperature, starts), np.maximum.reduceat(temperature, starts),
+        np.add.reduceat(temperature, starts),
+        np.minimum.reduceat(g_force, starts), np.maximum.reduceat(g_force, starts),
+        np.add.reduceat(g_force, starts),
+        counts,
+    )
+
+
+def newest_where(condition, timestamps):
+    """Per package (column), the newest timestamp where condition holds, or None"""
+    newest = np.where(condition, timestamps, -1).max(axis=0)
+    return [None if value < 0 else value for value in newest.tolist()]
+
+
+def write_chunk(conn, store, package_ids, chunk, engine=None):
+    """
+    Write one generated chunk in a single transaction: raw readings to
+    their day partitions, then the aggregated latest state, KPIs, rollups
+    and the alerts the rule engine raised. Returns (readings, alerts).
+    """
+    steps, packages = chunk["timestamp"].shape
+    timestamps = chunk["timestamp"].ravel()
+    columns = {"package_id": package_ids * steps}
+    columns.update((field, chunk[field].ravel().tolist()) for field in TELEMETRY_FIELDS if field != "package_id")
+    rows = list(zip(*(columns[field] for field in TELEMETRY_FIELDS)))
+
+    cursor = conn.cursor()
+    written = []
+    first_id = None
+    alerts = 0
+    # evaluate() replaces the state of each key it touches, so a shallow copy restores it
+    saved_states = dict(engine.states) if engine is not None else None
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        first_id = store.telemetry_head(conn) + 1
+        readings = [dict(zip(TELEMETRY_FIELDS, row), id=first_id + i) for i, row in enumerate(rows)]
+
+        # A chunk usually falls within one day; split it where it does not
+        days = timestamps // DAY_MS
+        for day in np.unique(days).tolist():
+            selected = readings if days[0] == days[-1] else [readings[i] for i in np.flatnonzero(days == day).tolist()]
+            written.append(store.write_partition(conn, day_of(day * DAY_MS), selected))
+
+        # Each package's newest reading is in the chunk's last step
+        cursor.executemany(latest_upsert(":"), readings[-packages:])
+
+        cursor.executemany(kpi_package_merge(), zip(
+            package_ids,
+            chunk["timestamp"][-1].tolist(),
+            newest_where(chunk["temperature"] > TEMPERATURE_THRESHOLD, chunk["timestamp"]),
+            newest_where(chunk["g_force"] > GFORCE_THRESHOLD, chunk["timestamp"]),
+        ))
+
+        # Only the part of the chunk each rollup still retains
+        package_index = np.tile(np.arange(packages), steps)
+        now = now_ms()
+        for table, seconds, retention in ROLLUP_TABLES:
+            kept = timestamps >= now - retention // MILLISECOND
+            if not kept.any():
+                continue
+            bucket_ms = seconds * 1000
+            aggregated = aggregate_buckets(package_index[kept], timestamps[kept] // bucket_ms * bucket_ms,
+                                           chunk["temperature"].ravel()[kept], chunk["g_force"].ravel()[kept])
+            cursor.executemany(rollup_merge(table), zip(
+                [package_ids[i] for i in aggregated[0].tolist()], *(column.tolist() for column in aggregated[1:])
+            ))
+
+        # One step at a time, so alerts that clear are resolved at that
+        # step's time. Backfilled alerts were never detected live, so they
+        # carry no detected_at.
+        if engine is not None:
+            engine.load_open_alerts(cursor)
+            for step in range(steps):
+                opened, resolved, changes = engine.evaluate(rows[step * packages:(step + 1) * packages], None)
+                write_alerts(cursor, opened, resolved, int(chunk["timestamp"][step].max()))
+                engine.apply(changes)
+                alerts += len(opened)
+
+        cursor.execute("UPDATE telemetry_sequence SET last_id = ? WHERE id = 1", (readings[-1]["id"],))
+        cursor.execute("COMMIT")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        store.discard(written, first_id)
+        if engine is not None:
+            engine.states = saved_states
+        raise
+
+    return len(rows), alerts
+
+
+def backfill(db_file=DB_FILE, packages=DEFAULT_PACKAGES, days=DEFAULT_DAYS, interval=DEFAULT_INTERVAL,
+             chunk_size=DEFAULT_CHUNK_SIZE, end=None, seed=None, alerts=True, store=None):
+    """
+    Generate and store `days` of readings for `packages` packages ending at
+    `end` (epoch ms, default now). Returns the rows and alerts written and
+    the seconds spent generating and writing.
+    """
+    store = store or open_store()
+    end = end if end is not None else now_ms()
+    package_ids = [f"PKG-{i + 1:05d}" for i in range(packages)]
+    engine = RuleEngine() if alerts else None
+    total_rows = int(days * 86400 // interval) * packages
+
+    conn = db.connect(db_file, isolation_level=None)
+    result = {"rows": 0, "alerts": 0, "generateSeconds": 0.0, "writeSeconds": 0.0}
+    started = last_report = time.perf_counter()
+    try:
+        chunks = generate_chunks(packages, days, interval, chunk_size, end, seed)
+        while True:
+            generating = time.perf_counter()
+            chunk = next(chunks, None)
+            writing = time.perf_counter()
+            result["generateSeconds"] += writing - generating
+            if chunk is None:
+                break
+
+            rows, raised = write_chunk(conn, store, package_ids, chunk, engine)
+            result["rows"] += rows
+            result["alerts"] += raised
+            result["writeSeconds"] += time.perf_counter() - writing
+
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                print(f"  {result['rows']:,} / {total_rows:,} readings "
+                      f"({result['rows'] / (last_report - started):,.0f} rows/s)")
+    finally:
+        conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai bulk telemetry backfill')
+    parser.add_argument('--db', default=DB_FILE,
+                        help=f'Database file (default: {DB_FILE})')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help=f'Days of history to generate (default: {DEFAULT_DAYS})')
+    parser.add_argument('--packages', type=int, default=DEFAULT_PACKAGES,
+                        help=f'Packages in the fleet (default: {DEFAULT_PACKAGES})')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL,
+                        help=f'Seconds between readings of a package (default: {DEFAULT_INTERVAL})')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'Readings per transaction (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--end',
+                        help='ISO 8601 timestamp the history ends at (default: now)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for a reproducible dataset')
+    parser.add_argument('--no-alerts', action='store_true',
+                        help='Skip the rule engine and write telemetry only')
+
+    args = parser.parse_args()
+
+    if np is None:
+        print("✗ The backfill requires numpy (pip install numpy)")
+        return
+    if args.days <= 0 or args.packages <= 0 or args.interval <= 0:
+        parser.error("--days, --packages and --interval must be positive")
+
+    run_migrations(args.db)
+
+    print(f"Backfilling {args.days} days of readings every {args.interval} s for {args.packages} packages...")
+    result = backfill(args.db, args.packages, args.days, args.interval, args.chunk_size,
+                      to_epoch_ms(args.end) if args.end else None, args.seed, not args.no_alerts)
+
+    elapsed = result["generateSeconds"] + result["writeSeconds"]
+    print(f"✓ Inserted {result['rows']:,} telemetry records and {result['alerts']:,} alerts in {elapsed:.1f} s: "
+          f"{result['rows'] / elapsed:,.0f} rows/s")
+    print(f"✓ Generation {result['generateSeconds']:.1f} s "
+          f"({result['rows'] / max(result['generateSeconds'], 1e-9):,.0f} rows/s), "
+          f"writes {result['writeSeconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Response cache for the read endpoints
+
+Responses are cached by path, query string and Accept header, and tagged
+with the data version they were built from. The data version combines a
+counter that the ingest path bumps and SQLite's PRAGMA data_version, which
+changes whenever another connection (the MQTT worker, populate_database.py)
+commits. Any write therefore invalidates every entry at once.
+
+Each cached response carries an ETag derived from the same version, so a
+poll with a matching If-None-Match gets a 304 without running a query or
+serialising anything.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import Response
+
+import db
+
+
+# Configuration
+CACHE_MAX_ENTRIES = int(os.getenv('CHISIFAI_CACHE_MAX_ENTRIES', '256'))
+
+
+class DataVersion:
+    """Changes whenever the database content may have changed"""
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file
+        self.counter = 0
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def bump(self):
+        with self.lock:
+            self.counter += 1
+
+    def current(self):
+        with self.lock:
+            if self.conn is None:
+                self.conn = db.connect(self.db_file, check_same_thread=False)
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            return f"{self.counter}.{data_version}"
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class ResponseCache:
+    """Size-bounded LRU of response bodies, valid for a single data version"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "notModified": 0, "evictions": 0}
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, body, headers):
+        with self.lock:
+            self.entries[key] = (version, body, headers)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def not_modified(self):
+        with self.lock:
+            self.stats["notModified"] += 1
+
+    def metrics(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "maxEntries": self.max_entries}
+
+
+def make_etag(key, version):
+    digest = hashlib.blake2b(repr((key, version)).encode(), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """Serve GET requests under `paths` from the cache, or 304 when the ETag still matches"""
+
+    def __init__(self, app, cache, version, paths):
+        super().__init__(app)
+        self.cache = cache
+        self.version = version
+        self.paths = tuple(paths)
+
+    async def dispatch(self, request, call_next):
+        if request.method != "GET" or not request.url.path.startswith(self.paths):
+            return await call_next(request)
+
+        key = (request.url.path, str(request.query_params), request.headers.get("accept", ""))
+        version = self.version.current()
+        etag = make_etag(key, version)
+
+        # Unchanged since the client's copy: no query, no serialisation
+        if etag in request.headers.get("if-none-match", ""):
+            self.cache.not_modified()
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+        cached = self.cache.get(key, version)
+        if cached is not None:
+            body, headers = cached
+            return Response(body, headers=headers)
+
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        headers["ETag"] = etag
+        headers["Cache-Control"] = "no-cache"
+        self.cache.put(key, version, body, headers)
+        return Response(body, headers=headers)
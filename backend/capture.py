@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Record and replay telemetry traffic
+
+With CHISIFAI_CAPTURE_DIR set, the MQTT ingestion worker and the API ingest
+endpoints append every message they receive to a gzip-compressed NDJSON file
+per UTC day and writer session (capture-YYYY-MM-DD.N.ndjson.gz, N counting
+the sessions of that day), one line per message:
+
+    {"t": <received, epoch ms>, "topic": "chisifai/trackers/telemetry", "payload": "<message>"}
+
+MQTT messages are recorded as received; readings posted over HTTP are
+recorded one per line with no topic. Payloads that are not UTF-8 are stored
+base64-encoded under "payload64". A writer never appends to a file an
+earlier session left behind, so a crash can only truncate its own segment,
+and the reader keeps every record before a truncated or corrupt block.
+
+The replayer streams captures back, keeping the original gaps between
+messages divided by --speed, to an MQTT broker or to the batch ingest
+endpoint. Files are read line by line, so captures of any size replay in
+constant memory:
+
+    python capture.py --replay 'captures/capture-2024-03-01.*.ndjson.gz' --speed 100 --broker localhost
+    python capture.py --replay captures/*.ndjson.gz --speed 10 --url http://localhost:8001
+"""
+
+import argparse
+import base64
+import glob
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+from serialization import dumps
+from timestamps import day_of, now_ms, parse_epoch_ms, to_iso
+from wire_format import BINARY_FORMATS, decode_rows, format_of, row_to_reading, shift_timestamps
+
+
+# Capture configuration
+CAPTURE_DIR = os.getenv('CHISIFAI_CAPTURE_DIR')
+CAPTURE_PREFIX = "capture-"
+CAPTURE_SUFFIX = ".ndjson.gz"
+CAPTURE_NAME = re.compile(r"capture-(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.ndjson\.gz$")
+READ_CHUNK = 1 << 16  # compressed bytes read at a time
+FLUSH_INTERVAL = 1.0  # seconds of traffic a crash can lose
+
+# Replay configuration
+DEFAULT_BROKER = "localhost"
+DEFAULT_PORT = 1883
+DEFAULT_TOPIC = "chisifai/trackers/telemetry"
+MAX_BATCH = 5000  # readings per HTTP request when replay falls behind
+LAG_SAMPLE_SIZE = 100000  # lags kept for percentiles, whatever the capture size
+PERCENTILES = (50, 90, 99)
+
+
+class CaptureWriter:
+    """Append received messages to one capture file per UTC day; safe to share between threads"""
+
+    def __init__(self, directory=CAPTURE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.file = None
+        self.day = None
+        self.flushed_at = 0.0
+        self.records = 0
+
+    def path(self, day):
+        """A segment of `day` no earlier session has written to"""
+        existing = glob.glob(os.path.join(glob.escape(self.directory), f"{CAPTURE_PREFIX}{day}.*{CAPTURE_SUFFIX}"))
+        segment = max((capture_sort_key(path)[1] for path in existing), default=0) + 1
+        return os.path.join(self.directory, f"{CAPTURE_PREFIX}{day}.{segment}{CAPTURE_SUFFIX}")
+
+    def record(self, payload, topic=None, received=None):
+        """Append one message (bytes or str) received at `received` (epoch ms, default now)"""
+        received = received if received is not None else now_ms()
+        line = {"t": received, "topic": topic}
+        if isinstance(payload, str):
+            line["payload"] = payload
+        else:
+            try:
+                line["payload"] = payload.decode('utf-8')
+            except UnicodeDecodeError:
+                line["payload64"] = base64.b64encode(payload).decode('ascii')
+        data = dumps(line) + b"\n"
+
+        with self.lock:
+            day = day_of(received)
+            if day != self.day:
+                if self.file is not None:
+                    self.file.close()
+                os.makedirs(self.directory, exist_ok=True)
+                self.file = gzip.open(self.path(day), "xb")
+                self.day = day
+            self.file.write(data)
+            self.records += 1
+
+            if time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed_at = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.day = None
+
+
+def open_capture():
+    """The process's capture writer, or None when CHISIFAI_CAPTURE_DIR is not set"""
+    return CaptureWriter(CAPTURE_DIR) if CAPTURE_DIR else None
+
+
+def read_lines(path):
+    """
+    Yield the complete lines of a gzip file, one member after another,
+    stopping at a truncated or corrupt block instead of raising, so a
+    segment cut short by a crash still replays up to its last flush.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    started = False
+    pending = b""
+    with open(path, "rb") as f:
+        data = f.read(READ_CHUNK)
+        while data:
+            try:
+                pending += decompressor.decompress(data)
+            except zlib.error as e:
+                print(f"⚠ {path}: corrupt data, keeping the records before it ({e})")
+                return
+            started = True
+            if decompressor.eof:
+                # The next member, if any, starts right after the end of this one
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                started = False
+            else:
+                data = b""
+
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            yield from lines
+            if not data:
+                data = f.read(READ_CHUNK)
+
+    # Every record ends with a newline, so anything left over was cut off
+    if started or pending:
+        print(f"⚠ {path}: truncated, keeping the records before the cut")
+
+
+def read_capture(paths):
+    """Yield (received, topic, payload bytes) from capture files in order, one line at a time"""
+    for path in paths:
+        damaged = 0
+        for line in read_lines(path):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if "payload64" in record:
+                    payload = base64.b64decode(record["payload64"])
+                else:
+                    payload = record["payload"].encode('utf-8')
+                received, topic = record["t"], record.get("topic")
+            except (AttributeError, KeyError, TypeError, ValueError):
+                damaged += 1
+                continue
+            yield received, topic, payload
+        if damaged:
+            print(f"⚠ {path}: skipped {damaged} damaged records")
+
+
+def rebase_payload(payload, offset, topic=None):
+    """Shift the timestamp of every reading in a payload by `offset` milliseconds"""
+    fmt = format_of(topic or "")
+    if fmt in BINARY_FORMATS:
+        try:
+            return shift_timestamps(payload, fmt, offset)
+        except ValueError:
+            return payload
+
+    try:
+        items = json.loads(payload)
+    except (UnicodeDecodeError, ValueError):
+        return payload
+    for item in items if isinstance(items, list) else [items]:
+        if isinstance(item, dict):
+            timestamp = parse_epoch_ms(item.get("timestamp"))
+            if timestamp is not None:
+                item["timestamp"] = to_iso(timestamp + offset)
+    return dumps(items)
+
+
+class MqttTarget:
+    """Publish replayed messages to an MQTT broker"""
+
+    def __init__(self, broker=DEFAULT_BROKER, port=DEFAULT_PORT, topic=None, qos=1):
+        import paho.mqtt.client as mqtt
+
+        self.topic = topic
+        self.qos = qos
+        self.published = 0
+        self.acked = 0
+        self.failed = 0
+        self.client = mqtt.Client(client_id=f"chisifai_replay_{os.getpid()}")
+        self.client.on_publish = self.on_publish
+        self.client.connect(broker, port, 60)
+        self.client.loop_start()
+        self.success = mqtt.MQTT_ERR_SUCCESS
+
+    def on_publish(self, client, userdata, mid):
+        self.acked += 1
+
+    def send(self, records):
+        for _, topic, payload in records:
+            info = self.client.publish(self.topic or topic or DEFAULT_TOPIC, payload, qos=self.qos)
+            if info.rc == self.success:
+                self.published += 1
+            else:
+                self.failed += 1
+
+    def close(self, timeout=10.0):
+        """Wait for outstanding acks, then disconnect"""
+        deadline = time.monotonic() + timeout
+        while self.acked < self.published and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class HttpTarget:
+    """Post replayed readings to the batch ingest endpoint as NDJSON"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        connection = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.conn = connection(parts.hostname, parts.port)
+        self.path = parts.path.rstrip("/") + "/api/telemetry/batch"
+        self.published = 0
+        self.acked = 0
+        self.failed = 0
+
+    def send(self, records):
+        lines = []
+        for _, topic, payload in records:
+            # Binary payloads are posted as the JSON readings they decode to
+            fmt = format_of(topic or "")
+            if fmt in BINARY_FORMATS:
+                try:
+                    lines.extend(dumps(row_to_reading(row)) for row in decode_rows(payload, fmt))
+                    continue
+                except ValueError:
+                    pass
+
+            # An MQTT message can hold an array of readings; NDJSON wants one per line
+            if payload.lstrip().startswith(b"["):
+                try:
+                    lines.extend(dumps(item) for item in json.loads(payload))
+                    continue
+                except ValueError:
+                    pass
+            lines.append(payload)
+
+        for first in range(0, len(lines), MAX_BATCH):
+            batch = lines[first:first + MAX_BATCH]
+            self.conn.request("POST", self.path, body=b"\n".join(batch),
+                              headers={"Content-Type": "application/x-ndjson"})
+            response = self.conn.getresponse()
+            response.read()
+            self.published += len(batch)
+            if response.status < 400:
+                self.acked += len(batch)
+            else:
+                self.failed += len(batch)
+
+    def close(self):
+        self.conn.close()
+
+
+def replay(paths, target, speed=1.0, rebase=False, limit=None):
+    """
+    Send the messages of `paths` to `target`, each one (t - t0) / speed after
+    the start, where t0 is the first message's receive time. Messages that
+    fall due together are sent together. Returns counters and lag samples
+    (seconds each message went out after its due time).
+    """
+    stats = {"messages": 0, "elapsed": 0.0, "span": 0.0, "maxLag": 0.0, "lags": []}
+    sampler = random.Random(0)
+    group = []
+    first = None
+    offset = 0
+    start = time.perf_counter()
+
+    for received, topic, payload in read_capture(paths):
+        if limit is not None and stats["messages"] >= limit:
+            break
+        if first is None:
+            first = received
+            start = time.perf_counter()
+            # Readings keep their spacing but land around the replay start
+            offset = now_ms() - first
+
+        due = (received - first) / 1000 / speed
+        now = time.perf_counter() - start
+        if due > now:
+            if group:
+                target.send(group)
+                group = []
+            time.sleep(max(0.0, due - (time.perf_counter() - start)))
+            now = time.perf_counter() - start
+
+        # Reservoir sample of lags, so percentiles need constant memory
+        lag = max(0.0, now - due)
+        stats["maxLag"] = max(stats["maxLag"], lag)
+        if len(stats["lags"]) < LAG_SAMPLE_SIZE:
+            stats["lags"].append(lag)
+        else:
+            slot = sampler.randrange(stats["messages"] + 1)
+            if slot < LAG_SAMPLE_SIZE:
+                stats["lags"][slot] = lag
+
+        group.append((received, topic, rebase_payload(payload, offset, topic) if rebase else payload))
+        stats["messages"] += 1
+        stats["span"] = (received - first) / 1000
+        if len(group) >= MAX_BATCH:
+            target.send(group)
+            group = []
+
+    if group:
+        target.send(group)
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+
+def capture_sort_key(path):
+    """(day, segment) of a capture file, so segment 10 sorts after segment 9"""
+    match = CAPTURE_NAME.search(os.path.basename(path))
+    if match is None:
+        return os.path.basename(path), 0
+    return match.group(1), int(match.group(2) or 0)
+
+
+def capture_paths(patterns):
+    """Expand files and globs into capture files, oldest day and segment first"""
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(pattern) or [pattern])
+    return sorted(paths, key=capture_sort_key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai telemetry capture replay')
+    parser.add_argument('--replay', nargs='+', metavar='CAPTURE', required=True,
+                        help='Capture files (or globs) to replay, in day order')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed: 1 keeps the original timing, 10 or 100 compress it (default: 1)')
+    parser.add_argument('--broker',
+                        help='Publish to this MQTT broker')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'MQTT broker port (default: {DEFAULT_PORT})')
+    parser.add_argument('--topic',
+                        help=f'MQTT topic for every message (default: the recorded topic, or {DEFAULT_TOPIC})')
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1,
+                        help='MQTT QoS level (default: 1)')
+    parser.add_argument('--url',
+                        help='Post to the batch ingest endpoint of this API instead (e.g. http://localhost:8001)')
+    parser.add_argument('--rebase', action='store_true',
+                        help='Shift reading timestamps so the capture starts now, keeping their spacing')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Stop after this many messages')
+
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    if bool(args.broker) == bool(args.url):
+        parser.error("give either --broker or --url")
+
+    paths = capture_paths(args.replay)
+    if args.broker:
+        print(f"Replaying {len(paths)} capture file(s) at {args.speed:g}x to MQTT {args.broker}:{args.port}...")
+        target = MqttTarget(args.broker, args.port, args.topic, args.qos)
+    else:
+        print(f"Replaying {len(paths)} capture file(s) at {args.speed:g}x to {args.url}...")
+        target = HttpTarget(args.url)
+
+    try:
+        stats = replay(paths, target, args.speed, args.rebase, args.limit)
+    except KeyboardInterrupt:
+        print("\n⚠ Replay interrupted by user.")
+        return
+    finally:
+        target.close()
+
+    elapsed = max(stats["elapsed"], 1e-9)
+    lags = sorted(stats["lags"])
+    print(f"✓ Replayed {stats['messages']} messages spanning {stats['span']:.1f} s in {stats['elapsed']:.1f} s "
+          f"({stats['span'] / elapsed:.1f}x, {stats['messages'] / elapsed:.1f} msg/s)")
+    print(f"✓ Delivered {target.acked} of {target.published} sent")
+    if target.failed:
+        print(f"✗ {target.failed} messages rejected")
+    if lags:
+        print("Lag behind the original timing: " +
+              "  ".join(f"p{p} {lags[min(len(lags) - 1, len(lags) * p // 100)] * 1000:.1f} ms" for p in PERCENTILES) +
+              f"  max {stats['maxLag'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
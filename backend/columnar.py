@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Columnar response formats for bulk telemetry reads
+
+Clients that send one of these Accept types get the rows of a history or
+snapshot endpoint as columns instead of a list of objects:
+
+- application/vnd.chisifai.columns+json: a struct-of-arrays JSON object,
+  {"timestamp": [...], "value": [...], "packageId": [...]};
+- application/vnd.apache.arrow.stream: an Apache Arrow IPC stream
+  (requires pyarrow).
+
+Columns are built straight from the rows in batches, without creating a
+pydantic model per row. Compare with the row-model path with
+
+    python columnar.py --benchmark --rows 500 5000 50000
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import time
+from itertools import islice
+
+from serialization import dumps
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+# Media types
+COLUMNAR_JSON = "application/vnd.chisifai.columns+json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+# Rows fetched from the cursor per batch
+COLUMN_BATCH_SIZE = 1000
+
+
+def negotiate_format(accept):
+    """Return the columnar media type requested by an Accept header, or None for row JSON"""
+    if not accept:
+        return None
+    for part in accept.split(','):
+        media_type = part.split(';')[0].strip().lower()
+        if media_type == COLUMNAR_JSON:
+            return COLUMNAR_JSON
+        if media_type == ARROW_STREAM:
+            return ARROW_STREAM if pyarrow is not None else None
+    return None
+
+
+def read_columns(rows, names, batch_size=COLUMN_BATCH_SIZE):
+    """
+    Drain an executed cursor (or any iterable of sqlite3.Row) into a dict of
+    column lists. `names` maps result columns to output names; columns not
+    in it are skipped.
+    """
+    rows = iter(rows)
+    columns = {name: [] for name in names.values()}
+
+    indices = None
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        if indices is None:
+            indices = [(i, names[key]) for i, key in enumerate(batch[0].keys()) if key in names]
+        transposed = list(zip(*batch))
+        for i, name in indices:
+            columns[name].extend(transposed[i])
+
+    return columns
+
+
+def rows_to_columns(rows, names):
+    """Columns from rows that have already been fetched (e.g. after downsampling)"""
+    return {name: [row[key] for row in rows] for key, name in names.items()}
+
+
+def encode_columns(columns, media_type):
+    """Serialise a dict of columns in the negotiated format"""
+    if media_type == ARROW_STREAM:
+        table = pyarrow.table(columns)
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return dumps(columns)
+
+
+def benchmark(row_counts=(500, 5000, 50000), repeat=5):
+    """
+    Time the row-model path (pydantic model per row, then FastAPI's
+    jsonable_encoder and json.dumps) against the columnar encoders on an
+    in-memory telemetry partition. Returns {rows: {path: {seconds, bytes}}}.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from api_server import TemperatureData, iso_timestamps
+    from migrations import partition_day, partition_statements, partition_table
+    from timestamps import to_epoch_ms, to_iso
+
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    # One day partition with epoch-millisecond timestamps, read and formatted as the endpoints do
+    start = to_epoch_ms("2024-01-01T00:00:00Z")
+    table = partition_table(partition_day(start))
+    for statement in partition_statements(table):
+        conn.execute(statement)
+    conn.executemany(
+        f"INSERT INTO {table} (package_id, temperature, g_force, latitude, longitude, timestamp) "
+        "VALUES (?, ?, 1.0, 40.4, -3.7, ?)",
+        ((
+            f"PKG-{i % 50:03d}",
+            round(19 + random.random() * 4, 2),
+            start + i * 1000
+        ) for i in range(max(row_counts)))
+    )
+    names = {"timestamp": "timestamp", "temperature": "value", "package_id": "packageId"}
+    query = f"SELECT timestamp, temperature, package_id FROM {table} ORDER BY timestamp DESC LIMIT ?"
+
+    def rows_path(n):
+        rows = conn.execute(query, (n,)).fetchall()
+        models = [TemperatureData(timestamp=to_iso(r['timestamp']), value=r['temperature'], packageId=r['package_id'])
+                  for r in rows]
+        return json.dumps(jsonable_encoder(models)).encode()
+
+    def columnar_path(media_type):
+        def run(n):
+            return encode_columns(iso_timestamps(read_columns(conn.execute(query, (n,)), names)), media_type)
+        return run
+
+    paths = {"rows+pydantic": rows_path, "columns+json": columnar_path(COLUMNAR_JSON)}
+    if pyarrow is not None:
+        paths["arrow"] = columnar_path(ARROW_STREAM)
+
+    results = {}
+    for n in row_counts:
+        results[n] = {}
+        for name, run in paths.items():
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                size = len(run(n))
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[n][name] = {"seconds": best, "bytes": size}
+
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai columnar response formats')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare the row-model and columnar serialisation paths')
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000, 50000],
+                        help='Row counts to benchmark (default: 500 5000 50000)')
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    if pyarrow is None:
+        print("pyarrow not installed: skipping the Arrow path")
+    for n, paths in benchmark(args.rows).items():
+        baseline = paths["rows+pydantic"]["seconds"]
+        for name, result in paths.items():
+            print(f"{n:>7} rows  {name:<14} {result['seconds'] * 1000:9.2f} ms  "
+                  f"{result['bytes']:>10} bytes  x{baseline / result['seconds']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+SQLite connection management for the Chisifai backend
+
+Connections are opened once per thread and reused, with pragmas tuned for a
+concurrent reader/writer workload. Every setting can be overridden through
+environment variables.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+# Database configuration
+DB_FILE = os.getenv('CHISIFAI_DB_FILE', 'chisifai.db')
+
+# WAL lets dashboard readers run while populate/ingest writers commit
+JOURNAL_MODE = os.getenv('CHISIFAI_SQLITE_JOURNAL_MODE', 'WAL')
+SYNCHRONOUS = os.getenv('CHISIFAI_SQLITE_SYNCHRONOUS', 'NORMAL')
+MMAP_SIZE = int(os.getenv('CHISIFAI_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+CACHE_SIZE = int(os.getenv('CHISIFAI_SQLITE_CACHE_SIZE', '-65536'))  # negative values are KiB
+BUSY_TIMEOUT = int(os.getenv('CHISIFAI_SQLITE_BUSY_TIMEOUT', '5000'))  # milliseconds
+
+# Dedicated reader threads for the async endpoints
+READER_THREADS = int(os.getenv('CHISIFAI_READER_THREADS', '8'))
+READER_QUEUE_SIZE = int(os.getenv('CHISIFAI_READER_QUEUE_SIZE', '64'))  # waiting reads before rejecting
+READ_TIMEOUT = float(os.getenv('CHISIFAI_READ_TIMEOUT', '10'))  # seconds
+
+
+class ReaderSaturated(Exception):
+    """Every reader thread is busy and the wait queue is full"""
+
+
+def connect(db_file=None, **kwargs):
+    """Open a SQLite connection with the configured pragmas applied"""
+    conn = sqlite3.connect(db_file or DB_FILE, timeout=BUSY_TIMEOUT / 1000, **kwargs)
+    conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Hands each thread its own long-lived connection. FastAPI runs sync
+    endpoints on a fixed set of worker threads, so this amounts to one
+    connection per worker instead of one per request.
+    """
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or DB_FILE
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def get(self):
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # The pool closes connections from the main thread on shutdown
+            conn = connect(self.db_file, check_same_thread=False)
+            conn.row_factory = sqlite3.Row  # This enables column access by name
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow the thread's connection, leaving no transaction open afterwards"""
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+    def size(self):
+        with self.lock:
+            return len(self.connections)
+
+    def close_all(self):
+        """Close every pooled connection"""
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+
+class ReadJob:
+    """One read running (or waiting to run) on a reader thread"""
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.conn = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Skip the job if it has not started, or interrupt its running query"""
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class ReaderPool:
+    """
+    Bounded pool of reader threads for async endpoints. Each thread keeps its
+    own connection from `connections`, so reads run concurrently under WAL
+    without competing with FastAPI's default threadpool. A read that times
+    out or whose request is cancelled is interrupted inside SQLite. Exceptions
+    of the `client_errors` types (bad request parameters) are counted apart
+    from failed reads.
+    """
+
+    def __init__(self, connections, threads=READER_THREADS, queue_size=READER_QUEUE_SIZE, timeout=READ_TIMEOUT,
+                 client_errors=()):
+        self.connections = connections
+        self.threads = threads
+        self.timeout = timeout
+        self.client_errors = tuple(client_errors)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="sqlite-reader")
+        # Reads admitted at once: one per thread plus the wait queue
+        self.slots = threading.BoundedSemaphore(threads + queue_size)
+        self.lock = threading.Lock()
+        self.stats = {
+            "inFlight": 0,
+            "active": 0,
+            "completed": 0,
+            "failed": 0,
+            "clientErrors": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "waitSeconds": 0.0,
+            "maxWaitSeconds": 0.0,
+        }
+
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.stats[key] += delta
+
+    def _execute(self, job, queued_at):
+        """Run a job on a reader thread with that thread's connection"""
+        waited = time.monotonic() - queued_at
+        with self.lock:
+            self.stats["waitSeconds"] += waited
+            self.stats["maxWaitSeconds"] = max(self.stats["maxWaitSeconds"], waited)
+
+        with self.connections.connection() as conn:
+            with job.lock:
+                if job.cancelled:
+                    return None
+                job.conn = conn
+            self._count("active")
+            try:
+                return job.fn(conn, *job.args)
+            finally:
+                self._count("active", -1)
+                with job.lock:
+                    job.conn = None
+
+    async def run(self, fn, *args, timeout=None):
+        """
+        Run `fn(conn, *args)` on a reader thread and await its result.
+
+        Raises ReaderSaturated when the wait queue is full, and
+        asyncio.TimeoutError when the read takes longer than `timeout`
+        seconds (the default is READ_TIMEOUT).
+        """
+        if not self.slots.acquire(blocking=False):
+            self._count("rejected")
+            raise ReaderSaturated()
+
+        job = ReadJob(fn, args)
+        self._count("inFlight")
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, self._execute, job, time.monotonic()
+            )
+            result = await asyncio.wait_for(future, timeout or self.timeout)
+            self._count("completed")
+            return result
+        except asyncio.TimeoutError:
+            job.cancel()
+            self._count("timeouts")
+            raise
+        except asyncio.CancelledError:
+            job.cancel()
+            self._count("cancelled")
+            raise
+        except self.client_errors:
+            self._count("clientErrors")
+            raise
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            self._count("inFlight", -1)
+            self.slots.release()
+
+    def metrics(self):
+        """Pool saturation: busy threads, queued reads and how long reads waited for a thread"""
+        with self.lock:
+            stats = dict(self.stats)
+        started = stats["completed"] + stats["failed"] + stats["clientErrors"] + stats["timeouts"] + stats["cancelled"]
+        wait_seconds = stats.pop("waitSeconds")
+        return {
+            **stats,
+            "threads": self.threads,
+            "waiting": max(stats["inFlight"] - stats["active"], 0),
+            "saturation": round(stats["active"] / self.threads, 2),
+            "avgWaitSeconds": round(wait_seconds / started, 4) if started else 0.0,
+            "maxWaitSeconds": round(stats["maxWaitSeconds"], 4),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
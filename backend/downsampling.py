@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Shape-preserving downsampling for chart series
+"""
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    `points` is a list of (x, y) pairs sorted by x. Returns the indices of the
+    points to keep: always the first and the last, plus one point per bucket
+    chosen to preserve the visual shape (peaks and troughs survive).
+    """
+    count = len(points)
+    if threshold >= count:
+        return list(range(count))
+    if threshold < 3:
+        return [0, count - 1][:threshold]
+
+    selected = [0]
+    # Every bucket except the first and last point
+    bucket_size = (count - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, count)
+        if next_start >= next_end:
+            next_start, next_end = count - 1, count
+        span = next_end - next_start
+        avg_x = sum(points[j][0] for j in range(next_start, next_end)) / span
+        avg_y = sum(points[j][1] for j in range(next_start, next_end)) / span
+
+        # Pick the point in this bucket with the largest triangle area
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        selected.append(best)
+        a = best
+
+    selected.append(count - 1)
+    return selected
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Ramer–Douglas–Peucker line simplification.
+
+    `points` is a list of (x, y) pairs in path order. Returns the indices of
+    the points to keep, in order: every dropped point lies within
+    `tolerance` of the simplified line.
+    """
+    count = len(points)
+    if count < 3:
+        return list(range(count))
+
+    keep = [False] * count
+    keep[0] = keep[count - 1] = True
+    # Explicit stack instead of recursion, so long traces cannot hit the recursion limit
+    stack = [(0, count - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first]
+        bx, by = points[last]
+        dx, dy = bx - ax, by - ay
+        length = (dx * dx + dy * dy) ** 0.5
+
+        # Farthest point from the segment first-last
+        max_distance = -1.0
+        farthest = first
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length == 0:
+                distance = ((x - ax) ** 2 + (y - ay) ** 2) ** 0.5
+            else:
+                distance = abs(dy * x - dx * y + bx * ay - by * ax) / length
+            if distance > max_distance:
+                max_distance = distance
+                farthest = i
+
+        if max_distance > tolerance:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [i for i in range(count) if keep[i]]
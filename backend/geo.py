@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Geospatial helpers for the map endpoints
+"""
+
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+# Packages closer than this many screen pixels are merged into one cluster
+CLUSTER_CELL_PIXELS = 60
+TILE_PIXELS = 256
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bbox_for_radius(lat, lng, radius_km):
+    """
+    Bounding box (min_lng, min_lat, max_lng, max_lat) that contains every
+    point within `radius_km` of the centre. Used as the index prefilter for
+    radius queries; the exact distance is checked afterwards.
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    # Near the poles any longitude can be within range
+    dlng = 180.0 if cos_lat < 1e-6 else min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+    return (
+        max(lng - dlng, -180.0),
+        max(lat - dlat, -90.0),
+        min(lng + dlng, 180.0),
+        min(lat + dlat, 90.0),
+    )
+
+
+def cluster_cell_degrees(zoom):
+    """Grid cell size in degrees for a web-map zoom level"""
+    return 360.0 / (2 ** zoom) * CLUSTER_CELL_PIXELS / TILE_PIXELS
+
+
+def cluster_locations(locations, zoom):
+    """
+    Grid-cluster (package_id, latitude, longitude) tuples for a zoom level.
+
+    Returns one dict per occupied cell with the centroid, the number of
+    packages and, for single-package cells, the package id.
+    """
+    cell = cluster_cell_degrees(zoom)
+    cells = {}
+    for package_id, lat, lng in locations:
+        key = (math.floor((lat + 90.0) / cell), math.floor((lng + 180.0) / cell))
+        acc = cells.get(key)
+        if acc is None:
+            cells[key] = [lat, lng, 1, package_id]
+        else:
+            acc[0] += lat
+            acc[1] += lng
+            acc[2] += 1
+
+    return [
+        {
+            "latitude": lat_sum / count,
+            "longitude": lng_sum / count,
+            "count": count,
+            "packageId": package_id if count == 1 else None,
+        }
+        for lat_sum, lng_sum, count, package_id in cells.values()
+    ]
+
+
+def route_tolerance(zoom, pixels=1.0):
+    """Simplification tolerance in degrees: `pixels` screen pixels at a zoom level"""
+    return 360.0 / (TILE_PIXELS * 2 ** zoom) * pixels
+
+
+def encode_polyline(coordinates, precision=5):
+    """Encode (latitude, longitude) pairs with Google's encoded polyline algorithm"""
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lng = 0
+
+    for lat, lng in coordinates:
+        lat_i = int(round(lat * factor))
+        lng_i = int(round(lng * factor))
+        # Each coordinate is stored as the difference from the previous one
+        for delta in (lat_i - prev_lat, lng_i - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lng = lat_i, lng_i
+
+    return ''.join(output)
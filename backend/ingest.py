@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Telemetry ingest helpers shared by the API server and the ingestion workers
+"""
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Optional
+
+from rules import RuleEngine
+from timestamps import to_epoch_ms
+
+
+# Alert rule engine shared by every batch written from this process
+_rule_engine = None
+
+
+class TelemetryReading(BaseModel):
+    """Telemetry reading as published by the trackers"""
+    # SQLite stores NaN as NULL, which the NOT NULL columns reject
+    model_config = ConfigDict(allow_inf_nan=False)
+
+    id: Optional[str] = None
+    packageId: str
+    temperature: float
+    gForce: float
+    latitude: float
+    longitude: float
+    timestamp: str
+    batteryLevel: Optional[float] = None
+    signalStrength: Optional[int] = Field(None, ge=-2 ** 63, le=2 ** 63 - 1)  # SQLite INTEGER range
+
+    @field_validator('timestamp')
+    @classmethod
+    def iso_timestamp(cls, value):
+        # Stored as UTC epoch milliseconds, so it must parse
+        try:
+            to_epoch_ms(value)
+        except ValueError:
+            raise ValueError("timestamp must be ISO 8601 (YYYY-MM-DDTHH:MM:SS[.fff][+HH:MM]) within years 1 to 9999")
+        return value
+
+
+def reading_to_row(reading):
+    """Convert a validated telemetry reading into a telemetry table row, normalised to UTC epoch milliseconds"""
+    return (
+        reading.packageId,
+        reading.temperature,
+        reading.gForce,
+        reading.latitude,
+        reading.longitude,
+        to_epoch_ms(reading.timestamp),
+        reading.batteryLevel,
+        reading.signalStrength
+    )
+
+
+def get_rule_engine():
+    """Return the process-wide alert rule engine, creating it on first use"""
+    global _rule_engine
+    if _rule_engine is None:
+        _rule_engine = RuleEngine()
+    return _rule_engine
+
+
+def write_alerts(cursor, alerts, resolved, resolved_at):
+    """Store the alerts a batch opened and close the ones it resolved"""
+    # Close first: a key resolved and reopened in the same batch must not
+    # collide with its old open alert
+    if resolved:
+        cursor.executemany('''
+            UPDATE alerts SET is_resolved = 1, resolved_at = ?
+            WHERE dedup_key = ? AND (is_resolved = 0 OR is_resolved IS NULL)
+        ''', [(resolved_at, key) for key in resolved])
+
+    # Another writer may already hold the open alert for a dedup key
+    if alerts:
+        cursor.executemany('''
+            INSERT OR IGNORE INTO alerts
+            (package_id, alert_type, message, timestamp, severity, detected_at, dedup_key, is_resolved, resolved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [alert + (resolved_at if alert[7] else None,) for alert in alerts])
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Incremental KPI state for the Chisifai dashboard
+
+Triggers created by migration 5 keep the single-row kpi_state table current
+as telemetry and alerts are written:
+
+- kpi_packages has one row per package with when it was last seen and when
+  it last breached the temperature or g-force threshold;
+- kpi_state counts distinct packages, breached packages, active alerts and
+  the accumulated time-to-detection of alerts raised by the ingest path.
+
+/api/kpis reads kpi_state in O(1). If the counters ever drift (for example
+after editing the database by hand), rebuild them with
+
+    python kpis.py --rebuild
+"""
+
+import argparse
+
+import db
+from rules import GFORCE_THRESHOLD, TEMPERATURE_THRESHOLD
+
+
+# Database configuration
+DB_FILE = db.DB_FILE
+
+# Recompute every counter from the telemetry and alerts tables. Inserting
+# into kpi_packages fires the same triggers that maintain the counters.
+REBUILD_STATEMENTS = [
+    "DELETE FROM kpi_packages",
+    '''
+    UPDATE kpi_state SET
+        packages = 0,
+        temperature_breaches = 0,
+        g_force_breaches = 0,
+        breached_packages = 0
+    ''',
+    f'''
+    INSERT INTO kpi_packages (package_id, last_seen, temperature_breach_at, g_force_breach_at)
+    SELECT package_id,
+           MAX(timestamp),
+           MAX(CASE WHEN temperature > {TEMPERATURE_THRESHOLD} THEN timestamp END),
+           MAX(CASE WHEN g_force > {GFORCE_THRESHOLD} THEN timestamp END)
+    FROM telemetry
+    GROUP BY package_id
+    ''',
+    '''
+    UPDATE kpi_state SET
+        active_alerts = (SELECT COUNT(*) FROM alerts WHERE is_resolved = 0 OR is_resolved IS NULL),
+        detection_seconds = (
+            SELECT COALESCE(SUM(detected_at - timestamp) / 1000.0, 0)
+            FROM alerts WHERE detected_at IS NOT NULL
+        ),
+        detections = (SELECT COUNT(*) FROM alerts WHERE detected_at IS NOT NULL)
+    ''',
+]
+
+
+def read_kpi_state(cursor):
+    """Return the KPI counters as a dict"""
+    cursor.execute('''
+        SELECT packages, temperature_breaches, g_force_breaches, breached_packages,
+               active_alerts, detection_seconds, detections
+        FROM kpi_state WHERE id = 1
+    ''')
+    row = cursor.fetchone()
+    return {
+        "packages": row[0],
+        "temperatureBreaches": row[1],
+        "gForceBreaches": row[2],
+        "breachedPackages": row[3],
+        "activeAlerts": row[4],
+        "detectionSeconds": row[5],
+        "detections": row[6],
+    }
+
+
+def expire_kpis(cursor, cutoff):
+    """
+    Drop packages and breaches older than the raw retention cutoff, so the
+    KPIs cover the same window as the retained telemetry
+    """
+    cursor.execute("DELETE FROM kpi_packages WHERE last_seen < ?", (cutoff,))
+    cursor.execute("UPDATE kpi_packages SET temperature_breach_at = NULL WHERE temperature_breach_at < ?", (cutoff,))
+    cursor.execute("UPDATE kpi_packages SET g_force_breach_at = NULL WHERE g_force_breach_at < ?", (cutoff,))
+
+
+def rebuild_kpis(db_file=DB_FILE):
+    """Recompute the KPI state from the database in one transaction"""
+    conn = db.connect(db_file, isolation_level=None)
+
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in REBUILD_STATEMENTS:
+                conn.execute(statement)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return read_kpi_state(conn.cursor())
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai KPI state')
+    parser.add_argument('--db', default=DB_FILE,
+                        help=f'SQLite database file (default: {DB_FILE})')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recompute the KPI counters from telemetry and alerts')
+
+    args = parser.parse_args()
+
+    if args.rebuild:
+        state = rebuild_kpis(args.db)
+        print(f"✓ KPI state rebuilt: {state}")
+    else:
+        conn = db.connect(args.db)
+        try:
+            print(read_kpi_state(conn.cursor()))
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
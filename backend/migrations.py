@@ -0,0 +1,825 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for the Chisifai database
+
+Both the API server and the population script run these at startup. Each
+migration is applied once, inside its own transaction, and recorded in the
+schema_migrations table (the current version is also kept in
+PRAGMA user_version). A migration step is either a SQL statement or a
+function that receives the connection, for data-dependent changes.
+
+Run `python migrations.py --check-plans` to verify that every query the
+endpoints, ingest and cleanup run through the storage backend is served by
+an index.
+"""
+
+import argparse
+import re
+import sqlite3
+import sys
+from datetime import datetime
+
+import db
+from rules import GFORCE_THRESHOLD, TEMPERATURE_THRESHOLD
+from kpis import REBUILD_STATEMENTS as KPI_REBUILD_STATEMENTS
+from timestamps import day_of, parse_epoch_ms
+
+
+# Database configuration
+DB_FILE = db.DB_FILE
+
+
+# Rollup tables and the expression of their bucket, finest first. Buckets are
+# epoch milliseconds; migration 4 created them over ISO text timestamps.
+ROLLUP_BUCKETS = [
+    ("telemetry_rollup_1m", "{timestamp} / 60000 * 60000"),
+    ("telemetry_rollup_1h", "{timestamp} / 3600000 * 3600000"),
+    ("telemetry_rollup_1d", "{timestamp} / 86400000 * 86400000"),
+]
+TEXT_ROLLUP_BUCKETS = [
+    ("telemetry_rollup_1m", "strftime('%Y-%m-%dT%H:%M:00', {timestamp})"),
+    ("telemetry_rollup_1h", "strftime('%Y-%m-%dT%H:00:00', {timestamp})"),
+    ("telemetry_rollup_1d", "strftime('%Y-%m-%dT00:00:00', {timestamp})"),
+]
+
+
+# The upserts below are the bodies of the telemetry insert triggers. `row`
+# prefixes each reading column: "NEW." inside a trigger, ":" for executemany
+# with named parameters (storage.py, which writes raw rows to day partitions).
+
+def latest_upsert(row="NEW."):
+    """Keep package_latest at each package's newest reading"""
+    # Ties on the same timestamp resolve to the highest telemetry id
+    return f'''
+            INSERT INTO package_latest
+            (package_id, telemetry_id, temperature, g_force, latitude, longitude, timestamp, battery_level, signal_strength)
+            VALUES ({row}package_id, {row}id, {row}temperature, {row}g_force, {row}latitude, {row}longitude,
+                    {row}timestamp, {row}battery_level, {row}signal_strength)
+            ON CONFLICT(package_id) DO UPDATE SET
+                telemetry_id = excluded.telemetry_id,
+                temperature = excluded.temperature,
+                g_force = excluded.g_force,
+                latitude = excluded.latitude,
+                longitude = excluded.longitude,
+                timestamp = excluded.timestamp,
+                battery_level = excluded.battery_level,
+                signal_strength = excluded.signal_strength
+            WHERE excluded.timestamp > package_latest.timestamp
+               OR (excluded.timestamp = package_latest.timestamp AND excluded.telemetry_id > package_latest.telemetry_id)
+    '''
+
+
+# Folding a row into a rollup bucket; the row carries its own count, so
+# single readings and pre-aggregated buckets merge the same way
+ROLLUP_CONFLICT = """
+            ON CONFLICT(package_id, bucket) DO UPDATE SET
+                temperature_min = MIN(temperature_min, excluded.temperature_min),
+                temperature_max = MAX(temperature_max, excluded.temperature_max),
+                temperature_sum = temperature_sum + excluded.temperature_sum,
+                g_force_min = MIN(g_force_min, excluded.g_force_min),
+                g_force_max = MAX(g_force_max, excluded.g_force_max),
+                g_force_sum = g_force_sum + excluded.g_force_sum,
+                count = count + excluded.count
+"""
+
+
+def rollup_upsert(table, bucket, row="NEW."):
+    """Fold one reading into its bucket of a rollup table"""
+    bucket = bucket.format(timestamp=f"{row}timestamp")
+    return f'''
+            INSERT INTO {table}
+            (package_id, bucket, temperature_min, temperature_max, temperature_sum,
+             g_force_min, g_force_max, g_force_sum, count)
+            VALUES ({row}package_id, {bucket}, {row}temperature, {row}temperature, {row}temperature,
+                    {row}g_force, {row}g_force, {row}g_force, 1)
+            {ROLLUP_CONFLICT.strip()}
+    '''
+
+
+def rollup_merge(table):
+    """Merge pre-aggregated buckets (positional parameters in column order) into a rollup table"""
+    return f'''
+            INSERT INTO {table}
+            (package_id, bucket, temperature_min, temperature_max, temperature_sum,
+             g_force_min, g_force_max, g_force_sum, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            {ROLLUP_CONFLICT.strip()}
+    '''
+
+
+# Merging into a package's KPI row keeps the newest time of each kind
+KPI_PACKAGE_CONFLICT = """
+            ON CONFLICT(package_id) DO UPDATE SET
+                last_seen = MAX(last_seen, excluded.last_seen),
+                temperature_breach_at = COALESCE(MAX(temperature_breach_at, excluded.temperature_breach_at),
+                                                 temperature_breach_at, excluded.temperature_breach_at),
+                g_force_breach_at = COALESCE(MAX(g_force_breach_at, excluded.g_force_breach_at),
+                                             g_force_breach_at, excluded.g_force_breach_at)
+"""
+
+
+def kpi_package_upsert(row="NEW."):
+    """Per-package KPI state: last reading and latest threshold breaches"""
+    return f'''
+            INSERT INTO kpi_packages (package_id, last_seen, temperature_breach_at, g_force_breach_at)
+            VALUES ({row}package_id, {row}timestamp,
+                    CASE WHEN {row}temperature > {TEMPERATURE_THRESHOLD} THEN {row}timestamp END,
+                    CASE WHEN {row}g_force > {GFORCE_THRESHOLD} THEN {row}timestamp END)
+            {KPI_PACKAGE_CONFLICT.strip()}
+    '''
+
+
+def kpi_package_merge():
+    """Merge a package's last_seen and breach times, already aggregated over many readings"""
+    return f'''
+            INSERT INTO kpi_packages (package_id, last_seen, temperature_breach_at, g_force_breach_at)
+            VALUES (?, ?, ?, ?)
+            {KPI_PACKAGE_CONFLICT.strip()}
+    '''
+
+
+# Raw telemetry is partitioned by reading day into telemetry_YYYYMMDD tables
+PARTITION_GLOB = "telemetry_" + "[0-9]" * 8
+PARTITION_DAY = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Readings a migration cannot place in a partition are kept here for inspection
+QUARANTINE_TABLE = "telemetry_quarantine"
+
+# SQLite caps a compound SELECT at 500 terms, so the view nests groups of partitions
+VIEW_GROUP_SIZE = 400
+
+# The telemetry view of a database without partitions
+EMPTY_TELEMETRY_SELECT = """
+    SELECT NULL AS id, NULL AS package_id, NULL AS temperature, NULL AS g_force, NULL AS latitude,
+           NULL AS longitude, NULL AS timestamp, NULL AS battery_level, NULL AS signal_strength
+    WHERE 0
+"""
+
+
+def partition_day(timestamp):
+    """The partition (UTC day, YYYY-MM-DD) of an epoch-millisecond reading timestamp"""
+    return day_of(timestamp)
+
+
+def partition_table(day):
+    return f"telemetry_{day.replace('-', '')}"
+
+
+def partition_statements(table, timestamp_type="INTEGER"):
+    """Create one day's telemetry table with the history indexes"""
+    return [
+        f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            package_id TEXT NOT NULL,
+            temperature REAL NOT NULL,
+            g_force REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp {timestamp_type} NOT NULL,
+            battery_level REAL,
+            signal_strength INTEGER
+        )
+        ''',
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_package_timestamp ON {table} (package_id, timestamp)",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp)",
+    ]
+
+
+def list_partitions(conn):
+    """Day partitions in the database, oldest first, as {day: table}"""
+    tables = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (PARTITION_GLOB,)
+    ).fetchall()
+    return {f"{name[10:14]}-{name[14:16]}-{name[16:18]}": name for (name,) in tables}
+
+
+def rebuild_telemetry_view(conn):
+    """
+    Point the telemetry view at the current partitions. Endpoints query the
+    partitions directly; the view serves ad-hoc reads and kpis.py --rebuild.
+    """
+    tables = list(list_partitions(conn).values())
+    conn.execute("DROP VIEW IF EXISTS telemetry")
+    if not tables:
+        conn.execute(f"CREATE VIEW telemetry AS {EMPTY_TELEMETRY_SELECT}")
+        return
+    groups = [
+        " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables[i:i + VIEW_GROUP_SIZE])
+        for i in range(0, len(tables), VIEW_GROUP_SIZE)
+    ]
+    conn.execute(f"CREATE VIEW telemetry AS {' UNION ALL '.join(f'SELECT * FROM ({group})' for group in groups)}")
+
+
+def partition_telemetry(conn):
+    """Move the telemetry table's rows into day partitions and replace it with a view"""
+    conn.execute(
+        "UPDATE telemetry_sequence SET last_id = MAX(last_id, (SELECT COALESCE(MAX(id), 0) FROM telemetry))"
+    )
+    days = [row[0] for row in conn.execute("SELECT DISTINCT substr(timestamp, 1, 10) FROM telemetry")]
+    for day in days:
+        # Rows whose timestamp cannot name a partition are set aside before the table goes
+        if not PARTITION_DAY.fullmatch(day or ""):
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} AS SELECT * FROM telemetry WHERE 0")
+            moved = conn.execute(
+                f"INSERT INTO {QUARANTINE_TABLE} SELECT * FROM telemetry WHERE substr(timestamp, 1, 10) IS ?", (day,)
+            ).rowcount
+            print(f"⚠ Moved {moved} telemetry rows with non-ISO timestamps starting {day!r} to {QUARANTINE_TABLE}")
+            continue
+        table = partition_table(day)
+        for statement in partition_statements(table, "TEXT"):
+            conn.execute(statement)
+        conn.execute(f"INSERT INTO {table} SELECT * FROM telemetry WHERE substr(timestamp, 1, 10) = ?", (day,))
+
+    # Derived state is already current; from now on the ingest path maintains it
+    conn.execute("DROP TABLE telemetry")
+    rebuild_telemetry_view(conn)
+
+
+def register_timestamp_functions(conn):
+    """SQL functions that convert stored ISO timestamps: epoch_ms(text) and epoch_day(ms)"""
+    conn.create_function("epoch_ms", 1, parse_epoch_ms, deterministic=True)
+    conn.create_function("epoch_day", 1, lambda ms: None if ms is None else day_of(ms), deterministic=True)
+
+
+def quarantine_unparseable(conn, source, quarantine):
+    """Copy the rows of `source` whose timestamp epoch_ms() cannot convert into `quarantine`"""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {quarantine} AS SELECT * FROM {source} WHERE 0")
+    moved = conn.execute(
+        f"INSERT INTO {quarantine} SELECT * FROM {source} WHERE epoch_ms(timestamp) IS NULL"
+    ).rowcount
+    if moved:
+        print(f"⚠ Moved {moved} rows with unparseable timestamps from {source} to {quarantine}")
+
+
+def quarantine_latest_and_alerts(conn):
+    """Keep the latest positions and alerts the epoch conversion leaves out, for inspection"""
+    for table in ("package_latest", "alerts"):
+        quarantine_unparseable(conn, table, f"{table}_quarantine")
+
+
+def epoch_partitions(conn):
+    """Rewrite the day partitions with epoch-millisecond timestamps, split by UTC day"""
+    conn.execute("DROP VIEW IF EXISTS telemetry")
+
+    # Set the ISO partitions aside (with their index names) so the UTC days can reuse the names
+    sources = []
+    for table in list_partitions(conn).values():
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_package_timestamp")
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table}_timestamp")
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_iso")
+        sources.append(f"{table}_iso")
+
+    for source in sources:
+        # Set aside the rows no partition can hold before the source table goes
+        quarantine_unparseable(conn, source, QUARANTINE_TABLE)
+
+        # A local day spans at most two UTC days
+        days = conn.execute(f"SELECT DISTINCT epoch_day(epoch_ms(timestamp)) FROM {source}").fetchall()
+        for (day,) in days:
+            if day is None:
+                continue
+            table = partition_table(day)
+            for statement in partition_statements(table):
+                conn.execute(statement)
+            conn.execute(f'''
+                INSERT INTO {table}
+                SELECT id, package_id, temperature, g_force, latitude, longitude,
+                       epoch_ms(timestamp), battery_level, signal_strength
+                FROM {source}
+                WHERE epoch_day(epoch_ms(timestamp)) = ?
+            ''', (day,))
+        conn.execute(f"DROP TABLE {source}")
+
+    rebuild_telemetry_view(conn)
+
+
+def epoch_rollup_statements(table):
+    """Convert a rollup table's ISO buckets to epoch milliseconds"""
+    return [
+        rollup_table(f"{table}_epoch", "INTEGER"),
+        # Merges the rare buckets that collapse onto one instant (a DST change)
+        f'''
+        INSERT INTO {table}_epoch
+        SELECT package_id, epoch_ms(bucket),
+               MIN(temperature_min), MAX(temperature_max), SUM(temperature_sum),
+               MIN(g_force_min), MAX(g_force_max), SUM(g_force_sum), SUM(count)
+        FROM {table}
+        WHERE epoch_ms(bucket) IS NOT NULL
+        GROUP BY package_id, epoch_ms(bucket)
+        ''',
+        f"DROP TABLE {table}",
+        f"ALTER TABLE {table}_epoch RENAME TO {table}",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)",
+    ]
+
+
+def rollup_table(table, bucket_type="TEXT"):
+    return f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            package_id TEXT NOT NULL,
+            bucket {bucket_type} NOT NULL,
+            temperature_min REAL NOT NULL,
+            temperature_max REAL NOT NULL,
+            temperature_sum REAL NOT NULL,
+            g_force_min REAL NOT NULL,
+            g_force_max REAL NOT NULL,
+            g_force_sum REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (package_id, bucket)
+        ) WITHOUT ROWID
+        '''
+
+
+def rollup_statements(table, bucket):
+    """Create a per-package rollup table, its insert trigger and its backfill"""
+    return [
+        rollup_table(table),
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_on_insert
+        AFTER INSERT ON telemetry
+        BEGIN
+            {rollup_upsert(table, bucket).strip()};
+        END
+        ''',
+        f'''
+        INSERT OR IGNORE INTO {table}
+        (package_id, bucket, temperature_min, temperature_max, temperature_sum,
+         g_force_min, g_force_max, g_force_sum, count)
+        SELECT package_id, {bucket.format(timestamp="timestamp")},
+               MIN(temperature), MAX(temperature), SUM(temperature),
+               MIN(g_force), MAX(g_force), SUM(g_force), COUNT(*)
+        FROM telemetry
+        GROUP BY package_id, {bucket.format(timestamp="timestamp")}
+        ''',
+    ]
+
+
+# Triggers that keep kpi_state's package counters in step with kpi_packages
+KPI_PACKAGE_TRIGGERS = [
+    # Counters only move when a package appears, disappears or changes breach state
+    '''
+    CREATE TRIGGER IF NOT EXISTS kpi_on_package_insert
+    AFTER INSERT ON kpi_packages
+    BEGIN
+        UPDATE kpi_state SET
+            packages = packages + 1,
+            temperature_breaches = temperature_breaches + (NEW.temperature_breach_at IS NOT NULL),
+            g_force_breaches = g_force_breaches + (NEW.g_force_breach_at IS NOT NULL),
+            breached_packages = breached_packages
+                + (NEW.temperature_breach_at IS NOT NULL OR NEW.g_force_breach_at IS NOT NULL)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS kpi_on_package_update
+    AFTER UPDATE ON kpi_packages
+    WHEN (OLD.temperature_breach_at IS NULL) != (NEW.temperature_breach_at IS NULL)
+      OR (OLD.g_force_breach_at IS NULL) != (NEW.g_force_breach_at IS NULL)
+    BEGIN
+        UPDATE kpi_state SET
+            temperature_breaches = temperature_breaches
+                + (NEW.temperature_breach_at IS NOT NULL) - (OLD.temperature_breach_at IS NOT NULL),
+            g_force_breaches = g_force_breaches
+                + (NEW.g_force_breach_at IS NOT NULL) - (OLD.g_force_breach_at IS NOT NULL),
+            breached_packages = breached_packages
+                + (NEW.temperature_breach_at IS NOT NULL OR NEW.g_force_breach_at IS NOT NULL)
+                - (OLD.temperature_breach_at IS NOT NULL OR OLD.g_force_breach_at IS NOT NULL)
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS kpi_on_package_delete
+    AFTER DELETE ON kpi_packages
+    BEGIN
+        UPDATE kpi_state SET
+            packages = packages - 1,
+            temperature_breaches = temperature_breaches - (OLD.temperature_breach_at IS NOT NULL),
+            g_force_breaches = g_force_breaches - (OLD.g_force_breach_at IS NOT NULL),
+            breached_packages = breached_packages
+                - (OLD.temperature_breach_at IS NOT NULL OR OLD.g_force_breach_at IS NOT NULL)
+        WHERE id = 1;
+    END
+    ''',
+]
+
+# Triggers that keep the package_location R*Tree in step with package_latest, and its backfill
+LOCATION_TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS package_location_insert
+    AFTER INSERT ON package_latest
+    BEGIN
+        INSERT INTO package_location (id, min_lat, max_lat, min_lng, max_lng)
+        VALUES (NEW.rowid, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS package_location_update
+    AFTER UPDATE OF latitude, longitude ON package_latest
+    BEGIN
+        UPDATE package_location SET
+            min_lat = NEW.latitude, max_lat = NEW.latitude,
+            min_lng = NEW.longitude, max_lng = NEW.longitude
+        WHERE id = NEW.rowid;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS package_location_delete
+    AFTER DELETE ON package_latest
+    BEGIN
+        DELETE FROM package_location WHERE id = OLD.rowid;
+    END
+    ''',
+    '''
+    INSERT INTO package_location (id, min_lat, max_lat, min_lng, max_lng)
+    SELECT rowid, latitude, latitude, longitude, longitude FROM package_latest
+    ''',
+]
+
+
+MIGRATIONS = [
+    (1, "Create telemetry and alerts tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS telemetry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            package_id TEXT NOT NULL,
+            temperature REAL NOT NULL,
+            g_force REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            battery_level REAL,
+            signal_strength INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            package_id TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            is_resolved BOOLEAN DEFAULT 0,
+            severity TEXT DEFAULT 'medium'
+        )
+        ''',
+    ]),
+    (2, "Add package_latest table kept current on every telemetry insert", [
+        '''
+        CREATE TABLE IF NOT EXISTS package_latest (
+            package_id TEXT PRIMARY KEY,
+            telemetry_id INTEGER NOT NULL,
+            temperature REAL NOT NULL,
+            g_force REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            battery_level REAL,
+            signal_strength INTEGER
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS telemetry_update_latest
+        AFTER INSERT ON telemetry
+        BEGIN
+            {latest_upsert().strip()};
+        END
+        ''',
+        '''
+        INSERT OR IGNORE INTO package_latest
+        (package_id, telemetry_id, temperature, g_force, latitude, longitude, timestamp, battery_level, signal_strength)
+        SELECT package_id, id, temperature, g_force, latitude, longitude, timestamp, battery_level, signal_strength
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY package_id ORDER BY timestamp DESC, id DESC
+            ) AS rn
+            FROM telemetry
+        )
+        WHERE rn = 1
+        ''',
+    ]),
+    (3, "Add telemetry history and unresolved alert indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_package_timestamp ON telemetry (package_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_timestamp ON telemetry (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_package_latest_timestamp ON package_latest (timestamp)",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_alerts_unresolved ON alerts (timestamp)
+        WHERE is_resolved = 0 OR is_resolved IS NULL
+        ''',
+    ]),
+    (4, "Add 1-minute, 1-hour and 1-day telemetry rollups", [
+        statement
+        for table, bucket in TEXT_ROLLUP_BUCKETS
+        for statement in rollup_statements(table, bucket)
+    ]),
+    (5, "Add incrementally maintained KPI state", [
+        "ALTER TABLE alerts ADD COLUMN detected_at TEXT",
+        '''
+        CREATE TABLE IF NOT EXISTS kpi_packages (
+            package_id TEXT PRIMARY KEY,
+            last_seen TEXT NOT NULL,
+            temperature_breach_at TEXT,
+            g_force_breach_at TEXT
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS kpi_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            packages INTEGER NOT NULL DEFAULT 0,
+            temperature_breaches INTEGER NOT NULL DEFAULT 0,
+            g_force_breaches INTEGER NOT NULL DEFAULT 0,
+            breached_packages INTEGER NOT NULL DEFAULT 0,
+            active_alerts INTEGER NOT NULL DEFAULT 0,
+            detection_seconds REAL NOT NULL DEFAULT 0,
+            detections INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO kpi_state (id) VALUES (1)",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_telemetry_insert
+        AFTER INSERT ON telemetry
+        BEGIN
+            {kpi_package_upsert().strip()};
+        END
+        ''',
+    ] + KPI_PACKAGE_TRIGGERS + [
+        # Active alerts and time-to-detection (reading timestamp -> alert raised)
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_insert
+        AFTER INSERT ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts + (COALESCE(NEW.is_resolved, 0) = 0),
+                detection_seconds = detection_seconds
+                    + COALESCE((julianday(NEW.detected_at) - julianday(NEW.timestamp)) * 86400, 0),
+                detections = detections + (NEW.detected_at IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_resolve
+        AFTER UPDATE OF is_resolved ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts
+                    + (COALESCE(NEW.is_resolved, 0) = 0) - (COALESCE(OLD.is_resolved, 0) = 0)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_delete
+        AFTER DELETE ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts - (COALESCE(OLD.is_resolved, 0) = 0),
+                detection_seconds = detection_seconds
+                    - COALESCE((julianday(OLD.detected_at) - julianday(OLD.timestamp)) * 86400, 0),
+                detections = detections - (OLD.detected_at IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+    ] + KPI_REBUILD_STATEMENTS),
+    (6, "Add alert lifecycle for the rule engine", [
+        "ALTER TABLE alerts ADD COLUMN dedup_key TEXT",
+        "ALTER TABLE alerts ADD COLUMN resolved_at TEXT",
+        # At most one open alert per dedup key (package + rule)
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open_dedup_key
+        ON alerts(dedup_key)
+        WHERE dedup_key IS NOT NULL AND (is_resolved = 0 OR is_resolved IS NULL)
+        ''',
+    ]),
+    (7, "Add R*Tree index over the latest package positions", [
+        # Keyed by package_latest.rowid, which an upsert keeps stable
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS package_location
+        USING rtree(id, min_lat, max_lat, min_lng, max_lng)
+        ''',
+    ] + LOCATION_TRIGGERS),
+    (8, "Add telemetry id sequence for sharded storage", [
+        # Telemetry ids when the raw rows live outside this file (see storage.py)
+        '''
+        CREATE TABLE IF NOT EXISTS telemetry_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO telemetry_sequence (id, last_id) SELECT 1, COALESCE(MAX(id), 0) FROM telemetry",
+    ]),
+    (9, "Partition telemetry by day behind a telemetry view", [
+        partition_telemetry,
+    ]),
+    (10, "Store timestamps as UTC epoch milliseconds", [
+        register_timestamp_functions,
+        epoch_partitions,
+        quarantine_latest_and_alerts,
+        '''
+        CREATE TABLE package_latest_epoch (
+            package_id TEXT PRIMARY KEY,
+            telemetry_id INTEGER NOT NULL,
+            temperature REAL NOT NULL,
+            g_force REAL NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            battery_level REAL,
+            signal_strength INTEGER
+        )
+        ''',
+        '''
+        INSERT INTO package_latest_epoch
+        (rowid, package_id, telemetry_id, temperature, g_force, latitude, longitude, timestamp,
+         battery_level, signal_strength)
+        SELECT rowid, package_id, telemetry_id, temperature, g_force, latitude, longitude, epoch_ms(timestamp),
+               battery_level, signal_strength
+        FROM package_latest
+        WHERE epoch_ms(timestamp) IS NOT NULL
+        ''',
+        "DROP TABLE package_latest",
+        "ALTER TABLE package_latest_epoch RENAME TO package_latest",
+        "CREATE INDEX IF NOT EXISTS idx_package_latest_timestamp ON package_latest (timestamp)",
+        "DELETE FROM package_location",
+    ] + LOCATION_TRIGGERS + [
+        '''
+        CREATE TABLE alerts_epoch (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            package_id TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            is_resolved BOOLEAN DEFAULT 0,
+            severity TEXT DEFAULT 'medium',
+            detected_at INTEGER,
+            dedup_key TEXT,
+            resolved_at INTEGER
+        )
+        ''',
+        '''
+        INSERT INTO alerts_epoch
+        SELECT id, package_id, alert_type, message, epoch_ms(timestamp), is_resolved, severity,
+               epoch_ms(detected_at), dedup_key, epoch_ms(resolved_at)
+        FROM alerts
+        WHERE epoch_ms(timestamp) IS NOT NULL
+        ''',
+        # Keep the AUTOINCREMENT high-water mark, so stream cursors never see an id twice
+        "DELETE FROM sqlite_sequence WHERE name = 'alerts_epoch'",
+        "UPDATE sqlite_sequence SET name = 'alerts_epoch' WHERE name = 'alerts'",
+        "DROP TABLE alerts",
+        "ALTER TABLE alerts_epoch RENAME TO alerts",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_alerts_unresolved ON alerts (timestamp)
+        WHERE is_resolved = 0 OR is_resolved IS NULL
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open_dedup_key
+        ON alerts(dedup_key)
+        WHERE dedup_key IS NOT NULL AND (is_resolved = 0 OR is_resolved IS NULL)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_insert
+        AFTER INSERT ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts + (COALESCE(NEW.is_resolved, 0) = 0),
+                detection_seconds = detection_seconds + COALESCE((NEW.detected_at - NEW.timestamp) / 1000.0, 0),
+                detections = detections + (NEW.detected_at IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_resolve
+        AFTER UPDATE OF is_resolved ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts
+                    + (COALESCE(NEW.is_resolved, 0) = 0) - (COALESCE(OLD.is_resolved, 0) = 0)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS kpi_on_alert_delete
+        AFTER DELETE ON alerts
+        BEGIN
+            UPDATE kpi_state SET
+                active_alerts = active_alerts - (COALESCE(OLD.is_resolved, 0) = 0),
+                detection_seconds = detection_seconds - COALESCE((OLD.detected_at - OLD.timestamp) / 1000.0, 0),
+                detections = detections - (OLD.detected_at IS NOT NULL)
+            WHERE id = 1;
+        END
+        ''',
+    ] + [
+        statement
+        for table, _ in ROLLUP_BUCKETS
+        for statement in epoch_rollup_statements(table)
+    ] + [
+        # kpi_packages is derived from telemetry, so it is rebuilt rather than converted
+        "DROP TABLE kpi_packages",
+        '''
+        CREATE TABLE kpi_packages (
+            package_id TEXT PRIMARY KEY,
+            last_seen INTEGER NOT NULL,
+            temperature_breach_at INTEGER,
+            g_force_breach_at INTEGER
+        ) WITHOUT ROWID
+        ''',
+    ] + KPI_PACKAGE_TRIGGERS + KPI_REBUILD_STATEMENTS),
+]
+
+
+def get_schema_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    version = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()[0]
+    return version or 0
+
+
+def run_migrations(db_file=DB_FILE):
+    """Apply every pending migration and return the resulting schema version"""
+    conn = db.connect(db_file, isolation_level=None)
+
+    try:
+        for version, description, statements in MIGRATIONS:
+            # Take the write lock before checking, so concurrent startups
+            # (API server and populate script) apply each migration once
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if version <= get_schema_version(conn):
+                    conn.execute("COMMIT")
+                    continue
+
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now().isoformat())
+                )
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+                print(f"Applied migration {version}: {description}")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+        return get_schema_version(conn)
+    finally:
+        conn.close()
+
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def check_query_plans(conn, queries):
+    """
+    Return the queries whose plan scans a table without an index, as a dict
+    of name -> plan lines. An empty dict means every query uses an index.
+    """
+    failures = {}
+    for name, (sql, params) in queries.items():
+        plan = explain_query_plan(conn, sql, params)
+        full_scans = [
+            line for line in plan
+            if line.startswith("SCAN") and "INDEX" not in line and "CONSTANT ROW" not in line
+        ]
+        if full_scans:
+            failures[name] = plan
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai database migrations')
+    parser.add_argument('--db', default=DB_FILE,
+                        help=f'SQLite database file (default: {DB_FILE})')
+    parser.add_argument('--check-plans', action='store_true',
+                        help='Verify that every hot-path query uses an index')
+
+    args = parser.parse_args()
+
+    version = run_migrations(args.db)
+    print(f"Schema version: {version}")
+
+    if args.check_plans:
+        # The queries as the storage backend builds them, traced on a copy of the database
+        from storage import check_hot_path_plans
+
+        failures = check_hot_path_plans(args.db)
+        for name, plan in failures.items():
+            print(f"✗ {name} scans without an index: {plan}")
+        if failures:
+            sys.exit(1)
+        print("✓ Every hot-path query uses an index")
+
+
+if __name__ == "__main__":
+    main()
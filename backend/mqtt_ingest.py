@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Native MQTT ingestion worker for Chisifai telemetry
+
+Subscribes to the tracker telemetry topic (and its /bin and /msgpack
+subtopics for compact binary payloads, see wire_format.py), buffers
+readings in memory and flushes them to the configured storage backend in
+batches, either when the batch is full or when the flush window expires.
+This replaces the per-message MQTT -> Node-RED -> HTTP POST -> SQLite chain.
+"""
+
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import paho.mqtt.client as mqtt
+from pydantic import ValidationError
+
+import db
+from capture import CAPTURE_DIR, CaptureWriter
+from ingest import TelemetryReading, reading_to_row
+from storage import open_store
+from wire_format import decode_rows, format_of
+
+
+# Configuration
+DB_FILE = db.DB_FILE
+DEFAULT_BROKER = "test.mosquitto.org"
+DEFAULT_PORT = 1883
+DEFAULT_TOPIC = "chisifai/trackers/telemetry"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+DEFAULT_QUEUE_SIZE = 20000
+DEFAULT_ENQUEUE_TIMEOUT = 0.5  # seconds a full buffer may block the MQTT thread
+RETRY_DELAY = 1.0  # seconds between flush retries after a database error
+MAX_FLUSH_RETRIES = 5  # retries before a batch is dropped so later readings keep flowing
+# Errors a retry cannot fix: a reading the schema or the driver rejects fails the same way every time
+PERMANENT_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, OverflowError, ValueError)
+
+
+class TelemetryIngestWorker:
+    def __init__(self, db_file=DB_FILE, broker=DEFAULT_BROKER, port=DEFAULT_PORT, topic=DEFAULT_TOPIC,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE, enqueue_timeout=DEFAULT_ENQUEUE_TIMEOUT, store=None, capture=None):
+        self.db_file = db_file
+        self.store = store or open_store()
+        # Optional CaptureWriter recording every message as received, for replay
+        self.capture = capture
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.client_id = f"chisifai_ingest_{uuid.uuid4().hex[:8]}"
+
+        # Bounded buffer between the MQTT network thread and the writer thread
+        self.buffer = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+        self.client = None
+
+        self.lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "invalid": 0,
+            "enqueued": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "flushedRows": 0,
+            "flushedBatches": 0,
+            "flushErrors": 0,
+            "maxQueueDepth": 0,
+            "lastFlushSize": 0,
+            "lastFlushMs": 0.0,
+            "lastFlushAt": None,
+        }
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def metrics(self):
+        """Return a snapshot of throughput, backpressure and queue depth metrics"""
+        with self.lock:
+            snapshot = dict(self.stats)
+        snapshot["queueDepth"] = self.buffer.qsize()
+        snapshot["queueCapacity"] = self.buffer.maxsize
+        snapshot["queueUtilization"] = round(snapshot["queueDepth"] / self.buffer.maxsize, 3) if self.buffer.maxsize else 0.0
+        snapshot["running"] = self.flush_thread is not None and self.flush_thread.is_alive()
+        return snapshot
+
+    def handle_payload(self, payload, fmt="json"):
+        """
+        Validate an MQTT payload (one reading or a JSON array of readings, or
+        a binary payload in format `fmt`) and buffer it for the writer thread.
+        Independent of the MQTT client so it can be fed by any transport.
+        """
+        if fmt != "json":
+            return self.handle_binary(payload, fmt)
+
+        try:
+            items = json.loads(payload)
+        except (UnicodeDecodeError, ValueError):
+            self._count("received")
+            self._count("invalid")
+            return 0
+
+        if not isinstance(items, list):
+            items = [items]
+
+        accepted = 0
+        for item in items:
+            self._count("received")
+            try:
+                row = reading_to_row(TelemetryReading(**item))
+            except (TypeError, ValueError, ValidationError):
+                self._count("invalid")
+                continue
+            if self._enqueue(row):
+                accepted += 1
+
+        return accepted
+
+    def handle_binary(self, payload, fmt):
+        """Buffer the readings of a binary payload, which decodes straight to typed rows"""
+        try:
+            rows = decode_rows(payload, fmt)
+        except ValueError:
+            self._count("received")
+            self._count("invalid")
+            return 0
+
+        self._count("received", len(rows))
+        accepted = 0
+        for row in rows:
+            if self._enqueue(row):
+                accepted += 1
+        return accepted
+
+    def _enqueue(self, row):
+        """Put a row on the buffer, blocking briefly when it is full"""
+        try:
+            self.buffer.put_nowait(row)
+        except queue.Full:
+            # Backpressure: hold the network thread so the broker stops
+            # delivering, then shed load if the writer still cannot keep up
+            self._count("blocked")
+            try:
+                self.buffer.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self._count("dropped")
+                return False
+
+        depth = self.buffer.qsize()
+        with self.lock:
+            self.stats["enqueued"] += 1
+            if depth > self.stats["maxQueueDepth"]:
+                self.stats["maxQueueDepth"] = depth
+        return True
+
+    def _next_batch(self):
+        """Collect rows until the batch is full or the flush window expires"""
+        try:
+            batch = [self.buffer.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.buffer.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write_batch(self, conn, batch):
+        """
+        Write a batch, retrying transient database errors a few times before
+        dropping it. A batch holding a reading that can never be stored is
+        split instead, so only that reading is lost.
+        """
+        attempts = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                self.store.insert_batch(conn, batch)
+                break
+            except PERMANENT_ERRORS as e:
+                self._count("flushErrors")
+                self._split_batch(conn, batch, e)
+                return
+            except sqlite3.Error as e:
+                self._count("flushErrors")
+                attempts += 1
+                print(f"✗ Error flushing {len(batch)} readings (attempt {attempts}): {e}")
+                if self.stop_event.is_set() or attempts > MAX_FLUSH_RETRIES:
+                    self._count("dropped", len(batch))
+                    return
+                time.sleep(RETRY_DELAY)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.stats["flushedRows"] += len(batch)
+            self.stats["flushedBatches"] += 1
+            self.stats["lastFlushSize"] = len(batch)
+            self.stats["lastFlushMs"] = round(elapsed_ms, 2)
+            self.stats["lastFlushAt"] = time.time()
+
+    def _split_batch(self, conn, batch, error):
+        """Bisect a batch that failed permanently until the offending readings are isolated"""
+        if len(batch) == 1:
+            self._count("dropped")
+            print(f"✗ Dropped a reading that cannot be stored: {error}")
+            return
+        middle = len(batch) // 2
+        self._write_batch(conn, batch[:middle])
+        self._write_batch(conn, batch[middle:])
+
+    def _flush_loop(self):
+        conn = db.connect(self.db_file)
+        try:
+            while not self.stop_event.is_set() or not self.buffer.empty():
+                batch = self._next_batch()
+                if batch:
+                    try:
+                        self._write_batch(conn, batch)
+                    except Exception as e:
+                        # A batch that cannot be stored must not stop the writer thread
+                        self._count("flushErrors")
+                        self._count("dropped", len(batch))
+                        print(f"✗ Dropped {len(batch)} readings that cannot be stored: {e}")
+        finally:
+            conn.close()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print(f"✓ Connected to MQTT broker at {self.broker}:{self.port}")
+            # One level below the topic name the binary payload formats
+            client.subscribe([(self.topic, 1), (f"{self.topic}/+", 1)])
+            print(f"✓ Subscribed to topic: {self.topic} (and {self.topic}/+ for binary payloads)")
+        else:
+            print(f"✗ Failed to connect to MQTT broker. Error code: {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        print(f"✗ Disconnected from MQTT broker. Reason: {rc}")
+
+    def on_message(self, client, userdata, msg):
+        if self.capture is not None:
+            self.capture.record(msg.payload, msg.topic)
+        self.handle_payload(msg.payload, format_of(msg.topic))
+
+    def start_writer(self):
+        """Start the background thread that flushes the buffer to SQLite"""
+        self.stop_event.clear()
+        self.flush_thread = threading.Thread(target=self._flush_loop, name="telemetry-flush", daemon=True)
+        self.flush_thread.start()
+
+    def start(self):
+        """Start the writer thread and the MQTT subscription"""
+        self.start_writer()
+
+        self.client = mqtt.Client(client_id=self.client_id)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+
+        print(f"Connecting to MQTT broker at {self.broker}:{self.port}...")
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()
+
+    def stop(self):
+        """Stop consuming, then drain whatever is still buffered"""
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+
+        self.stop_event.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai MQTT telemetry ingestion worker')
+    parser.add_argument('--broker', default=DEFAULT_BROKER,
+                        help=f'MQTT broker address (default: {DEFAULT_BROKER})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'MQTT broker port (default: {DEFAULT_PORT})')
+    parser.add_argument('--topic', default=DEFAULT_TOPIC,
+                        help=f'MQTT topic to subscribe to (default: {DEFAULT_TOPIC})')
+    parser.add_argument('--db', default=DB_FILE,
+                        help=f'SQLite database file (default: {DB_FILE})')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Readings per database transaction (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help=f'Maximum seconds a reading waits in the buffer (default: {DEFAULT_FLUSH_INTERVAL})')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'Maximum buffered readings before backpressure (default: {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='Seconds between metric reports (default: 10)')
+    parser.add_argument('--capture-dir', default=CAPTURE_DIR,
+                        help='Record every received message to daily capture files in this directory '
+                             '(default: CHISIFAI_CAPTURE_DIR, off when unset)')
+
+    args = parser.parse_args()
+    capture = CaptureWriter(args.capture_dir) if args.capture_dir else None
+
+    worker = TelemetryIngestWorker(
+        db_file=args.db,
+        broker=args.broker,
+        port=args.port,
+        topic=args.topic,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        queue_size=args.queue_size,
+        capture=capture
+    )
+
+    worker.start()
+    print("Press Ctrl+C to stop the ingestion worker...")
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(f"Ingest metrics: {json.dumps(worker.metrics())}")
+    except KeyboardInterrupt:
+        print("\n⚠ Ingestion worker interrupted by user.")
+    finally:
+        print("Draining buffered readings...")
+        worker.stop()
+        worker.store.close()
+        if capture is not None:
+            capture.close()
+            print(f"✓ Recorded {capture.records} messages to {args.capture_dir}")
+        print(f"✓ Ingestion worker stopped. Final metrics: {json.dumps(worker.metrics())}")
+
+
+if __name__ == "__main__":
+    main()
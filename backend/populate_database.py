@@ -4,53 +4,29 @@ Simplified database population script for Chisifai dashboard
 This script initializes the database and populates it with sample data
 """
 
-import sqlite3
 import json
 import random
 import time
 from datetime import datetime, timedelta
 import uuid
 
+import db
+from migrations import run_migrations
+from rollups import RAW_RETENTION
+from storage import open_store
+from timestamps import MILLISECOND, now_ms, to_epoch_ms
+
 
 # Database setup
-DB_FILE = 'chisifai.db'
+DB_FILE = db.DB_FILE
+
+# Telemetry storage backend (CHISIFAI_STORAGE)
+store = open_store()
 
 
 def init_db():
-    """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create telemetry table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS telemetry (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            package_id TEXT NOT NULL,
-            temperature REAL NOT NULL,
-            g_force REAL NOT NULL,
-            latitude REAL NOT NULL,
-            longitude REAL NOT NULL,
-            timestamp TEXT NOT NULL,
-            battery_level REAL,
-            signal_strength INTEGER
-        )
-    ''')
-    
-    # Create alerts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            package_id TEXT NOT NULL,
-            alert_type TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            is_resolved BOOLEAN DEFAULT 0,
-            severity TEXT DEFAULT 'medium'
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Initialize the database by applying any pending schema migrations"""
+    run_migrations(DB_FILE)
 
 
 def generate_sample_telemetry():
@@ -160,140 +136,62 @@ def generate_realtime_telemetry():
     return packages
 
 
+def package_to_row(pkg):
+    """Convert a generated package reading into a telemetry table row"""
+    return (
+        pkg['package_id'],
+        pkg['temperature'],
+        pkg['g_force'],
+        pkg['latitude'],
+        pkg['longitude'],
+        to_epoch_ms(pkg['timestamp']),
+        pkg['battery_level'],
+        pkg['signal_strength']
+    )
+
+
+def insert_packages(packages):
+    """Insert generated readings through the ingest path, which applies the alert rules"""
+    conn = db.connect(DB_FILE, isolation_level=None)
+    
+    try:
+        # Rules see each package's readings in time order
+        rows = sorted((package_to_row(pkg) for pkg in packages), key=lambda row: row[5])
+        return store.insert_batch(conn, rows)
+    finally:
+        conn.close()
+
+
 def insert_telemetry_data():
     """Insert sample telemetry data into the database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Generate and insert new data
     packages = generate_sample_telemetry()
-    
-    for pkg in packages:
-        # Insert telemetry record
-        cursor.execute('''
-            INSERT INTO telemetry 
-            (package_id, temperature, g_force, latitude, longitude, timestamp, battery_level, signal_strength)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            pkg['package_id'],
-            pkg['temperature'],
-            pkg['g_force'],
-            pkg['latitude'],
-            pkg['longitude'],
-            pkg['timestamp'],
-            pkg['battery_level'],
-            pkg['signal_strength']
-        ))
-        
-        # Create alerts for temperature issues
-        if pkg['temperature'] > 26.0:
-            cursor.execute('''
-                INSERT INTO alerts 
-                (package_id, alert_type, message, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                pkg['package_id'],
-                'Temperatura Excedida',
-                f'Temperatura demasiado alta: {pkg["temperature"]}°C',
-                pkg['timestamp'],
-                'high'
-            ))
-        
-        # Create alerts for g-force issues
-        if pkg['g_force'] > 2.5:
-            cursor.execute('''
-                INSERT INTO alerts 
-                (package_id, alert_type, message, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                pkg['package_id'],
-                'Posible Impacto',
-                f'Fuerza G inusual: {pkg["g_force"]}G',
-                pkg['timestamp'],
-                'high'
-            ))
-    
-    conn.commit()
-    conn.close()
-    print(f"Inserted {len(packages)} telemetry records and associated alerts")
+    ack = insert_packages(packages)
+    print(f"Inserted {ack['accepted']} telemetry records and {ack['alerts']} alerts")
 
 
 def insert_realtime_data():
     """Insert real-time telemetry data into the database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
     packages = generate_realtime_telemetry()
-    
-    for pkg in packages:
-        # Insert telemetry record
-        cursor.execute('''
-            INSERT INTO telemetry 
-            (package_id, temperature, g_force, latitude, longitude, timestamp, battery_level, signal_strength)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            pkg['package_id'],
-            pkg['temperature'],
-            pkg['g_force'],
-            pkg['latitude'],
-            pkg['longitude'],
-            pkg['timestamp'],
-            pkg['battery_level'],
-            pkg['signal_strength']
-        ))
-        
-        # Create alerts for temperature issues
-        if pkg['temperature'] > 26.0:
-            cursor.execute('''
-                INSERT INTO alerts 
-                (package_id, alert_type, message, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                pkg['package_id'],
-                'Temperatura Excedida',
-                f'Temperatura demasiado alta: {pkg["temperature"]}°C',
-                pkg['timestamp'],
-                'high'
-            ))
-        
-        # Create alerts for g-force issues
-        if pkg['g_force'] > 2.5:
-            cursor.execute('''
-                INSERT INTO alerts 
-                (package_id, alert_type, message, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                pkg['package_id'],
-                'Posible Impacto',
-                f'Fuerza G inusual: {pkg["g_force"]}G',
-                pkg['timestamp'],
-                'high'
-            ))
-    
-    conn.commit()
-    conn.close()
-    print(f"Inserted {len(packages)} real-time telemetry records")
+    ack = insert_packages(packages)
+    print(f"Inserted {ack['accepted']} real-time telemetry records")
 
 
 def cleanup_old_data():
-    """Remove data older than 24 hours to keep DB size manageable"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Calculate cutoff time (24 hours ago)
-    cutoff_time = datetime.now() - timedelta(hours=24)
-    cutoff_str = cutoff_time.isoformat()
+    """Remove raw data past its retention and rollups past theirs to keep DB size manageable"""
+    conn = db.connect(DB_FILE)
     
-    # Delete old records
-    cursor.execute("DELETE FROM telemetry WHERE timestamp < ?", (cutoff_str,))
-    cursor.execute("DELETE FROM alerts WHERE timestamp < ?", (cutoff_str,))
+    # Calculate cutoff time for raw telemetry (24 hours ago by default)
+    cutoff_time = now_ms() - RAW_RETENTION // MILLISECOND
     
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    try:
+        removed = store.cleanup(conn, cutoff_time)
+    finally:
+        conn.close()
     
-    if deleted_count > 0:
-        print(f"Cleaned up {deleted_count} old records")
+    if removed["deleted"] > 0:
+        print(f"Cleaned up {removed['deleted']} old records")
+    if removed["droppedPartitions"] > 0:
+        print(f"Dropped {removed['droppedPartitions']} telemetry partitions past retention")
 
 
 def main():
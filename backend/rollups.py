@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Per-package telemetry rollups for long-horizon history
+
+The telemetry_rollup_1m/1h/1d tables are maintained by triggers on every
+telemetry insert (see migrations.py), so they keep history after raw rows
+have been cleaned up. Each resolution has its own retention, configurable
+independently of the raw telemetry retention.
+"""
+
+import os
+from datetime import timedelta
+
+from timestamps import MILLISECOND, now_ms
+
+
+# Retention configuration
+RAW_RETENTION = timedelta(hours=float(os.getenv('CHISIFAI_RAW_RETENTION_HOURS', '24')))
+ROLLUP_1M_RETENTION = timedelta(days=float(os.getenv('CHISIFAI_ROLLUP_1M_RETENTION_DAYS', '7')))
+ROLLUP_1H_RETENTION = timedelta(days=float(os.getenv('CHISIFAI_ROLLUP_1H_RETENTION_DAYS', '90')))
+ROLLUP_1D_RETENTION = timedelta(days=float(os.getenv('CHISIFAI_ROLLUP_1D_RETENTION_DAYS', '1825')))
+
+# Rollup tables, finest first
+ROLLUP_TABLES = [
+    ("telemetry_rollup_1m", 60, ROLLUP_1M_RETENTION),
+    ("telemetry_rollup_1h", 3600, ROLLUP_1H_RETENTION),
+    ("telemetry_rollup_1d", 86400, ROLLUP_1D_RETENTION),
+]
+
+# Bucket sizes the chart endpoints accept, finest first, and the rollup each one reads
+RESOLUTIONS = {
+    "1m": {"seconds": 60, "table": "telemetry_rollup_1m", "retention": ROLLUP_1M_RETENTION},
+    "5m": {"seconds": 300, "table": "telemetry_rollup_1m", "retention": ROLLUP_1M_RETENTION},
+    "1h": {"seconds": 3600, "table": "telemetry_rollup_1h", "retention": ROLLUP_1H_RETENTION},
+    "1d": {"seconds": 86400, "table": "telemetry_rollup_1d", "retention": ROLLUP_1D_RETENTION},
+}
+
+
+def bucket_floor(timestamp, seconds):
+    """Truncate an epoch-millisecond timestamp to the start of its bucket"""
+    return timestamp // (seconds * 1000) * seconds * 1000
+
+
+def choose_resolution(start, end, max_points, now=None):
+    """
+    Pick the resolution for a range of epoch-millisecond timestamps: the
+    finest one whose bucket count fits in `max_points` and whose retention
+    still covers `start`. Falls back to the coarsest resolution when none fits.
+    """
+    now = now or now_ms()
+    start = start if start is not None else now - timedelta(hours=24) // MILLISECOND
+    end = end if end is not None else now
+    span = max((end - start) / 1000, 0)
+
+    for name, resolution in RESOLUTIONS.items():
+        if start < now - resolution["retention"] // MILLISECOND:
+            continue
+        if span / resolution["seconds"] <= max_points:
+            return name
+
+    return list(RESOLUTIONS)[-1]
+
+
+def prune_rollups(cursor, now=None):
+    """Delete rollup buckets older than each resolution's retention"""
+    now = now or now_ms()
+    deleted = 0
+    for table, _, retention in ROLLUP_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE bucket < ?", (now - retention // MILLISECOND,))
+        deleted += cursor.rowcount
+    return deleted
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Streaming alert rule engine for Chisifai telemetry
+
+Rules are declared per product and evaluated on every ingested reading with
+O(1) work per rule, using per-package state kept in memory. Supported rule
+types:
+
+- threshold: value above (or below) a limit, optionally sustained for N
+  seconds before opening, with a separate clear level for hysteresis;
+- rate: rate of change per minute above a limit.
+
+An alert opens once per dedup key (package + rule) and stays open until the
+clear condition holds, so a package sitting at 28 °C raises one alert, not
+one per reading. Rules without a clear level stay open until resolved.
+
+Set CHISIFAI_RULES_FILE to a JSON file with the same shape as DEFAULT_RULES
+to override the built-in rules. Readings carry epoch-millisecond timestamps.
+"""
+
+import copy
+import json
+import os
+import threading
+from fnmatch import fnmatch
+
+
+# Alert thresholds for cheesecake shipments
+TEMPERATURE_THRESHOLD = 26.0
+GFORCE_THRESHOLD = 2.5
+IMPACT_CLEAR_GFORCE = 1.5  # normal handling stays around 1 G
+
+# Built-in rules for cheesecake shipments
+DEFAULT_RULES = {
+    "cheesecake": {
+        "match": "*",
+        "rules": [
+            {
+                "id": "temperature-high",
+                "type": "threshold",
+                "metric": "temperature",
+                "above": TEMPERATURE_THRESHOLD,
+                "clear_below": 25.0,
+                "sustain_seconds": 0,
+                "alert_type": "Temperatura Excedida",
+                "message": "Temperatura demasiado alta: {value}°C",
+                "severity": "high",
+            },
+            {
+                "id": "temperature-rise",
+                "type": "rate",
+                "metric": "temperature",
+                "above_per_minute": 3.0,
+                "clear_below_per_minute": 1.0,
+                "alert_type": "Cambio Brusco de Temperatura",
+                "message": "Temperatura subiendo {value}°C/min",
+                "severity": "medium",
+            },
+            {
+                "id": "impact",
+                "type": "threshold",
+                "metric": "g_force",
+                "above": GFORCE_THRESHOLD,
+                # Back to normal handling closes it, so the next impact alerts again
+                "clear_below": IMPACT_CLEAR_GFORCE,
+                "alert_type": "Posible Impacto",
+                "message": "Fuerza G inusual: {value}G",
+                "severity": "high",
+            },
+        ],
+    },
+}
+
+# Position of each metric in a telemetry row (see ingest.reading_to_row)
+METRIC_COLUMNS = {
+    "temperature": 1,
+    "g_force": 2,
+    "battery_level": 6,
+    "signal_strength": 7,
+}
+PACKAGE_COLUMN = 0
+TIMESTAMP_COLUMN = 5
+
+
+def load_rules():
+    """Load the rule configuration from CHISIFAI_RULES_FILE or the built-in defaults"""
+    path = os.getenv('CHISIFAI_RULES_FILE')
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        return json.load(f)
+
+
+def dedup_key(package_id, rule_id):
+    return f"{package_id}:{rule_id}"
+
+
+class RuleEngine:
+    def __init__(self, products=None):
+        self.products = products if products is not None else load_rules()
+        self.rules_by_package = {}
+        self.states = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def rules_for(self, package_id):
+        """Rules of the first product whose pattern matches the package (cached)"""
+        rules = self.rules_by_package.get(package_id)
+        if rules is None:
+            rules = []
+            for product in self.products.values():
+                if fnmatch(package_id, product.get("match", "*")):
+                    rules = product["rules"]
+                    break
+            self.rules_by_package[package_id] = rules
+        return rules
+
+    def load_open_alerts(self, cursor):
+        """Restore which alerts are open, so a restart does not reopen them"""
+        with self.lock:
+            if self.loaded:
+                return
+            cursor.execute('''
+                SELECT dedup_key FROM alerts
+                WHERE dedup_key IS NOT NULL AND (is_resolved = 0 OR is_resolved IS NULL)
+            ''')
+            for (key,) in cursor.fetchall():
+                self.states.setdefault(key, {})["open"] = True
+            self.loaded = True
+
+    def evaluate(self, rows, detected_at):
+        """
+        Evaluate a batch of telemetry rows in order.
+
+        Returns (opened, closed, changes): alert rows to insert (already
+        resolved if they also cleared within the batch), dedup keys of
+        previously open alerts to resolve and the new per-key state. The
+        state is only committed with apply() once the alerts are stored, so
+        a failed write leaves the engine untouched.
+        """
+        opened = []
+        closed = []
+        changes = {}
+        # Position in `opened` of the alerts this batch opened and has not closed
+        opened_in_batch = {}
+
+        with self.lock:
+            for row in rows:
+                package_id = row[PACKAGE_COLUMN]
+                for rule in self.rules_for(package_id):
+                    key = dedup_key(package_id, rule["id"])
+                    state = changes.get(key)
+                    if state is None:
+                        state = copy.copy(self.states.get(key, {}))
+                        changes[key] = state
+
+                    action = self.step(rule, state, row)
+                    if action == "open":
+                        value = state["trigger_value"]
+                        opened_in_batch[key] = len(opened)
+                        opened.append((
+                            package_id,
+                            rule["alert_type"],
+                            rule["message"].format(value=value),
+                            state["trigger_timestamp"],
+                            rule.get("severity", "medium"),
+                            detected_at,
+                            key,
+                            0
+                        ))
+                    elif action == "close":
+                        index = opened_in_batch.pop(key, None)
+                        if index is None:
+                            closed.append(key)
+                        else:
+                            opened[index] = opened[index][:7] + (1,)
+
+        return opened, closed, changes
+
+    def apply(self, changes):
+        with self.lock:
+            self.states.update(changes)
+
+    def step(self, rule, state, row):
+        """Advance one rule's state with one reading; returns 'open', 'close' or None"""
+        timestamp = row[TIMESTAMP_COLUMN]
+        value = row[METRIC_COLUMNS[rule["metric"]]]
+        if value is None:
+            return None
+
+        if rule["type"] == "threshold":
+            breached, cleared = self.threshold_condition(rule, value)
+        elif rule["type"] == "rate":
+            rate = self.rate_per_minute(state, value, timestamp)
+            if rate is None:
+                return None
+            value = round(rate, 2)
+            breached = rate > rule["above_per_minute"]
+            clear_below = rule.get("clear_below_per_minute")
+            cleared = clear_below is not None and rate < clear_below
+        else:
+            return None
+
+        if state.get("open"):
+            if cleared:
+                state["open"] = False
+                state.pop("pending_since", None)
+                return "close"
+            return None
+
+        if not breached:
+            # Condition broken before it was sustained long enough
+            state.pop("pending_since", None)
+            return None
+
+        if "pending_since" not in state:
+            state["pending_since"] = timestamp
+            state["trigger_timestamp"] = timestamp
+            state["trigger_value"] = value
+
+        sustain = rule.get("sustain_seconds", 0)
+        if sustain and (timestamp - state["pending_since"]) / 1000 < sustain:
+            return None
+
+        state["open"] = True
+        state.pop("pending_since", None)
+        return "open"
+
+    def threshold_condition(self, rule, value):
+        """Return (breached, cleared) for a threshold rule with optional hysteresis"""
+        if "above" in rule:
+            breached = value > rule["above"]
+            clear_below = rule.get("clear_below")
+            cleared = clear_below is not None and value < clear_below
+        else:
+            breached = value < rule["below"]
+            clear_above = rule.get("clear_above")
+            cleared = clear_above is not None and value > clear_above
+        return breached, cleared
+
+    def rate_per_minute(self, state, value, timestamp):
+        """Rate of change since the previous reading of this package, per minute"""
+        previous, previous_value = state.get("last_time"), state.get("last_value")
+        if previous is not None and timestamp <= previous:
+            # Out-of-order reading: ignore it for rate purposes
+            return None
+
+        state["last_time"] = timestamp
+        state["last_value"] = value
+        if previous is None:
+            return None
+
+        return (value - previous_value) / ((timestamp - previous) / 60000)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Fast JSON responses for the read endpoints
+
+Endpoints build plain dicts straight from the cursor rows and return them in
+a FastJSONResponse, which FastAPI sends as-is: no pydantic model per row and
+no re-validation against response_model (the models still document the
+schema). orjson is used when installed, the standard json module otherwise.
+
+Measure every read endpoint at 500, 5k and 50k rows with
+
+    python serialization.py --benchmark
+
+or, with pytest-benchmark installed, python -m pytest backend/tests/test_serialization_benchmark.py
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content):
+    """Serialise to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def build_benchmark_database(db_file, n):
+    """Create a migrated database holding `n` packages with one reading each"""
+    import db
+    from migrations import run_migrations
+    from rules import RuleEngine
+    from storage import SQLiteStore
+    from timestamps import to_epoch_ms
+
+    run_migrations(db_file)
+    base = datetime(2024, 1, 1)
+    rows = [
+        (f"PKG-{i:06d}", 20.0 + (i % 80) / 10, 1.0 + (i % 30) / 100,
+         40.0 + (i % 1000) / 1000, -3.0 - (i % 700) / 1000,
+         to_epoch_ms((base + timedelta(seconds=i)).isoformat()), 90.0, -60)
+        for i in range(n)
+    ]
+    conn = db.connect(db_file, isolation_level=None)
+    SQLiteStore().insert_batch(conn, rows, RuleEngine())
+    conn.close()
+
+
+def benchmark_endpoints(n):
+    """URL of each read endpoint for `n` rows (history is capped at MAX_HISTORY_LIMIT)"""
+    import api_server
+
+    limit = min(n, api_server.MAX_HISTORY_LIMIT)
+    return {
+        "/api/telemetry": "/api/telemetry",
+        "/api/location": "/api/location",
+        "/api/temperature": f"/api/temperature?limit={limit}",
+        "/api/gforce": f"/api/gforce?limit={limit}",
+        "/api/alerts": "/api/alerts",
+        "/api/kpis": "/api/kpis",
+    }
+
+
+@contextmanager
+def serving(db_file):
+    """Point the API server's connection pools and data version at another database"""
+    import api_server
+    import db
+
+    original_pools = api_server.db_pool, api_server.reader_pool
+    original_version_file = api_server.data_version.db_file
+
+    api_server.db_pool = db.ConnectionPool(db_file)
+    api_server.reader_pool = db.ReaderPool(api_server.db_pool, client_errors=original_pools[1].client_errors)
+    api_server.data_version.close()
+    api_server.data_version.db_file = db_file
+    try:
+        yield api_server.app
+    finally:
+        api_server.reader_pool.shutdown()
+        api_server.db_pool.close_all()
+        api_server.db_pool, api_server.reader_pool = original_pools
+        api_server.data_version.close()
+        api_server.data_version.db_file = original_version_file
+        api_server.response_cache.clear()
+
+
+def uncached_get(client, url):
+    """GET a read endpoint past the response cache, so the query and serialisation run"""
+    import api_server
+
+    api_server.response_cache.clear()
+    api_server.data_version.bump()
+    return client.get(url)
+
+
+def benchmark(row_counts=(500, 5000, 50000), repeat=5):
+    """
+    Time each read endpoint against a temporary database holding `n`
+    packages with one reading each (history endpoints are capped at
+    MAX_HISTORY_LIMIT rows). Returns {n: {endpoint: {seconds, rows, rowsPerSecond}}}.
+    """
+    from fastapi.testclient import TestClient
+
+    results = {}
+    for n in row_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "benchmark.db")
+            build_benchmark_database(db_file, n)
+
+            with serving(db_file) as app:
+                client = TestClient(app)
+                results[n] = {}
+                for name, url in benchmark_endpoints(n).items():
+                    best = None
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        response = uncached_get(client, url)
+                        elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+                    body = response.json()
+                    count = len(body) if isinstance(body, list) else 1
+                    results[n][name] = {"seconds": best, "rows": count, "rowsPerSecond": count / best}
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai read endpoint serialisation benchmark')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Measure latency and throughput of every read endpoint')
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000, 50000],
+                        help='Packages (rows) in the benchmark database (default: 500 5000 50000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Requests per endpoint; the fastest is reported (default: 5)')
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    print(f"JSON encoder: {'orjson' if orjson is not None else 'json'}")
+    for n, endpoints in benchmark(args.rows, args.repeat).items():
+        for name, result in endpoints.items():
+            print(f"{n:>7} rows  {name:<18} {result['seconds'] * 1000:9.2f} ms  "
+                  f"{result['rows']:>7} rows returned  {result['rowsPerSecond']:>12,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,982 @@
+#!/usr/bin/env python3
+"""
+Storage backends for telemetry, alerts and latest package state
+
+The API server, the population script and the MQTT worker read and write
+through a TelemetryStore instead of issuing SQL against one file, so the raw
+telemetry can be laid out differently without touching the endpoints:
+
+- SQLiteStore (default): everything in DB_FILE, with raw telemetry in one
+  table per day;
+- ShardedStore: raw telemetry in one SQLite file per day under
+  CHISIFAI_SHARD_DIR; latest state, alerts, KPIs and rollups stay in
+  DB_FILE.
+
+Both partition raw telemetry by reading day: range queries only touch the
+days they overlap, and retention drops whole days instead of running a
+DELETE over the raw rows.
+
+Pick one with CHISIFAI_STORAGE=sqlite|sharded. Every method takes the
+caller's connection to DB_FILE (from db.ConnectionPool or the reader pool),
+which also holds the write lock that orders ingest batches.
+
+Check that both backends return the same results with
+
+    python storage.py --conformance
+
+check_hot_path_plans() traces the queries the endpoints run through the
+store and checks that an index serves each one (migrations.py --check-plans).
+"""
+
+import argparse
+import heapq
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+import db
+from ingest import get_rule_engine, write_alerts
+from kpis import expire_kpis, read_kpi_state
+from migrations import (
+    ROLLUP_BUCKETS, kpi_package_upsert, latest_upsert, list_partitions, partition_day,
+    partition_statements, partition_table, rebuild_telemetry_view, rollup_upsert,
+)
+from rollups import prune_rollups
+from rules import TIMESTAMP_COLUMN
+from timestamps import now_ms, parse_epoch_ms, to_epoch_ms, to_iso
+
+
+# Storage configuration
+STORAGE = os.getenv('CHISIFAI_STORAGE', 'sqlite')
+SHARD_DIR = os.getenv('CHISIFAI_SHARD_DIR', os.path.splitext(db.DB_FILE)[0] + '-shards')
+
+# Telemetry row layout shared by the ingest path and the rule engine
+TELEMETRY_FIELDS = (
+    "package_id", "temperature", "g_force", "latitude", "longitude",
+    "timestamp", "battery_level", "signal_strength",
+)
+
+# Columns of package_latest, named like the telemetry table
+LATEST_COLUMNS = """
+    telemetry_id AS id, package_id, temperature, g_force, latitude, longitude,
+    timestamp, battery_level, signal_strength
+"""
+
+
+def empty_ack():
+    return {"accepted": 0, "alerts": 0, "resolved": 0, "firstId": None, "lastId": None}
+
+
+def telemetry_conditions(since_id=None, since=None, package_id=None, start=None, end=None, head=None,
+                         time_column='timestamp'):
+    """Build the WHERE clause shared by the telemetry and rollup range queries"""
+    conditions = []
+    params = []
+    if since is not None and since_id is not None:
+        # Keyset cursor: after (since, since_id) in (timestamp, id) order
+        conditions.append(f"{time_column} >= ? AND ({time_column} > ? OR id > ?)")
+        params.extend([since, since, since_id])
+        since = since_id = None
+    if since_id is not None:
+        conditions.append("id > ?")
+        params.append(since_id)
+    if head is not None:
+        # Unary + keeps the planner on the timestamp indexes
+        conditions.append("+id <= ?")
+        params.append(head)
+    if since is not None:
+        conditions.append(f"{time_column} > ?")
+        params.append(since)
+    if package_id is not None:
+        conditions.append("package_id = ?")
+        params.append(package_id)
+    if start is not None:
+        conditions.append(f"{time_column} >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{time_column} <= ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def history_order(since_id, since):
+    """Cursor reads go oldest first so clients can append; plain reads newest first"""
+    if since is not None:
+        return "ORDER BY timestamp, id"
+    if since_id is not None:
+        return "ORDER BY id"
+    return "ORDER BY timestamp DESC"
+
+
+class TelemetryStore:
+    """
+    Repository interface for telemetry, alerts and latest state.
+
+    Reads return sqlite3.Row objects (or an executed cursor over them) with
+    the telemetry/alerts column names; timestamps, range bounds and cutoffs
+    are UTC epoch milliseconds.
+    """
+
+    # Telemetry
+
+    def insert_batch(self, conn, rows, engine=None):
+        """Store rows laid out as TELEMETRY_FIELDS and apply the alert rules; returns the ingest ack"""
+        raise NotImplementedError
+
+    def telemetry_head(self, conn):
+        """Newest telemetry id (0 when empty)"""
+        raise NotImplementedError
+
+    def history(self, conn, column, since_id=None, since=None, package_id=None, start=None, end=None, limit=500):
+        """
+        One column's readings as (id, timestamp, column, package_id) rows plus
+        the head id they were read against, ordered as history_order()
+        """
+        raise NotImplementedError
+
+    def telemetry_since(self, conn, since_id, limit):
+        """Full telemetry rows after an id, oldest first"""
+        raise NotImplementedError
+
+    def newest_timestamp(self, conn):
+        """Timestamp of the newest stored reading, or None"""
+        raise NotImplementedError
+
+    def series(self, conn, column, package_id=None, start=None, end=None):
+        """One column's readings in a range, ordered by package and time"""
+        raise NotImplementedError
+
+    def route(self, conn, package_id, start, end):
+        """A package's positions in a range, in time order"""
+        raise NotImplementedError
+
+    def buckets(self, conn, column, table, seconds, package_id=None, start=None, end=None):
+        """Aggregate a rollup table into `seconds`-wide buckets per package"""
+        raise NotImplementedError
+
+    def cleanup(self, conn, cutoff):
+        """Remove raw telemetry, stale state and old rollups; returns what was removed"""
+        raise NotImplementedError
+
+    # Latest state
+
+    def latest(self, conn, bbox=None):
+        """Latest reading of every package, or of those inside (min_lng, min_lat, max_lng, max_lat)"""
+        raise NotImplementedError
+
+    def latest_timestamp(self, conn, package_id):
+        """Timestamp of a package's latest reading, or None if unknown"""
+        raise NotImplementedError
+
+    def kpi_state(self, conn):
+        """The incrementally maintained KPI counters"""
+        raise NotImplementedError
+
+    # Alerts
+
+    def active_alerts(self, conn, limit):
+        """Most recent unresolved alerts first"""
+        raise NotImplementedError
+
+    def alerts_head(self, conn):
+        """Newest alert id (0 when empty)"""
+        raise NotImplementedError
+
+    def alerts_since(self, conn, since_id, limit):
+        """Unresolved alerts after an id, oldest first"""
+        raise NotImplementedError
+
+    def resolved_alerts(self, conn, alert_ids):
+        """Which of the given alert ids are resolved"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources besides the caller's connections"""
+
+
+def overlapping(days, start=None, end=None, newest_first=False):
+    """The (day, value) items of a {day: value} map whose day overlaps [start, end]"""
+    selected = [
+        (day, value) for day, value in days.items()
+        if (start is None or day >= partition_day(start)) and (end is None or day <= partition_day(end))
+    ]
+    if newest_first:
+        selected.reverse()
+    return selected
+
+
+def partition_insert(table):
+    return f"""
+        INSERT INTO {table} (id, {", ".join(TELEMETRY_FIELDS)})
+        VALUES (:id, {", ".join(":" + field for field in TELEMETRY_FIELDS)})
+    """
+
+
+# What the telemetry insert triggers did for each reading, run with executemany
+STATE_STATEMENTS = [latest_upsert(":"), kpi_package_upsert(":")] + [
+    rollup_upsert(table, bucket, ":") for table, bucket in ROLLUP_BUCKETS
+]
+
+
+class SQLiteStore(TelemetryStore):
+    """
+    Everything in DB_FILE. Raw telemetry lives in one table per reading day
+    (telemetry_YYYYMMDD), so range queries only read the days they overlap
+    and retention drops whole tables; the telemetry view spans them all.
+
+    Subclasses can keep the partitions elsewhere by overriding partitions(),
+    write_partition(), discard() and drop_partitions().
+    """
+
+    # Readings written to other files can be seen before DB_FILE commits
+    # their batch, so reads then stop at the committed head id
+    filter_head = False
+
+    # Day partitions
+
+    def partitions(self, conn, start=None, end=None, newest_first=False):
+        """(connection, table) of each partition overlapping [start, end], oldest first"""
+        return [(conn, table) for _, table in overlapping(list_partitions(conn), start, end, newest_first)]
+
+    def write_partition(self, conn, day, readings):
+        """Insert a day's readings inside the batch transaction; returns what discard() needs"""
+        table = partition_table(day)
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if exists is None:
+            for statement in partition_statements(table):
+                conn.execute(statement)
+            rebuild_telemetry_view(conn)
+        conn.executemany(partition_insert(table), readings)
+
+    def discard(self, written, first_id):
+        """Undo partition writes of a failed batch that its rollback does not cover"""
+
+    def drop_partitions(self, conn, cutoff):
+        """Drop partitions older than the cutoff's day; returns (rows deleted, partitions dropped)"""
+        cutoff_day = partition_day(cutoff)
+        deleted = dropped = 0
+        for day, table in list_partitions(conn).items():
+            if day < cutoff_day:
+                conn.execute(f"DROP TABLE {table}")
+                dropped += 1
+            elif day == cutoff_day:
+                # Only the day the cutoff falls in needs a row-level delete
+                deleted += conn.execute(f"DELETE FROM {table} WHERE timestamp < ?", (cutoff,)).rowcount
+        if dropped:
+            rebuild_telemetry_view(conn)
+        return deleted, dropped
+
+    # Telemetry
+
+    def insert_batch(self, conn, rows, engine=None):
+        """
+        Insert a batch of telemetry rows in a single transaction, opening and
+        closing alerts as the rule engine dictates.
+
+        Returns a dict with the number of rows written and the id range
+        assigned to them, which is contiguous because the batch holds the
+        write lock.
+        """
+        rows = list(rows)
+        if not rows:
+            return empty_ack()
+
+        engine = engine or get_rule_engine()
+        # Alerts record when they were raised, which feeds the time-to-detection KPI
+        detected_at = now_ms()
+        days = [partition_day(row[TIMESTAMP_COLUMN]) for row in rows]
+        cursor = conn.cursor()
+        written = []
+        first_id = None
+
+        try:
+            # Take the write lock up front so the id range cannot interleave, and
+            # so rules are evaluated in the same order the batches are stored
+            cursor.execute("BEGIN IMMEDIATE")
+            engine.load_open_alerts(cursor)
+            alerts, resolved, changes = engine.evaluate(rows, detected_at)
+
+            first_id = self.telemetry_head(conn) + 1
+            readings = [dict(zip(TELEMETRY_FIELDS, row), id=first_id + i) for i, row in enumerate(rows)]
+            last_id = readings[-1]["id"]
+
+            by_day = {}
+            for day, reading in zip(days, readings):
+                by_day.setdefault(day, []).append(reading)
+            for day, day_readings in by_day.items():
+                written.append(self.write_partition(conn, day, day_readings))
+
+            # Latest state, KPIs and rollups
+            for statement in STATE_STATEMENTS:
+                cursor.executemany(statement, readings)
+            write_alerts(cursor, alerts, resolved, detected_at)
+
+            cursor.execute("UPDATE telemetry_sequence SET last_id = ? WHERE id = 1", (last_id,))
+            cursor.execute("COMMIT")
+        except Exception:
+            # Whatever failed, leave the connection outside a transaction for the next batch
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            self.discard(written, first_id)
+            raise
+
+        # The engine only moves on once its alerts are stored
+        engine.apply(changes)
+
+        return {
+            "accepted": len(rows),
+            "alerts": len(alerts),
+            "resolved": len(resolved),
+            "firstId": first_id,
+            "lastId": last_id,
+            "receivedAt": to_iso(detected_at)
+        }
+
+    def telemetry_head(self, conn):
+        return conn.execute("SELECT last_id FROM telemetry_sequence WHERE id = 1").fetchone()[0]
+
+    def history(self, conn, column, since_id=None, since=None, package_id=None, start=None, end=None, limit=500):
+        # Read the head and the rows from one snapshot so the cursor has no gaps
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        head = self.telemetry_head(conn)
+
+        where, params = telemetry_conditions(since_id, since, package_id, start, end,
+                                             head if self.filter_head else None)
+        query = f"""
+            SELECT id, timestamp, {column}, package_id FROM {{table}}
+            {where}
+            {history_order(since_id, since)}
+            LIMIT ?
+        """
+
+        # Ids follow arrival rather than reading time, so any day can hold newer ids
+        if since_id is not None and since is None:
+            pages = [
+                partition.execute(query.format(table=table), params + [limit]).fetchall()
+                for partition, table in self.partitions(conn)
+            ]
+            return list(islice(heapq.merge(*pages, key=lambda row: row['id']), limit)), head
+
+        # Days are disjoint in time: walk them in order until the page is full
+        lower = max(filter(None, (since, start)), default=None)
+        rows = []
+        for partition, table in self.partitions(conn, lower, end, newest_first=since is None):
+            rows.extend(partition.execute(query.format(table=table), params + [limit - len(rows)]).fetchall())
+            if len(rows) >= limit:
+                break
+        return rows, head
+
+    def telemetry_since(self, conn, since_id, limit):
+        where, params = telemetry_conditions(since_id, head=self.telemetry_head(conn) if self.filter_head else None)
+        pages = [
+            partition.execute(f"SELECT * FROM {table} {where} ORDER BY id LIMIT ?", params + [limit]).fetchall()
+            for partition, table in self.partitions(conn)
+        ]
+        return list(islice(heapq.merge(*pages, key=lambda row: row['id']), limit))
+
+    def newest_timestamp(self, conn):
+        for partition, table in self.partitions(conn, newest_first=True):
+            newest = partition.execute(f"SELECT MAX(timestamp) FROM {table}").fetchone()[0]
+            if newest is not None:
+                return newest
+        return None
+
+    def series(self, conn, column, package_id=None, start=None, end=None):
+        where, params = telemetry_conditions(package_id=package_id, start=start, end=end,
+                                             head=self.telemetry_head(conn) if self.filter_head else None)
+        pages = [
+            partition.execute(f"""
+                SELECT timestamp, {column}, package_id FROM {table}
+                {where}
+                ORDER BY package_id, timestamp
+            """, params).fetchall()
+            for partition, table in self.partitions(conn, start, end)
+        ]
+        return list(heapq.merge(*pages, key=lambda row: (row['package_id'], row['timestamp'])))
+
+    def route(self, conn, package_id, start, end):
+        where, params = telemetry_conditions(package_id=package_id, start=start, end=end,
+                                             head=self.telemetry_head(conn) if self.filter_head else None)
+        rows = []
+        for partition, table in self.partitions(conn, start, end):
+            # Served by the partition's (package_id, timestamp) index
+            rows.extend(partition.execute(f"""
+                SELECT latitude, longitude, timestamp FROM {table}
+                {where}
+                ORDER BY timestamp
+            """, params).fetchall())
+        return rows
+
+    def buckets(self, conn, column, table, seconds, package_id=None, start=None, end=None):
+        where, params = telemetry_conditions(package_id=package_id, start=start, end=end, time_column='bucket')
+        return conn.execute(f"""
+            SELECT package_id,
+                   bucket / ? * ? AS bucket_start,
+                   MIN({column}_min) AS min_value,
+                   MAX({column}_max) AS max_value,
+                   SUM({column}_sum) / SUM(count) AS avg_value,
+                   SUM(count) AS count
+            FROM {table}
+            {where}
+            GROUP BY package_id, bucket_start
+            ORDER BY bucket_start, package_id
+        """, [seconds * 1000, seconds * 1000] + params).fetchall()
+
+    def cleanup(self, conn, cutoff):
+        cursor = conn.cursor()
+        try:
+            # Holding the write lock keeps writers out of the partitions being dropped
+            cursor.execute("BEGIN IMMEDIATE")
+            deleted = self.cleanup_state(cursor, cutoff)
+            rows, dropped = self.drop_partitions(conn, cutoff)
+            cursor.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+            raise
+        return {"deleted": deleted + rows, "droppedPartitions": dropped}
+
+    def cleanup_state(self, cursor, cutoff):
+        """Expire latest state, alerts, KPIs and rollups along with the raw rows"""
+        cursor.execute("DELETE FROM package_latest WHERE timestamp < ?", (cutoff,))
+        # Open rule alerts stay until their clear condition resolves them
+        cursor.execute('''
+            DELETE FROM alerts
+            WHERE timestamp < ?
+              AND NOT (dedup_key IS NOT NULL AND (is_resolved = 0 OR is_resolved IS NULL))
+        ''', (cutoff,))
+        deleted = cursor.rowcount
+
+        # Keep the KPIs over the same window as the retained telemetry
+        expire_kpis(cursor, cutoff)
+
+        # Delete rollup buckets past their own retention
+        return deleted + prune_rollups(cursor)
+
+    # Latest state
+
+    def latest(self, conn, bbox=None):
+        if bbox is None:
+            return conn.execute(f"""
+                SELECT {LATEST_COLUMNS}
+                FROM package_latest
+                ORDER BY timestamp DESC, package_id
+            """)
+
+        # The R*Tree stores 32-bit floats, so it narrows the candidates and the
+        # exact coordinates are checked on package_latest
+        min_lng, min_lat, max_lng, max_lat = bbox
+        return conn.execute("""
+            SELECT p.telemetry_id AS id, p.package_id, p.temperature, p.g_force, p.latitude, p.longitude,
+                   p.timestamp, p.battery_level, p.signal_strength
+            FROM package_location l
+            JOIN package_latest p ON p.rowid = l.id
+            WHERE l.max_lat >= ? AND l.min_lat <= ? AND l.max_lng >= ? AND l.min_lng <= ?
+              AND p.latitude BETWEEN ? AND ? AND p.longitude BETWEEN ? AND ?
+            ORDER BY p.timestamp DESC, p.package_id
+        """, (min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng))
+
+    def latest_timestamp(self, conn, package_id):
+        row = conn.execute("SELECT timestamp FROM package_latest WHERE package_id = ?", (package_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def kpi_state(self, conn):
+        return read_kpi_state(conn.cursor())
+
+    # Alerts
+
+    def active_alerts(self, conn, limit):
+        return conn.execute("""
+            SELECT * FROM alerts
+            WHERE is_resolved = 0 OR is_resolved IS NULL
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+    def alerts_head(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM alerts").fetchone()[0]
+
+    def alerts_since(self, conn, since_id, limit):
+        return conn.execute("""
+            SELECT * FROM alerts
+            WHERE id > ? AND (is_resolved = 0 OR is_resolved IS NULL)
+            ORDER BY id
+            LIMIT ?
+        """, (since_id, limit)).fetchall()
+
+    def resolved_alerts(self, conn, alert_ids):
+        placeholders = ",".join("?" * len(alert_ids))
+        rows = conn.execute(f"SELECT id FROM alerts WHERE id IN ({placeholders}) AND is_resolved = 1",
+                            list(alert_ids)).fetchall()
+        return [row[0] for row in rows]
+
+
+SHARD_PREFIX = "telemetry-"
+SHARD_SUFFIX = ".db"
+
+# PRAGMA user_version of shards with epoch-millisecond timestamps; older ones hold ISO text
+SHARD_VERSION = 1
+
+
+class ShardedStore(SQLiteStore):
+    """
+    Raw telemetry in one file per day (telemetry-YYYY-MM-DD.db, by reading
+    timestamp), each holding a single telemetry table; everything else in
+    DB_FILE as with SQLiteStore. Writers hold DB_FILE's write lock while
+    they touch the shards, so shard writes never contend, and a reading is
+    only visible once DB_FILE commits the id sequence past it.
+    """
+
+    filter_head = True
+
+    def __init__(self, shard_dir=SHARD_DIR):
+        self.shard_dir = shard_dir
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def shard_path(self, day):
+        return os.path.join(self.shard_dir, f"{SHARD_PREFIX}{day}{SHARD_SUFFIX}")
+
+    def days(self):
+        """Days that have a shard, oldest first, mapped to the shard file's inode"""
+        shards = {}
+        try:
+            with os.scandir(self.shard_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(SHARD_PREFIX) and entry.name.endswith(SHARD_SUFFIX):
+                        shards[entry.name[len(SHARD_PREFIX):-len(SHARD_SUFFIX)]] = entry.inode()
+        except FileNotFoundError:
+            pass
+        return dict(sorted(shards.items()))
+
+    def create_shard(self, day):
+        """Create a day's file with its schema in place before anyone can list it"""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        path = self.shard_path(day)
+        pending = f"{path}.{os.getpid()}.tmp"
+        conn = db.connect(pending)
+        try:
+            for statement in partition_statements("telemetry"):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SHARD_VERSION}")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(pending, path)
+
+    def shard(self, day, inode=None, create=False):
+        """The calling thread's connection to a day's shard"""
+        path = self.shard_path(day)
+        if inode is None:
+            if create and not os.path.exists(path):
+                self.create_shard(day)
+            inode = os.stat(path).st_ino
+
+        cache = self.local.__dict__.setdefault('shards', {})
+        cached = cache.get(day)
+        if cached is not None and cached[1] == inode:
+            return cached[0]
+        if cached is not None:
+            self.release(cached[0])
+
+        # mode=rw: a shard dropped since it was listed must not be recreated empty
+        conn = db.connect(f"{Path(path).absolute().as_uri()}?mode=rw", uri=True,
+                          isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        cache[day] = (conn, inode)
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def release(self, conn):
+        with self.lock:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        conn.close()
+
+    def partitions(self, conn, start=None, end=None, newest_first=False):
+        days = self.days()
+
+        # Forget this thread's connections to dropped shards
+        cache = self.local.__dict__.setdefault('shards', {})
+        for day in [day for day in cache if day not in days]:
+            self.release(cache.pop(day)[0])
+
+        partitions = []
+        for day, inode in overlapping(days, start, end, newest_first):
+            try:
+                partitions.append((self.shard(day, inode), "telemetry"))
+            except sqlite3.OperationalError:
+                continue  # dropped while listing
+        return partitions
+
+    def write_partition(self, conn, day, readings):
+        shard = self.shard(day, create=True)
+        with shard:
+            shard.execute("BEGIN IMMEDIATE")
+            shard.executemany(partition_insert("telemetry"), readings)
+        return shard
+
+    def discard(self, written, first_id):
+        # The ids will be handed out again, so drop the rows already committed
+        for shard in written:
+            try:
+                with shard:
+                    shard.execute("DELETE FROM telemetry WHERE id >= ?", (first_id,))
+            except sqlite3.Error as e:
+                print(f"✗ Could not discard readings from id {first_id} in a shard: {e}")
+
+    def drop_partitions(self, conn, cutoff):
+        cutoff_day = partition_day(cutoff)
+        deleted = dropped = 0
+        for day in self.days():
+            if day < cutoff_day:
+                path = self.shard_path(day)
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.remove(path + suffix)
+                    except FileNotFoundError:
+                        pass
+                dropped += 1
+            elif day == cutoff_day:
+                shard = self.shard(day)
+                with shard:
+                    shard.execute("BEGIN IMMEDIATE")
+                    deleted += shard.execute("DELETE FROM telemetry WHERE timestamp < ?", (cutoff,)).rowcount
+        return deleted, dropped
+
+    def convert_iso_shards(self):
+        """
+        Rewrite shards written before migration 10 (ISO text timestamps, one
+        file per local day) as epoch-millisecond shards per UTC day. Run it
+        with the API and the workers stopped. Returns the readings converted.
+        """
+        sources = []
+        for day in self.days():
+            path = self.shard_path(day)
+            conn = db.connect(path)
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+            finally:
+                # Closing the last connection checkpoints the WAL into the file
+                conn.close()
+            if version < SHARD_VERSION:
+                os.replace(path, f"{path}.iso")
+                sources.append(f"{path}.iso")
+
+        converted = 0
+        for source in sources:
+            conn = db.connect(source)
+            conn.row_factory = sqlite3.Row
+            try:
+                by_day = {}
+                skipped = 0
+                for row in conn.execute(f"SELECT id, {', '.join(TELEMETRY_FIELDS)} FROM telemetry"):
+                    reading = dict(row)
+                    reading["timestamp"] = parse_epoch_ms(reading["timestamp"])
+                    if reading["timestamp"] is None:
+                        skipped += 1
+                        continue
+                    by_day.setdefault(partition_day(reading["timestamp"]), []).append(reading)
+            finally:
+                conn.close()
+
+            for day, readings in by_day.items():
+                shard = self.shard(day, create=True)
+                with shard:
+                    shard.execute("BEGIN IMMEDIATE")
+                    shard.executemany(partition_insert("telemetry"), readings)
+                converted += len(readings)
+            if skipped:
+                print(f"✗ Dropped {skipped} readings with unparseable timestamps from {source}")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(source + suffix):
+                    os.remove(source + suffix)
+        return converted
+
+    def close(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+
+STORES = {
+    "sqlite": SQLiteStore,
+    "sharded": ShardedStore,
+}
+
+
+def open_store(kind=None):
+    """Create the storage backend selected by CHISIFAI_STORAGE"""
+    kind = kind or STORAGE
+    if kind not in STORES:
+        raise ValueError(f"CHISIFAI_STORAGE must be one of {', '.join(STORES)}, not {kind!r}")
+    return STORES[kind]()
+
+
+def conformance_workload(store, db_file):
+    """
+    Drive a store through ingest, every read and a retention cleanup.
+    Returns the results as plain values keyed by check name, the checks
+    whose invariants failed, and what the cleanup removed.
+    """
+    from migrations import run_migrations
+    from rules import RuleEngine
+
+    run_migrations(db_file)
+    conn = db.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    engine = RuleEngine()
+
+    # Three days of readings from five packages, with breaches and a late reading
+    base = datetime(2024, 3, 1, 22, 0)
+    rows = []
+    for i in range(240):
+        timestamp = base + timedelta(minutes=15 * i)
+        package = f"PKG-{i % 5:03d}"
+        temperature = 28.0 if 40 <= i < 60 and i % 5 == 1 else 20.0 + (i % 7) / 2
+        g_force = 3.1 if i == 100 else 1.0 + (i % 4) / 10
+        rows.append((package, temperature, g_force, 40.4 + (i % 9) / 100, -3.7 - (i % 11) / 100,
+                     to_epoch_ms(timestamp.isoformat()), 95.0 - i / 10, -60 - i % 20))
+    late = ("PKG-002", 21.5, 1.1, 40.41, -3.71, to_epoch_ms((base + timedelta(hours=3)).isoformat()), 90.0, -70)
+
+    def values(rows):
+        return [tuple(row) for row in rows]
+
+    results = {}
+    broken = []
+    acks = [store.insert_batch(conn, rows[:150], engine),
+            store.insert_batch(conn, rows[150:] + [late], engine)]
+    results["insert acks"] = [(ack["accepted"], ack["alerts"], ack["resolved"], ack["firstId"], ack["lastId"])
+                              for ack in acks]
+    end = rows[-1][5]
+
+    results["latest"] = values(store.latest(conn))
+    results["latest in bbox"] = values(store.latest(conn, (-3.75, 40.40, -3.70, 40.45)))
+    results["latest timestamp"] = store.latest_timestamp(conn, "PKG-003")
+    results["unknown package"] = store.latest_timestamp(conn, "PKG-999")
+    results["telemetry head"] = store.telemetry_head(conn)
+    results["newest timestamp"] = store.newest_timestamp(conn)
+
+    rows_, head = store.history(conn, "temperature", limit=40)
+    results["history newest first"] = (values(rows_), head)
+    rows_, head = store.history(conn, "g_force", package_id="PKG-001", start=rows[30][5], end=rows[200][5], limit=25)
+    results["history range"] = (values(rows_), head)
+    rows_, head = store.history(conn, "temperature", since=rows[90][5], limit=60)
+    results["history since"] = (values(rows_), head)
+    conn.rollback()
+
+    # Paging by id must visit every reading exactly once
+    seen, since_id = [], 0
+    while True:
+        rows_, head = store.history(conn, "temperature", since_id=since_id, limit=37)
+        rows_ = values(rows_)
+        conn.rollback()
+        seen.extend(row[0] for row in rows_)
+        if len(rows_) < 37:
+            break
+        since_id = rows_[-1][0]
+    results["history since_id pages"] = seen
+    if sorted(seen) != list(range(1, len(rows) + 2)):
+        broken.append("history since_id pages")
+
+    results["telemetry since"] = values(store.telemetry_since(conn, 200, 1000))
+    results["series"] = values(store.series(conn, "temperature", start=rows[10][5], end=end))
+    results["route"] = values(store.route(conn, "PKG-002", rows[0][5], end))
+    results["buckets"] = values(store.buckets(conn, "temperature", "telemetry_rollup_1h", 3600,
+                                              start=rows[0][5], end=end))
+    kpis = store.kpi_state(conn)
+    kpis.pop("detectionSeconds")  # depends on the wall clock at ingest
+    results["kpi state"] = kpis
+
+    alert_columns = "id, package_id, alert_type, message, timestamp, severity, is_resolved, dedup_key"
+    results["active alerts"] = [tuple(row[c.strip()] for c in alert_columns.split(','))
+                                for row in store.active_alerts(conn, 10)]
+    results["alerts since"] = [tuple(row[c.strip()] for c in alert_columns.split(','))
+                               for row in store.alerts_since(conn, 0, 100)]
+    results["alerts head"] = store.alerts_head(conn)
+
+    # Retention cut in the middle of the third day
+    cutoff = to_epoch_ms((base + timedelta(days=1, hours=12)).isoformat())
+    removed = store.cleanup(conn, cutoff)
+    results["cleanup"] = removed
+    # The first two days lie wholly before the cutoff and go without a row-level delete
+    if removed["droppedPartitions"] != 2:
+        broken.append("cleanup")
+    rows_, _ = store.history(conn, "temperature", since_id=0, limit=1000)
+    rows_ = values(rows_)
+    conn.rollback()
+    results["after cleanup"] = rows_
+    if not rows_ or any(row[1] < cutoff for row in rows_):
+        broken.append("after cleanup")
+    results["latest after cleanup"] = values(store.latest(conn))
+    results["newest after cleanup"] = store.newest_timestamp(conn)
+
+    conn.close()
+    store.close()
+    return results, broken, removed
+
+
+def check_conformance(kinds=None):
+    """
+    Run the conformance workload on every backend against temporary
+    databases and compare each with SQLiteStore. Returns the names of the
+    checks that differ, per backend.
+    """
+    kinds = kinds or list(STORES)
+    outcomes = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in ["sqlite"] + [kind for kind in kinds if kind != "sqlite"]:
+            directory = os.path.join(tmp, kind)
+            os.makedirs(directory)
+            store = ShardedStore(os.path.join(directory, "shards")) if kind == "sharded" else STORES[kind]()
+            outcomes[kind] = conformance_workload(store, os.path.join(directory, "chisifai.db"))
+
+    reference = outcomes["sqlite"][0]
+    failures = {}
+    for kind, (results, broken, removed) in outcomes.items():
+        failures[kind] = [name for name, value in results.items() if value != reference[name] or name in broken]
+        print(f"{kind}: cleanup removed {removed['deleted']} rows and {removed['droppedPartitions']} partitions")
+        for name in results:
+            print(f"  {'✗' if name in failures[kind] else '✓'} {name}")
+    return {kind: names for kind, names in failures.items() if names}
+
+
+def hot_path_calls(store, conn, start, end):
+    """The storage calls behind each read endpoint, the stream, ingest and the retention cleanup"""
+    from rules import RuleEngine
+
+    return {
+        "/api/telemetry": lambda: store.latest(conn).fetchall(),
+        "/api/location?bbox": lambda: store.latest(conn, (-4.0, 40.0, -3.0, 41.0)).fetchall(),
+        "/api/packages/{id}": lambda: store.latest_timestamp(conn, "PKG-001"),
+        "/api/temperature": lambda: store.history(conn, "temperature"),
+        "/api/temperature?since_id": lambda: store.history(conn, "temperature", since_id=10),
+        "/api/temperature?since": lambda: store.history(conn, "temperature", since=start),
+        "/api/temperature?since&since_id": lambda: store.history(conn, "temperature", since_id=10, since=start),
+        "/api/gforce?package_id&start&end": lambda: store.history(conn, "g_force", package_id="PKG-001",
+                                                                  start=start, end=end),
+        "/api/gforce?downsample=lttb&package_id": lambda: store.series(conn, "g_force", "PKG-001", start, end),
+        "/api/packages/{id}/route": lambda: store.route(conn, "PKG-001", start, end),
+        "/api/temperature?bucket": lambda: store.buckets(conn, "temperature", "telemetry_rollup_1m", 300,
+                                                         start=start, end=end),
+        "/api/gforce?bucket&package_id": lambda: store.buckets(conn, "g_force", "telemetry_rollup_1h", 3600,
+                                                               "PKG-001", start, end),
+        "/api/stream (telemetry)": lambda: store.telemetry_since(conn, 10, 1000),
+        "/api/stream (alerts)": lambda: store.alerts_since(conn, 0, 1000),
+        "/api/stream (resolved)": lambda: store.resolved_alerts(conn, [1, 2, 3]),
+        "/api/alerts": lambda: store.active_alerts(conn, 10),
+        "/api/kpis": lambda: store.kpi_state(conn),
+        "ingest": lambda: store.insert_batch(conn, [("PKG-001", 29.0, 3.0, 40.4, -3.7, end, 90.0, -60),
+                                                    ("PKG-001", 20.0, 1.0, 40.4, -3.7, end + 1000, 90.0, -60)],
+                                             RuleEngine()),
+        # Drops the first day and trims the second
+        "cleanup_old_data": lambda: store.cleanup(conn, (start + end) // 2),
+    }
+
+
+def traced_queries(conn, call):
+    """The distinct data statements a storage call runs, with their parameters inlined"""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+        if conn.in_transaction:
+            conn.rollback()
+    return [
+        sql for sql in dict.fromkeys(statements)
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH"))
+        and "sqlite_master" not in sql
+    ]
+
+
+def check_hot_path_plans(db_file=None):
+    """
+    Trace the hot-path storage calls on a scratch database (a copy of
+    db_file when given, so its statistics apply) and check every query they
+    run with check_query_plans(). Returns the failures as "call #n" -> plan.
+    """
+    from migrations import check_query_plans, run_migrations
+    from rules import RuleEngine
+
+    hour = 3_600_000
+    start = to_epoch_ms("2024-03-01T22:00:00Z")
+    end = start + 48 * hour
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = os.path.join(tmp, "chisifai.db")
+        if db_file:
+            source, target = db.connect(db_file), db.connect(scratch)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+        run_migrations(scratch)
+
+        conn = db.connect(scratch)
+        conn.row_factory = sqlite3.Row
+        store = SQLiteStore()
+        try:
+            rows = [(f"PKG-{i % 5:03d}", 20.0 + i % 9, 1.0 + (i % 4) / 10, 40.4, -3.7, start + i * hour // 4,
+                     90.0, -60) for i in range(200)]
+            store.insert_batch(conn, rows, RuleEngine())
+
+            failures = {}
+            for name, call in hot_path_calls(store, conn, start, end).items():
+                queries = traced_queries(conn, call)
+                if name == "cleanup_old_data":
+                    # Retention also sweeps the per-package KPI and alert tables; the hot part is the telemetry
+                    queries = [sql for sql in queries if "telemetry" in sql]
+                if not queries:
+                    failures[name] = ["ran no query"]
+                    continue
+                failures.update(check_query_plans(conn, {f"{name} #{i}": (sql, ()) for i, sql in enumerate(queries)}))
+        finally:
+            conn.close()
+            store.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai storage backends')
+    parser.add_argument('--conformance', action='store_true',
+                        help='Run the same workload on every backend and compare the results')
+    parser.add_argument('--backend', choices=list(STORES), action='append',
+                        help='Backend to check (default: all)')
+    parser.add_argument('--convert-shards', action='store_true',
+                        help='Convert shards with ISO timestamps (before schema version 10) to epoch milliseconds')
+
+    args = parser.parse_args()
+
+    if args.convert_shards:
+        converted = ShardedStore().convert_iso_shards()
+        print(f"✓ Converted {converted} readings in {SHARD_DIR}")
+        return
+
+    if not args.conformance:
+        parser.print_help()
+        return
+
+    failures = check_conformance(args.backend)
+    if failures:
+        sys.exit(1)
+    print("✓ Every backend matches SQLiteStore")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Server-Sent Events fan-out for the Chisifai dashboard
+
+A single producer polls the database for new rows and broadcasts the deltas
+to every connected subscriber, so N open dashboards cost one query stream
+instead of N sets of polls.
+"""
+
+import asyncio
+import json
+
+from fastapi.concurrency import run_in_threadpool
+
+
+# Configuration
+POLL_INTERVAL = 1.0  # seconds between producer polls
+HEARTBEAT_INTERVAL = 15.0  # seconds of silence before a keepalive comment
+SUBSCRIBER_QUEUE_SIZE = 100  # events buffered per subscriber before it must resync
+
+
+def format_event(event, data):
+    """Encode one SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+
+    def offer(self, message):
+        """Queue a message; a subscriber that falls behind is told to resync"""
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class StreamBroadcaster:
+    """
+    Shared producer for the push stream. `poll(cursor)` runs on the threadpool,
+    advances the cursor dict in place and returns a list of (event, data)
+    deltas. The producer only runs while someone is subscribed.
+    """
+
+    def __init__(self, poll, interval=POLL_INTERVAL):
+        self.poll = poll
+        self.interval = interval
+        self.cursor = {}
+        self.subscribers = set()
+        self.task = None
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._produce())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        """Fan a single event out to every subscriber"""
+        message = format_event(event, data)
+        for subscriber in list(self.subscribers):
+            subscriber.offer(message)
+
+    async def _produce(self):
+        while self.subscribers:
+            try:
+                deltas = await run_in_threadpool(self.poll, self.cursor)
+            except Exception as e:
+                print(f"✗ Error polling stream deltas: {e}")
+                deltas = []
+
+            for event, data in deltas:
+                self.publish(event, data)
+
+            await asyncio.sleep(self.interval)
+
+        # Start from the current head again once somebody resubscribes
+        self.cursor.clear()
+
+    async def events(self, request):
+        """Async generator of SSE messages for one client connection"""
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if subscriber.lagged:
+                    # The client refetches full state and reconnects
+                    yield format_event("resync", {})
+                    break
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def metrics(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "producerRunning": self.task is not None and not self.task.done(),
+            "cursor": dict(self.cursor),
+        }
@@ -0,0 +1,49 @@
+"""
+Shared setup for the backend tests
+
+Points every database path at a temporary directory before any backend
+module is imported, so the tests never touch chisifai.db.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="chisifai-tests-")
+
+os.environ["CHISIFAI_DB_FILE"] = os.path.join(SCRATCH_DIR, "chisifai.db")
+os.environ["CHISIFAI_SHARD_DIR"] = os.path.join(SCRATCH_DIR, "chisifai-shards")
+os.environ.pop("CHISIFAI_RULES_FILE", None)
+os.environ.pop("CHISIFAI_CAPTURE_DIR", None)
+os.environ.pop("CHISIFAI_MQTT_BROKER", None)
+os.environ.pop("CHISIFAI_STORAGE", None)
+sys.path.insert(0, BACKEND_DIR)
+
+
+def pytest_addoption(parser):
+    parser.addoption("--large-benchmarks", action="store_true",
+                     help="Also run the serialisation benchmarks on 50,000 rows")
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    """A freshly migrated database"""
+    from migrations import run_migrations
+
+    path = str(tmp_path / "chisifai.db")
+    run_migrations(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def api_client():
+    """The API server on the scratch database; shutdown closes its pools, so one per session"""
+    from fastapi.testclient import TestClient
+
+    import api_server
+
+    with TestClient(api_server.app) as client:
+        yield client
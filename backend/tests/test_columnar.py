@@ -0,0 +1,83 @@
+"""Columnar response formats: content negotiation and column round trips"""
+
+import json
+import sqlite3
+
+import pytest
+
+import columnar
+from columnar import ARROW_STREAM, COLUMNAR_JSON, encode_columns, negotiate_format, read_columns, rows_to_columns
+
+ROWS = [(i, 1_709_330_400_000 + i * 1000, 20.0 + i / 10, f"PKG-{i % 3:03d}") for i in range(7)]
+NAMES = {"timestamp": "timestamp", "temperature": "value", "package_id": "packageId"}
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE telemetry (id INTEGER PRIMARY KEY, timestamp INTEGER, temperature REAL, package_id TEXT)")
+    conn.executemany("INSERT INTO telemetry VALUES (?, ?, ?, ?)", ROWS)
+    yield conn.execute("SELECT id, timestamp, temperature, package_id FROM telemetry ORDER BY id")
+    conn.close()
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("", None),
+    ("application/json", None),
+    (COLUMNAR_JSON, COLUMNAR_JSON),
+    ("text/html, Application/Vnd.Chisifai.Columns+JSON;q=0.9", COLUMNAR_JSON),
+])
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(accept) == expected
+
+
+def test_arrow_needs_pyarrow(monkeypatch):
+    monkeypatch.setattr(columnar, "pyarrow", None)
+
+    assert negotiate_format(ARROW_STREAM) is None
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 1000])
+def test_read_columns_keeps_row_order_across_batches(cursor, batch_size):
+    columns = read_columns(cursor, NAMES, batch_size)
+
+    # Columns not named are skipped
+    assert columns == {
+        "timestamp": [row[1] for row in ROWS],
+        "value": [row[2] for row in ROWS],
+        "packageId": [row[3] for row in ROWS],
+    }
+
+
+def test_read_columns_of_no_rows():
+    assert read_columns([], NAMES) == {"timestamp": [], "value": [], "packageId": []}
+
+
+def test_rows_to_columns_matches_read_columns(cursor):
+    rows = cursor.fetchall()
+
+    assert rows_to_columns(rows, NAMES) == read_columns(rows, NAMES)
+
+
+def test_columnar_json_round_trip(cursor):
+    columns = read_columns(cursor, NAMES)
+
+    assert json.loads(encode_columns(columns, COLUMNAR_JSON)) == columns
+
+
+def test_arrow_round_trip(cursor):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+
+    columns = read_columns(cursor, NAMES)
+    table = pyarrow.ipc.open_stream(encode_columns(columns, ARROW_STREAM)).read_all()
+
+    assert table.to_pydict() == columns
+
+
+def test_benchmark_runs():
+    results = columnar.benchmark((20,), repeat=1)
+
+    assert {"rows+pydantic", "columns+json"} <= set(results[20])
@@ -0,0 +1,84 @@
+"""Validation and error responses of the telemetry ingest endpoints"""
+
+import json
+
+import pytest
+
+
+def reading(**fields):
+    return {"packageId": "PKG-001", "temperature": 20.0, "gForce": 1.0, "latitude": 40.4,
+            "longitude": -3.7, "timestamp": "2024-03-01T10:00:00Z", **fields}
+
+
+def post_raw(client, body, content_type="application/json"):
+    return client.post("/api/telemetry/batch", content=body, headers={"Content-Type": content_type})
+
+
+def test_batch_is_acknowledged(api_client):
+    response = api_client.post("/api/telemetry/batch", json=[reading(), reading(packageId="PKG-002")])
+
+    assert response.status_code == 200
+    ack = response.json()
+    assert ack["accepted"] == 2
+    assert ack["lastId"] - ack["firstId"] == 1
+
+
+def test_ndjson_batch_is_acknowledged(api_client):
+    body = "\n".join(json.dumps(reading(batteryLevel=80.0)) for _ in range(3))
+    response = post_raw(api_client, body, "application/x-ndjson")
+
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 3
+
+
+def test_empty_batch_accepts_nothing(api_client):
+    response = api_client.post("/api/telemetry/batch", json=[])
+
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 0
+
+
+@pytest.mark.parametrize("literal", ["NaN", "Infinity", "-Infinity"])
+def test_non_finite_values_answer_422(api_client, literal):
+    body = json.dumps([reading(), reading()]).replace('"temperature": 20.0', f'"temperature": {literal}', 1)
+
+    response = post_raw(api_client, body)
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["record"] == 0
+
+
+def test_single_reading_rejects_nan(api_client):
+    body = json.dumps(reading()).replace('"gForce": 1.0', '"gForce": NaN')
+
+    response = api_client.post("/api/telemetry", content=body, headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("record, index", [
+    ([reading(), {"packageId": "PKG-001"}], 1),
+    ([reading(), reading(timestamp="yesterday")], 1),
+    ([reading(signalStrength=2 ** 70)], 0),
+    ([reading(), "not an object"], 1),
+])
+def test_invalid_records_answer_422(api_client, record, index):
+    response = api_client.post("/api/telemetry/batch", json=record)
+
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["record"] == index if isinstance(detail, dict) else f"Record {index}" in detail
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"42", b"\xff\xfe"])
+def test_malformed_payloads_answer_400(api_client, body):
+    assert post_raw(api_client, body).status_code == 400
+
+
+def test_rejected_batch_stores_nothing(api_client):
+    before = api_client.get("/api/temperature?limit=1", headers={"Cache-Control": "no-cache"}).headers["X-Next-Cursor"]
+
+    api_client.post("/api/telemetry/batch", json=[reading(), reading(latitude="north")])
+
+    after = api_client.get("/api/temperature?limit=1").headers["X-Next-Cursor"]
+    assert after == before
@@ -0,0 +1,71 @@
+"""Migration 10: converting an ISO-timestamp database to epoch milliseconds"""
+
+import pytest
+
+import db
+import migrations
+from timestamps import to_epoch_ms
+
+GOOD = "2024-03-01T10:00:00+00:00"
+BAD = "yesterday"
+
+
+@pytest.fixture
+def iso_db(tmp_path, monkeypatch):
+    """A database at schema 9 with one convertible and one unconvertible row per table"""
+    path = str(tmp_path / "chisifai.db")
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:9])
+        assert migrations.run_migrations(path) == 9
+
+    conn = db.connect(path)
+    for statement in migrations.partition_statements("telemetry_20240301", "TEXT"):
+        conn.execute(statement)
+    conn.executemany(
+        "INSERT INTO telemetry_20240301 VALUES (?, 'PKG-001', 20.0, 1.0, 40.4, -3.7, ?, 80.0, -60)",
+        [(1, GOOD), (2, "2024-03-01 " + BAD)],
+    )
+    conn.executemany(
+        "INSERT INTO package_latest VALUES (?, ?, 20.0, 1.0, 40.4, -3.7, ?, 80.0, -60)",
+        [("PKG-001", 1, GOOD), ("PKG-002", 2, BAD)],
+    )
+    conn.executemany(
+        "INSERT INTO alerts (package_id, alert_type, message, timestamp, is_resolved) VALUES (?, 'impact', 'x', ?, 0)",
+        [("PKG-001", GOOD), ("PKG-002", BAD)],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def rows(conn, sql):
+    return conn.execute(sql).fetchall()
+
+
+def test_unconvertible_rows_are_quarantined(iso_db):
+    assert migrations.run_migrations(iso_db) == migrations.MIGRATIONS[-1][0]
+
+    conn = db.connect(iso_db)
+    try:
+        assert rows(conn, "SELECT id, timestamp FROM telemetry") == [(1, to_epoch_ms(GOOD))]
+        assert rows(conn, "SELECT id FROM telemetry_quarantine") == [(2,)]
+        assert rows(conn, "SELECT package_id, timestamp FROM package_latest") == [("PKG-001", to_epoch_ms(GOOD))]
+        assert rows(conn, "SELECT package_id, timestamp FROM package_latest_quarantine") == [("PKG-002", BAD)]
+        assert rows(conn, "SELECT package_id, timestamp FROM alerts") == [("PKG-001", to_epoch_ms(GOOD))]
+        assert rows(conn, "SELECT package_id, timestamp FROM alerts_quarantine") == [("PKG-002", BAD)]
+        assert rows(conn, "SELECT active_alerts FROM kpi_state") == [(1,)]
+    finally:
+        conn.close()
+
+
+def test_converted_alert_ids_are_not_reused(iso_db):
+    migrations.run_migrations(iso_db)
+
+    conn = db.connect(iso_db)
+    try:
+        conn.execute(
+            "INSERT INTO alerts (package_id, alert_type, message, timestamp) VALUES ('PKG-003', 'impact', 'x', 0)"
+        )
+        assert rows(conn, "SELECT MAX(id) FROM alerts") == [(3,)]
+    finally:
+        conn.close()
@@ -0,0 +1,75 @@
+"""Validation and batch writing of the MQTT ingestion worker, without a broker"""
+
+import json
+import time
+
+import pytest
+
+import db
+from mqtt_ingest import RETRY_DELAY, TelemetryIngestWorker
+from storage import SQLiteStore
+from timestamps import to_epoch_ms
+
+START = to_epoch_ms("2024-03-01T10:00:00Z")
+
+
+def reading(**fields):
+    return {"packageId": "PKG-001", "temperature": 20.0, "gForce": 1.0, "latitude": 40.4,
+            "longitude": -3.7, "timestamp": "2024-03-01T10:00:00Z", **fields}
+
+
+def row(index, temperature=20.0):
+    return ("PKG-001", temperature, 1.0, 40.4, -3.7, START + index * 1000, 80.0, -60)
+
+
+@pytest.fixture
+def worker(db_file):
+    worker = TelemetryIngestWorker(db_file=db_file, store=SQLiteStore(), flush_interval=0.05)
+    yield worker
+    worker.stop()
+    worker.store.close()
+
+
+def stored_count(db_file):
+    conn = db.connect(db_file)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM telemetry").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("bad", [
+    {"temperature": float("nan")},
+    {"gForce": float("inf")},
+    {"timestamp": "9999-12-31T23:59:59-05:00"},
+    {"timestamp": "not a time"},
+], ids=["nan", "infinity", "past-year-9999", "unparseable"])
+def test_bad_reading_in_payload_counts_as_invalid(worker, db_file, bad):
+    payload = json.dumps([reading()] * 5 + [reading(**bad)] + [reading()] * 5).encode()
+
+    worker.start_writer()
+    assert worker.handle_payload(payload) == 10
+    worker.stop()
+
+    metrics = worker.metrics()
+    assert metrics["invalid"] == 1
+    assert metrics["flushedRows"] == 10
+    assert metrics["dropped"] == 0
+    assert stored_count(db_file) == 10
+
+
+def test_unstorable_row_drops_only_itself_without_retrying(worker, db_file):
+    batch = [row(i) for i in range(5)] + [row(5, temperature=float("nan"))] + [row(i) for i in range(6, 11)]
+    conn = db.connect(db_file)
+    try:
+        started = time.monotonic()
+        worker._write_batch(conn, batch)
+        elapsed = time.monotonic() - started
+    finally:
+        conn.close()
+
+    metrics = worker.metrics()
+    assert elapsed < RETRY_DELAY
+    assert metrics["flushedRows"] == 10
+    assert metrics["dropped"] == 1
+    assert stored_count(db_file) == 10
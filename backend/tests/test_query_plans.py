@@ -0,0 +1,14 @@
+"""
+The hot-path queries, as the storage backend actually builds them, must be
+served by an index
+"""
+
+from storage import check_hot_path_plans
+
+
+def test_hot_paths_use_an_index():
+    assert check_hot_path_plans() == {}
+
+
+def test_hot_paths_use_an_index_on_a_copy(db_file):
+    assert check_hot_path_plans(db_file) == {}
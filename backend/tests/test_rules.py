@@ -0,0 +1,182 @@
+"""Tests for the streaming alert rules"""
+
+import json
+import sqlite3
+
+import pytest
+
+import db
+from rules import RuleEngine
+from storage import SQLiteStore
+
+START = 1_709_330_400_000
+MINUTE = 60_000
+
+
+def reading(package_id, timestamp, g_force, temperature=20.0):
+    return (package_id, temperature, g_force, 40.4, -3.7, timestamp, 90.0, -60)
+
+
+def test_separate_impacts_raise_separate_alerts(db_file):
+    conn = db.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    store = SQLiteStore()
+    engine = RuleEngine()
+    start = 1_709_330_400_000
+
+    # Impact, back to normal handling, then a second impact
+    store.insert_batch(conn, [reading("PKG-001", start, 3.2), reading("PKG-001", start + 60_000, 1.0)], engine)
+    store.insert_batch(conn, [reading("PKG-001", start + 120_000, 3.5)], engine)
+
+    alerts = conn.execute('''
+        SELECT is_resolved FROM alerts WHERE alert_type = 'Posible Impacto' ORDER BY id
+    ''').fetchall()
+    assert [row["is_resolved"] for row in alerts] == [1, 0]
+    conn.close()
+
+
+def test_impact_stays_one_alert_while_it_lasts():
+    engine = RuleEngine()
+    start = 1_709_330_400_000
+    rows = [reading("PKG-001", start + i * 1000, g_force) for i, g_force in enumerate([3.0, 2.8, 2.0, 3.1])]
+
+    opened, closed, _ = engine.evaluate(rows, start)
+
+    impacts = [alert for alert in opened if alert[1] == "Posible Impacto"]
+    assert len(impacts) == 1 and closed == []
+
+
+def temperature(package_id, timestamp, value):
+    return reading(package_id, timestamp, 1.0, temperature=value)
+
+
+def engine_with(**rule):
+    """An engine with one rule on every package"""
+    rule = {"id": "test", "alert_type": "Test", "message": "{value}", **rule}
+    return RuleEngine({"test": {"match": "*", "rules": [rule]}})
+
+
+def run(engine, rows):
+    """Evaluate a batch and commit the engine state, as a successful write does"""
+    opened, closed, changes = engine.evaluate(rows, START)
+    engine.apply(changes)
+    return opened, closed
+
+
+def test_sustained_breach_opens_once_held_long_enough():
+    engine = engine_with(type="threshold", metric="temperature", above=26.0, sustain_seconds=120)
+
+    assert run(engine, [temperature("PKG-001", START, 27.0)]) == ([], [])
+    assert run(engine, [temperature("PKG-001", START + MINUTE, 27.5)]) == ([], [])
+    opened, _ = run(engine, [temperature("PKG-001", START + 2 * MINUTE, 28.0)])
+
+    # The alert is stamped with the reading that started the breach
+    assert [(alert[2], alert[3]) for alert in opened] == [("27.0", START)]
+
+
+def test_breach_broken_before_sustain_does_not_open():
+    engine = engine_with(type="threshold", metric="temperature", above=26.0, sustain_seconds=120)
+    rows = [temperature("PKG-001", START + i * MINUTE, value) for i, value in enumerate([27.0, 25.0, 27.0, 27.0])]
+
+    opened, _ = run(engine, rows)
+
+    assert opened == []
+
+
+def test_rate_rule_opens_on_fast_rise():
+    engine = RuleEngine()
+    rows = [temperature("PKG-001", START, 20.0), temperature("PKG-001", START + MINUTE, 24.0)]
+
+    opened, _ = run(engine, rows)
+
+    assert [(alert[1], alert[2]) for alert in opened] == [("Cambio Brusco de Temperatura",
+                                                          "Temperatura subiendo 4.0°C/min")]
+
+
+def test_rate_rule_ignores_out_of_order_readings():
+    engine = RuleEngine()
+    rows = [temperature("PKG-001", START + MINUTE, 20.0), temperature("PKG-001", START, 10.0),
+            temperature("PKG-001", START + 2 * MINUTE, 21.0)]
+
+    opened, _ = run(engine, rows)
+
+    assert opened == []
+
+
+def test_threshold_clears_only_past_the_clear_level():
+    engine = RuleEngine()
+    run(engine, [temperature("PKG-001", START, 27.0)])
+
+    # Between the clear level (25) and the limit (26) the alert stays open
+    assert run(engine, [temperature("PKG-001", START + 10 * MINUTE, 25.5)]) == ([], [])
+    assert run(engine, [temperature("PKG-001", START + 20 * MINUTE, 26.5)]) == ([], [])
+    assert run(engine, [temperature("PKG-001", START + 30 * MINUTE, 24.9)]) == ([], ["PKG-001:temperature-high"])
+
+
+@pytest.mark.parametrize("rule, breach, normal", [
+    ({"type": "threshold", "metric": "temperature", "above": 26.0, "clear_below": 25.0}, [27.0], [24.0]),
+    ({"type": "threshold", "metric": "temperature", "below": 2.0, "clear_above": 4.0}, [1.0], [5.0]),
+    ({"type": "rate", "metric": "temperature", "above_per_minute": 3.0, "clear_below_per_minute": 1.0},
+     [20.0, 25.0], [25.5]),
+], ids=["above", "below", "rate"])
+def test_each_rule_kind_clears(rule, breach, normal):
+    engine = engine_with(**rule)
+    rows = [temperature("PKG-001", START + i * MINUTE, value) for i, value in enumerate(breach + normal)]
+
+    opened, closed = run(engine, rows[:len(breach)])
+    assert len(opened) == 1 and closed == []
+
+    opened, closed = run(engine, rows[len(breach):])
+    assert opened == [] and closed == ["PKG-001:test"]
+
+
+def test_rule_without_clear_level_stays_open():
+    engine = engine_with(type="threshold", metric="temperature", above=26.0)
+    run(engine, [temperature("PKG-001", START, 27.0)])
+
+    assert run(engine, [temperature("PKG-001", START + MINUTE, 10.0)]) == ([], [])
+
+
+def test_alert_opened_and_cleared_in_one_batch_is_stored_resolved():
+    engine = RuleEngine()
+    rows = [temperature("PKG-001", START, 27.0), temperature("PKG-001", START + 10 * MINUTE, 24.0)]
+
+    opened, closed = run(engine, rows)
+
+    assert [alert[7] for alert in opened if alert[1] == "Temperatura Excedida"] == [1]
+    assert closed == []
+
+
+def test_rules_file_overrides_defaults(tmp_path, monkeypatch):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps({
+        "frozen": {"match": "FRZ-*", "rules": [{
+            "id": "thawing", "type": "threshold", "metric": "temperature", "above": -10.0,
+            "alert_type": "Descongelación", "message": "{value}°C",
+        }]},
+    }))
+    monkeypatch.setenv("CHISIFAI_RULES_FILE", str(rules_file))
+    engine = RuleEngine()
+
+    opened, _ = run(engine, [temperature("FRZ-001", START, -5.0), temperature("PKG-001", START, 30.0)])
+
+    # Packages no product matches have no rules
+    assert [(alert[0], alert[6]) for alert in opened] == [("FRZ-001", "FRZ-001:thawing")]
+
+
+def test_open_alerts_survive_a_restart(db_file):
+    conn = db.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    store = SQLiteStore()
+    store.insert_batch(conn, [temperature("PKG-001", START, 27.0)], RuleEngine())
+
+    # A new engine, as after a restart, loads the open alert instead of raising it again
+    engine = RuleEngine()
+    ack = store.insert_batch(conn, [temperature("PKG-001", START + MINUTE, 28.0)], engine)
+    assert ack["alerts"] == 0
+
+    ack = store.insert_batch(conn, [temperature("PKG-001", START + 20 * MINUTE, 24.0)], engine)
+    assert ack["resolved"] == 1
+    alerts = conn.execute("SELECT is_resolved FROM alerts WHERE dedup_key = 'PKG-001:temperature-high'").fetchall()
+    assert [row["is_resolved"] for row in alerts] == [1]
+    conn.close()
@@ -0,0 +1,42 @@
+"""
+Read endpoint serialisation benchmark under pytest-benchmark (the same
+workload as `python serialization.py --benchmark`)
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from fastapi.testclient import TestClient
+
+from serialization import benchmark_endpoints, build_benchmark_database, serving, uncached_get
+
+ROW_COUNTS = (500, 5000, 50000)
+# Benchmarking every endpoint on the largest database is slow, so it runs on request
+LARGE_ROWS = 50000
+ENDPOINTS = list(benchmark_endpoints(0))
+
+
+@pytest.fixture(scope="module", params=ROW_COUNTS, ids=lambda n: f"{n}rows")
+def served(request, tmp_path_factory):
+    n = request.param
+    if n >= LARGE_ROWS and not request.config.getoption("--large-benchmarks"):
+        pytest.skip(f"{n} rows runs with --large-benchmarks")
+    db_file = str(tmp_path_factory.mktemp("serialization") / "benchmark.db")
+    build_benchmark_database(db_file, n)
+    with serving(db_file) as app:
+        yield n, TestClient(app)
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_read_endpoint(benchmark, served, endpoint):
+    n, client = served
+    url = benchmark_endpoints(n)[endpoint]
+    benchmark.group = f"{n} rows"
+
+    response = benchmark(uncached_get, client, url)
+
+    assert response.status_code == 200
+    body = response.json()
+    if endpoint in ("/api/telemetry", "/api/location"):
+        assert len(body) == n
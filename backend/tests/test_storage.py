@@ -0,0 +1,24 @@
+"""Every storage backend must pass the conformance workload and match SQLiteStore"""
+
+import pytest
+
+from storage import ShardedStore, SQLiteStore, conformance_workload
+
+
+def run_workload(store_class, directory):
+    store = ShardedStore(str(directory / "shards")) if store_class is ShardedStore else store_class()
+    return conformance_workload(store, str(directory / "chisifai.db"))
+
+
+@pytest.fixture(scope="module")
+def reference(tmp_path_factory):
+    results, _, _ = run_workload(SQLiteStore, tmp_path_factory.mktemp("reference"))
+    return results
+
+
+@pytest.mark.parametrize("store_class", [SQLiteStore, ShardedStore], ids=lambda cls: cls.__name__)
+def test_conformance(store_class, reference, tmp_path):
+    results, broken, _ = run_workload(store_class, tmp_path)
+
+    assert broken == []
+    assert [name for name in results if results[name] != reference[name]] == []
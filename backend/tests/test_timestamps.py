@@ -0,0 +1,38 @@
+"""Timestamps must stay within the years a partition day can name"""
+
+import pytest
+
+from timestamps import MAX_EPOCH_MS, MIN_EPOCH_MS, day_of, to_epoch_ms
+
+# Parseable, but an offset pushes the UTC time outside years 1 to 9999
+OUT_OF_RANGE = ["9999-12-31T23:59:59-01:00", "0001-01-01T00:00:00+01:00"]
+
+
+def reading(timestamp):
+    return {"packageId": "PKG-001", "temperature": 20.0, "gForce": 1.0,
+            "latitude": 40.4, "longitude": -3.7, "timestamp": timestamp}
+
+
+@pytest.mark.parametrize("value", OUT_OF_RANGE)
+def test_to_epoch_ms_rejects_out_of_range(value):
+    with pytest.raises(ValueError):
+        to_epoch_ms(value)
+
+
+def test_range_limits_name_a_day():
+    assert to_epoch_ms("0001-01-01T00:00:00Z") == MIN_EPOCH_MS
+    assert to_epoch_ms("9999-12-31T23:59:59.999Z") == MAX_EPOCH_MS
+    assert day_of(MIN_EPOCH_MS) == "0001-01-01" and day_of(MAX_EPOCH_MS) == "9999-12-31"
+
+
+@pytest.mark.parametrize("value", OUT_OF_RANGE)
+def test_ingest_answers_422(api_client, value):
+    assert api_client.post("/api/telemetry", json=reading(value)).status_code == 422
+    assert api_client.post("/api/telemetry/batch", json=[reading(value)]).status_code == 422
+
+
+@pytest.mark.parametrize("value", OUT_OF_RANGE)
+@pytest.mark.parametrize("query", ["/api/temperature?start={}", "/api/temperature?end={}", "/api/gforce?since={}"])
+def test_query_params_answer_400(api_client, query, value):
+    response = api_client.get(query.format(value.replace("+", "%2B")))
+    assert response.status_code == 400
@@ -0,0 +1,87 @@
+"""Binary telemetry payloads decode to the rows the JSON path stores"""
+
+import pytest
+
+from ingest import TelemetryReading, reading_to_row
+from wire_format import decode_rows, encode, format_of, row_to_reading, sample_readings, shift_timestamps, topic_for
+
+
+@pytest.fixture(params=["bin", "msgpack"])
+def fmt(request):
+    if request.param == "msgpack":
+        pytest.importorskip("msgpack")
+    return request.param
+
+
+def json_rows(readings):
+    return [reading_to_row(TelemetryReading(**reading)) for reading in readings]
+
+
+def test_round_trip_matches_json_ingest(fmt):
+    readings = sample_readings(packages=1, per_package=10)[0]
+
+    assert decode_rows(encode(readings, fmt), fmt) == json_rows(readings)
+
+
+def test_missing_optional_values_round_trip(fmt):
+    readings = sample_readings(packages=1, per_package=3)[0]
+    for reading in readings:
+        del reading["batteryLevel"], reading["signalStrength"]
+
+    rows = decode_rows(encode(readings, fmt), fmt)
+
+    assert rows == json_rows(readings)
+    assert all(row[6] is None and row[7] is None for row in rows)
+
+
+def test_large_position_steps_round_trip(fmt):
+    # Far beyond the 0.032767 degree narrow step, so bin switches to int32 steps
+    readings = sample_readings(packages=1, per_package=2)[0]
+    readings[1]["latitude"] = readings[0]["latitude"] + 1.5
+    readings[1]["longitude"] = readings[0]["longitude"] - 2.25
+
+    assert decode_rows(encode(readings, fmt), fmt) == json_rows(readings)
+
+
+def test_decoded_row_converts_back_to_the_reading(fmt):
+    readings = sample_readings(packages=1, per_package=1)[0]
+    row, = decode_rows(encode(readings, fmt), fmt)
+
+    assert reading_to_row(TelemetryReading(**row_to_reading(row))) == row
+
+
+def test_one_package_per_payload(fmt):
+    readings = [packages[0] for packages in sample_readings(packages=2, per_package=1)]
+
+    with pytest.raises(ValueError):
+        encode(readings, fmt)
+
+
+def test_truncated_payload_is_rejected(fmt):
+    payload = encode(sample_readings(packages=1, per_package=5)[0], fmt)
+
+    with pytest.raises(ValueError):
+        decode_rows(payload[:len(payload) // 2], fmt)
+
+
+def test_shift_timestamps_moves_every_reading(fmt):
+    readings = sample_readings(packages=1, per_package=4)[0]
+    rows = decode_rows(encode(readings, fmt), fmt)
+
+    shifted = decode_rows(shift_timestamps(encode(readings, fmt), fmt, 60_000), fmt)
+
+    assert [row[5] for row in shifted] == [row[5] + 60_000 for row in rows]
+
+
+def test_out_of_range_timestamp_is_rejected(fmt):
+    payload = encode(sample_readings(packages=1, per_package=1)[0], fmt)
+
+    with pytest.raises(ValueError):
+        decode_rows(shift_timestamps(payload, fmt, 2 ** 62), fmt)
+
+
+def test_topic_names_the_format():
+    topic = "chisifai/trackers/telemetry"
+
+    assert [format_of(topic_for(topic, fmt)) for fmt in ("json", "bin", "msgpack")] == ["json", "bin", "msgpack"]
+    assert format_of(f"{topic}/unknown") == "json"
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Epoch-millisecond timestamps
+
+Since migration 10 every timestamp column (raw telemetry, package_latest,
+alerts, KPI state and rollup buckets) holds UTC epoch milliseconds as an
+INTEGER. Readings are normalised to UTC at ingest and turned back into
+ISO 8601 only at the API boundary, so range filters and ORDER BY compare
+integers and the indexes store 8-byte keys instead of 26-character strings.
+
+Timestamps sent without an offset are taken as the server's local time,
+which is what datetime.now().isoformat() stored before.
+
+Compare index size and query speed of TEXT and INTEGER timestamps with
+
+    python timestamps.py --benchmark
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+DAY_MS = 86400 * 1000
+# Range of the ISO timestamps readings can carry (years 1 to 9999)
+MIN_EPOCH_MS = (datetime(1, 1, 1, tzinfo=timezone.utc) - EPOCH) // MILLISECOND
+MAX_EPOCH_MS = (datetime(9999, 12, 31, 23, 59, 59, 999000, tzinfo=timezone.utc) - EPOCH) // MILLISECOND
+
+
+def to_epoch_ms(value):
+    """
+    UTC epoch milliseconds of an ISO 8601 timestamp; raises ValueError if it
+    does not parse or its UTC time falls outside years 1 to 9999
+    """
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    try:
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        ms = (dt - EPOCH) // MILLISECOND
+    except OverflowError:
+        ms = None
+    # An offset can push the UTC time past the range a partition day can name
+    if ms is None or not MIN_EPOCH_MS <= ms <= MAX_EPOCH_MS:
+        raise ValueError(f"timestamp {value} is outside years 1 to 9999 in UTC")
+    return ms
+
+
+def parse_epoch_ms(value):
+    """Like to_epoch_ms, but None for a value that is not a timestamp (used to migrate stored values)"""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return to_epoch_ms(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_iso(ms):
+    """ISO 8601 UTC timestamp with millisecond precision, e.g. 2024-03-01T22:00:00.000Z"""
+    # gmtime + strftime is the cheapest formatter in the stdlib, which matters once per row
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ms // 1000)) + f".{ms % 1000:03d}Z"
+
+
+def now_ms():
+    return time.time_ns() // 1000000
+
+
+def day_of(ms):
+    """The UTC day (YYYY-MM-DD) a timestamp falls in"""
+    return (NAIVE_EPOCH + timedelta(days=ms // DAY_MS)).date().isoformat()
+
+
+def time_of_day(ms):
+    """HH:MM:SS in the server's local time, as alert times were shown before epoch storage"""
+    return time.strftime("%H:%M:%S", time.localtime(ms // 1000))
+
+
+def benchmark(row_counts=(10000, 100000, 1000000), repeat=5):
+    """
+    Store the same readings with TEXT (ISO) and INTEGER (epoch ms)
+    timestamps, indexed like the telemetry partitions, and compare index
+    sizes and the history queries. Returns {n: {check: {"text", "epoch"}}}
+    with bytes for sizes and seconds (best of `repeat`) for queries.
+    """
+    results = {}
+    for n in row_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "benchmark.db"))
+            base = datetime(2024, 3, 1)
+            readings = [
+                (f"PKG-{i % 50:03d}", round(19 + random.random() * 4, 2),
+                 base + timedelta(seconds=i, microseconds=random.randrange(1000000)))
+                for i in range(n)
+            ]
+            layouts = {
+                "text": ("TEXT", lambda dt: dt.isoformat()),
+                "epoch": ("INTEGER", lambda dt: to_epoch_ms(dt.isoformat())),
+            }
+            for name, (column_type, convert) in layouts.items():
+                conn.execute(f'''
+                    CREATE TABLE telemetry_{name} (
+                        id INTEGER PRIMARY KEY,
+                        package_id TEXT NOT NULL,
+                        temperature REAL NOT NULL,
+                        timestamp {column_type} NOT NULL
+                    )
+                ''')
+                conn.executemany(
+                    f"INSERT INTO telemetry_{name} (package_id, temperature, timestamp) VALUES (?, ?, ?)",
+                    ((package, temperature, convert(dt)) for package, temperature, dt in readings)
+                )
+                conn.execute(f"CREATE INDEX idx_{name}_package_timestamp ON telemetry_{name} (package_id, timestamp)")
+                conn.execute(f"CREATE INDEX idx_{name}_timestamp ON telemetry_{name} (timestamp)")
+            conn.commit()
+
+            # The newest hour, as a range filter and with the package index
+            start, end = base + timedelta(seconds=n - 3600), base + timedelta(seconds=n)
+            bounds = {"text": (start.isoformat(), end.isoformat()),
+                      "epoch": (to_epoch_ms(start.isoformat()), to_epoch_ms(end.isoformat()))}
+            queries = {
+                "newest 500": ("SELECT timestamp, temperature, package_id FROM telemetry_{name} "
+                               "ORDER BY timestamp DESC LIMIT 500", lambda name: ()),
+                "last hour": ("SELECT timestamp, temperature, package_id FROM telemetry_{name} "
+                              "WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp", lambda name: bounds[name]),
+                "package last hour": ("SELECT timestamp, temperature FROM telemetry_{name} "
+                                      "WHERE package_id = 'PKG-007' AND timestamp >= ? AND timestamp <= ? "
+                                      "ORDER BY timestamp", lambda name: bounds[name]),
+            }
+
+            def best(fn):
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    fn()
+                    timings.append(time.perf_counter() - started)
+                return min(timings)
+
+            results[n] = {}
+            for check in ("table", "idx_{name}_timestamp", "idx_{name}_package_timestamp"):
+                results[n][check.replace("{name}_", "")] = {
+                    name: conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?",
+                                       (f"telemetry_{name}" if check == "table" else check.format(name=name),)
+                                       ).fetchone()[0]
+                    for name in layouts
+                }
+            for check, (sql, params) in queries.items():
+                results[n][check] = {
+                    name: best(lambda: conn.execute(sql.format(name=name), params(name)).fetchall())
+                    for name in layouts
+                }
+
+            # What each layout costs at the API boundary for an alerts page
+            page = conn.execute("SELECT timestamp FROM telemetry_text LIMIT 500").fetchall()
+            epoch_page = [to_epoch_ms(value) for (value,) in page]
+            results[n]["alert times x500"] = {
+                "text": best(lambda: [datetime.fromisoformat(value).strftime("%H:%M:%S") for (value,) in page]),
+                "epoch": best(lambda: [time_of_day(ms) for ms in epoch_page]),
+            }
+            results[n]["ISO output x500"] = {
+                "text": best(lambda: [value for (value,) in page]),
+                "epoch": best(lambda: [to_iso(ms) for ms in epoch_page]),
+            }
+            conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai timestamp storage benchmark')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare index size and query speed of TEXT and INTEGER timestamps')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Readings in the benchmark tables (default: 10000 100000 1000000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per query; the fastest is reported (default: 5)')
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+
+    for n, checks in benchmark(args.rows, args.repeat).items():
+        for check, values in checks.items():
+            text, epoch = values["text"], values["epoch"]
+            ratio = f"{epoch / text:6.2f}x" if text else ""
+            if isinstance(text, int):
+                print(f"{n:>8} rows  {check:<22} TEXT {text / 1024:10,.0f} KiB  INTEGER {epoch / 1024:10,.0f} KiB  {ratio}")
+            else:
+                print(f"{n:>8} rows  {check:<22} TEXT {text * 1000:10.3f} ms   INTEGER {epoch * 1000:10.3f} ms   {ratio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Compact binary telemetry payloads
+
+Trackers can publish in three formats. MQTT 3.1.1 has no content-type
+header, so the last level of the topic names the format:
+
+    chisifai/trackers/telemetry          JSON, one reading or an array
+    chisifai/trackers/telemetry/bin      fixed-layout struct (below)
+    chisifai/trackers/telemetry/msgpack  MessagePack with short keys (needs `msgpack`)
+
+A binary message carries the readings of one package. Values are fixed-point
+integers at the precision the JSON already had (0.01 °C, 0.01 G, 0.01 %
+battery, 1e-6 degrees), and the reading UUID is left out because ingest
+never stores it. The first reading's timestamp and position are absolute;
+every reading then stores its step from the one before (zero for the
+first), so a batch of nearby readings packs into small integers.
+
+"bin" layout, little-endian:
+
+    header   B version, B flags, B package id length, H reading count,
+             package id (UTF-8), q timestamp (epoch ms),
+             i latitude, i longitude (1e-6 degrees)
+    reading  i ms since previous, h temperature, H g-force,
+             h latitude step, h longitude step, H battery, b signal
+
+Position steps are int16 unless one of them exceeds 0.032767 degrees; then
+the WIDE flag switches the whole message to int32 steps. A missing battery
+level is stored as 0xFFFF and a missing signal strength as -128.
+
+"msgpack" is a map {"v", "p", "t", "y", "x", "r"} with the same base values
+and one map per reading {"d", "c", "g", "y", "x", "b", "s"}; zero steps and
+missing values are left out.
+
+Compare message size and decode throughput against JSON with
+
+    python wire_format.py --benchmark
+"""
+
+import argparse
+import json
+import math
+import random
+import struct
+import time
+import uuid
+
+from timestamps import DAY_MS, MAX_EPOCH_MS, MIN_EPOCH_MS, now_ms, to_epoch_ms, to_iso
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+VERSION = 1
+WIDE = 0x01  # position steps are int32 instead of int16
+
+HEADER = struct.Struct('<BBBH')
+BASE = struct.Struct('<qii')
+READING = struct.Struct('<ihHhhHb')
+READING_WIDE = struct.Struct('<ihHiiHb')
+NARROW_LIMIT = 32767
+
+NO_BATTERY = 0xFFFF
+NO_SIGNAL = -128
+MAX_INTEGER = 2 ** 63 - 1  # SQLite INTEGER
+
+FORMATS = ("json", "bin", "msgpack")
+BINARY_FORMATS = ("bin", "msgpack")
+
+
+def topic_for(topic, fmt):
+    """Topic a tracker publishes `fmt` payloads to"""
+    return topic if fmt == "json" else f"{topic}/{fmt}"
+
+
+def format_of(topic):
+    """Payload format named by the last level of a message topic (JSON by default)"""
+    level = topic.rsplit('/', 1)[-1]
+    return level if level in BINARY_FORMATS else "json"
+
+
+def _fixed_point(readings):
+    """Package id, base (timestamp, latitude, longitude) and per-reading steps of one package's readings"""
+    package_id = readings[0]["packageId"]
+    base = previous = None
+    steps = []
+    for reading in readings:
+        if reading["packageId"] != package_id:
+            raise ValueError("a binary payload carries the readings of one package")
+        current = (to_epoch_ms(reading["timestamp"]),
+                   round(reading["latitude"] * 1e6),
+                   round(reading["longitude"] * 1e6))
+        if previous is None:
+            base = previous = current
+        battery = reading.get("batteryLevel")
+        signal = reading.get("signalStrength")
+        steps.append((
+            current[0] - previous[0],
+            round(reading["temperature"] * 100),
+            round(reading["gForce"] * 100),
+            current[1] - previous[1],
+            current[2] - previous[2],
+            NO_BATTERY if battery is None else round(battery * 100),
+            NO_SIGNAL if signal is None else signal
+        ))
+        previous = current
+    return package_id, base, steps
+
+
+def _check_row(row):
+    """Reject a decoded row the JSON path could not have produced, before it reaches storage"""
+    timestamp = row[5]
+    if not MIN_EPOCH_MS <= timestamp <= MAX_EPOCH_MS:
+        raise ValueError(f"timestamp {timestamp} is out of range")
+    for value in row[1:5] + row[6:7]:
+        if value is not None and not math.isfinite(value):
+            raise ValueError("readings must be finite numbers")
+    if row[7] is not None and not -MAX_INTEGER <= row[7] <= MAX_INTEGER:
+        raise ValueError(f"signal strength {row[7]} is out of range")
+    return row
+
+
+def _encode_bin(readings):
+    package_id, base, steps = _fixed_point(readings)
+    encoded_id = package_id.encode('utf-8')
+    wide = any(abs(step[3]) > NARROW_LIMIT or abs(step[4]) > NARROW_LIMIT for step in steps)
+    layout = READING_WIDE if wide else READING
+    try:
+        return b"".join([
+            HEADER.pack(VERSION, WIDE if wide else 0, len(encoded_id), len(steps)),
+            encoded_id,
+            BASE.pack(*base),
+            *(layout.pack(*step) for step in steps),
+        ])
+    except struct.error as e:
+        raise ValueError(f"reading out of range for the bin format: {e}")
+
+
+def _decode_bin(payload):
+    try:
+        version, flags, id_length, count = HEADER.unpack_from(payload)
+        if version != VERSION:
+            raise ValueError(f"unsupported bin payload version {version}")
+        offset = HEADER.size
+        package_id = bytes(payload[offset:offset + id_length]).decode('utf-8')
+        offset += id_length
+        timestamp, latitude, longitude = BASE.unpack_from(payload, offset)
+        offset += BASE.size
+        layout = READING_WIDE if flags & WIDE else READING
+        if len(payload) != offset + count * layout.size:
+            raise ValueError("bin payload length does not match its reading count")
+
+        rows = []
+        for elapsed, temperature, g_force, d_lat, d_lng, battery, signal in layout.iter_unpack(payload[offset:]):
+            timestamp += elapsed
+            latitude += d_lat
+            longitude += d_lng
+            rows.append(_check_row((
+                package_id,
+                temperature / 100,
+                g_force / 100,
+                latitude / 1e6,
+                longitude / 1e6,
+                timestamp,
+                None if battery == NO_BATTERY else battery / 100,
+                None if signal == NO_SIGNAL else signal
+            )))
+        return rows
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed bin payload: {e}")
+
+
+def _encode_msgpack(readings):
+    if msgpack is None:
+        raise ValueError("the msgpack format needs the msgpack package (pip install msgpack)")
+    package_id, (timestamp, latitude, longitude), steps = _fixed_point(readings)
+    encoded = []
+    for elapsed, temperature, g_force, d_lat, d_lng, battery, signal in steps:
+        reading = {"c": temperature, "g": g_force}
+        for key, value in (("d", elapsed), ("y", d_lat), ("x", d_lng)):
+            if value:
+                reading[key] = value
+        if battery != NO_BATTERY:
+            reading["b"] = battery
+        if signal != NO_SIGNAL:
+            reading["s"] = signal
+        encoded.append(reading)
+    return msgpack.packb({"v": VERSION, "p": package_id, "t": timestamp, "y": latitude, "x": longitude, "r": encoded})
+
+
+def _decode_msgpack(payload):
+    if msgpack is None:
+        raise ValueError("msgpack payloads need the msgpack package (pip install msgpack)")
+    try:
+        message = msgpack.unpackb(payload)
+        if message.get("v") != VERSION:
+            raise ValueError(f"unsupported msgpack payload version {message.get('v')}")
+        package_id = message["p"]
+        if not isinstance(package_id, str):
+            raise ValueError("package id must be a string")
+        timestamp, latitude, longitude = int(message["t"]), int(message["y"]), int(message["x"])
+
+        rows = []
+        for reading in message["r"]:
+            timestamp += int(reading.get("d", 0))
+            latitude += int(reading.get("y", 0))
+            longitude += int(reading.get("x", 0))
+            battery, signal = reading.get("b"), reading.get("s")
+            rows.append(_check_row((
+                package_id,
+                int(reading["c"]) / 100,
+                int(reading["g"]) / 100,
+                latitude / 1e6,
+                longitude / 1e6,
+                timestamp,
+                None if battery is None else int(battery) / 100,
+                None if signal is None else int(signal)
+            )))
+        return rows
+    except (AttributeError, KeyError, OverflowError, TypeError, ValueError) as e:
+        raise ValueError(f"malformed msgpack payload: {e}")
+
+
+ENCODERS = {"bin": _encode_bin, "msgpack": _encode_msgpack}
+DECODERS = {"bin": _decode_bin, "msgpack": _decode_msgpack}
+
+
+def encode(readings, fmt):
+    """Encode one package's readings (dicts as the trackers build them) as a `fmt` payload"""
+    if fmt == "json":
+        return json.dumps(readings[0] if len(readings) == 1 else readings).encode('utf-8')
+    if fmt not in ENCODERS:
+        raise ValueError(f"unknown payload format {fmt!r}")
+    return ENCODERS[fmt](readings)
+
+
+def decode_rows(payload, fmt):
+    """Telemetry rows (see ingest.reading_to_row) of a binary payload; raises ValueError if it is malformed"""
+    if fmt not in DECODERS:
+        raise ValueError(f"unknown binary payload format {fmt!r}")
+    return DECODERS[fmt](payload)
+
+
+def row_to_reading(row):
+    """The JSON reading of a decoded telemetry row, for transports that only take JSON"""
+    package_id, temperature, g_force, latitude, longitude, timestamp, battery, signal = row
+    reading = {
+        "packageId": package_id,
+        "temperature": temperature,
+        "gForce": g_force,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": to_iso(timestamp),
+    }
+    if battery is not None:
+        reading["batteryLevel"] = battery
+    if signal is not None:
+        reading["signalStrength"] = signal
+    return reading
+
+
+def shift_timestamps(payload, fmt, offset):
+    """A binary payload with every reading moved by `offset` milliseconds"""
+    if fmt == "bin":
+        # Only the base timestamp is absolute
+        try:
+            start = HEADER.size + payload[2]
+            timestamp, = struct.unpack_from('<q', payload, start)
+        except (IndexError, struct.error) as e:
+            raise ValueError(f"malformed bin payload: {e}")
+        return payload[:start] + struct.pack('<q', timestamp + offset) + payload[start + 8:]
+    if msgpack is None:
+        raise ValueError("msgpack payloads need the msgpack package (pip install msgpack)")
+    message = msgpack.unpackb(payload)
+    message["t"] += offset
+    return msgpack.packb(message)
+
+
+def sample_readings(packages, per_package, interval=2.0, seed=42):
+    """Readings shaped like the simulator's, `per_package` in a row for each package"""
+    rng = random.Random(seed)
+    start = now_ms() - DAY_MS
+    readings = []
+    for i in range(packages):
+        latitude = 40.4168 + (rng.random() - 0.5) * 0.1
+        longitude = -3.7038 + (rng.random() - 0.5) * 0.1
+        package = []
+        for step in range(per_package):
+            latitude += (rng.random() - 0.5) * 0.001
+            longitude += (rng.random() - 0.5) * 0.001
+            package.append({
+                "packageId": f"PKG-{i + 1:05d}",
+                "temperature": round(21.0 + (rng.random() - 0.5) * 4.0, 2),
+                "gForce": round(1.0 + (rng.random() - 0.5) * 0.5, 2),
+                "latitude": round(latitude, 6),
+                "longitude": round(longitude, 6),
+                "timestamp": to_iso(start + round(step * interval * 1000) + rng.randrange(100)),
+                "batteryLevel": round(100 - rng.random() * 5, 2),
+                "signalStrength": rng.randint(-80, -40)
+            })
+        readings.append(package)
+    return readings
+
+
+def benchmark(batch_sizes=(1, 10), packages=2000, repeat=3):
+    """
+    Encode the same readings in every available format, `batch` readings per
+    message, and decode them the way the ingest worker does (JSON through
+    the pydantic model, binary straight to rows). Returns
+    {batch: {format: {"bytes", "seconds", "readings", "matches"}}} where
+    "matches" tells whether the decoded rows equal those from the JSON path.
+    """
+    from ingest import TelemetryReading, reading_to_row
+
+    def json_rows(payload):
+        items = json.loads(payload)
+        return [reading_to_row(TelemetryReading(**item)) for item in (items if isinstance(items, list) else [items])]
+
+    formats = [fmt for fmt in FORMATS if fmt != "msgpack" or msgpack is not None]
+    results = {}
+    for batch in batch_sizes:
+        readings = sample_readings(packages, batch)
+        # The simulator's JSON also carries a UUID per reading
+        messages = {"json": [encode([dict(r, id=str(uuid.uuid4())) for r in package], "json")
+                             for package in readings]}
+        for fmt in formats[1:]:
+            messages[fmt] = [encode(package, fmt) for package in readings]
+
+        expected = [row for payload in messages["json"] for row in json_rows(payload)]
+        results[batch] = {}
+        for fmt in formats:
+            decode = json_rows if fmt == "json" else (lambda payload, fmt=fmt: decode_rows(payload, fmt))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = [row for payload in messages[fmt] for row in decode(payload)]
+                timings.append(time.perf_counter() - started)
+            results[batch][fmt] = {
+                "bytes": sum(len(payload) for payload in messages[fmt]),
+                "seconds": min(timings),
+                "readings": len(rows),
+                "matches": rows == expected,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai telemetry payload format benchmark')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Compare bytes per message and decode throughput of JSON and the binary formats')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10],
+                        help='Readings per message (default: 1 10)')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='Messages per format and batch size (default: 2000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Decoding runs; the fastest is reported (default: 3)')
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+    if msgpack is None:
+        print("⚠ msgpack not installed; benchmarking json and bin only")
+
+    for batch, formats in benchmark(args.batch, args.messages, args.repeat).items():
+        json_bytes = formats["json"]["bytes"]
+        for fmt, result in formats.items():
+            per_message = result["bytes"] / args.messages
+            print(f"{batch:>3} readings/msg  {fmt:<8} {per_message:8.1f} B/msg  "
+                  f"{result['bytes'] / result['readings']:6.1f} B/reading  "
+                  f"{result['bytes'] / json_bytes:5.2f}x size  "
+                  f"{result['readings'] / result['seconds']:>10,.0f} readings/s decoded  "
+                  f"{'✓' if result['matches'] else '✗ rows differ from JSON'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,26 @@ import {
   fetchAlerts, 
   fetchLocationData,
   fetchTemperatureData,
-  fetchGForceData
+  fetchGForceData,
+  subscribeToUpdates
 } from '../services/apiService';
 
 const DataContext = createContext();
 
+// Keep pushed history the same size as the REST endpoints return
+const HISTORY_LIMIT = 500;
+const ALERTS_LIMIT = 10;
+
+// Merge pushed readings into the latest-per-package list, newest first
+const mergeLatest = (current, updates) => {
+  const byPackage = new Map(current.map(item => [item.packageId, item]));
+  updates.forEach(item => byPackage.set(item.packageId, item));
+  return [...byPackage.values()].sort((a, b) => (a.timestamp < b.timestamp ? 1 : -1));
+};
+
+// Prepend pushed items (oldest first on the wire) to a newest-first list
+const prependNewest = (current, updates, limit) => [...updates].reverse().concat(current).slice(0, limit);
+
 export const DataProvider = ({ children }) => {
   const [telemetryData, setTelemetryData] = useState([]);
   const [kpis, setKpis] = useState({
@@ -59,12 +74,45 @@ export const DataProvider = ({ children }) => {
     }
   };
 
-  // Initialize data and set up polling
+  // Apply telemetry pushed by the server to every derived dataset
+  const applyTelemetry = (records) => {
+    setTelemetryData(current => mergeLatest(current, records));
+    setLocationData(current => mergeLatest(current, records.map(record => ({
+      id: record.id,
+      packageId: record.packageId,
+      latitude: record.latitude,
+      longitude: record.longitude,
+      timestamp: record.timestamp
+    }))));
+    setTemperatureData(current => prependNewest(current, records.map(record => ({
+      timestamp: record.timestamp,
+      value: record.temperature,
+      packageId: record.packageId
+    })), HISTORY_LIMIT));
+    setGForceData(current => prependNewest(current, records.map(record => ({
+      timestamp: record.timestamp,
+      value: record.gForce,
+      packageId: record.packageId
+    })), HISTORY_LIMIT));
+  };
+
+  // Initialize data and subscribe to pushed updates
   useEffect(() => {
     // Initial data load
     fetchData();
-    
-    // Set up polling to update data every 5 minutes to significantly reduce refresh frequency
+
+    const unsubscribe = subscribeToUpdates({
+      onTelemetry: applyTelemetry,
+      onAlerts: (newAlerts) => setAlerts(current => prependNewest(current, newAlerts, ALERTS_LIMIT)),
+      onResolved: (resolvedIds) => setAlerts(current => current.filter(alert => !resolvedIds.includes(alert.id))),
+      onKpis: setKpis,
+      onResync: fetchData
+    });
+    if (unsubscribe) {
+      return unsubscribe;
+    }
+
+    // Fall back to polling every 5 minutes when the browser has no EventSource
     const interval = setInterval(() => {
       fetchData();
     }, 300000);
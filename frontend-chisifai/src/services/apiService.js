@@ -57,9 +57,11 @@ export const fetchAlerts = async () => {
   return await apiFetch('/api/alerts') || [];
 };
 
-// Fetch location data
-export const fetchLocationData = async () => {
-  return await apiFetch('/api/location') || [];
+// Fetch location data, optionally for a viewport ({ bbox: map.getBounds().toBBoxString() })
+// or a radius ({ lat, lng, radius_km }), clustered with { cluster: true, zoom }
+export const fetchLocationData = async (params = {}) => {
+  const query = new URLSearchParams(params).toString();
+  return await apiFetch(query ? `/api/location?${query}` : '/api/location') || [];
 };
 
 // Fetch temperature data
@@ -70,4 +72,41 @@ export const fetchTemperatureData = async () => {
 // Fetch G-force data
 export const fetchGForceData = async () => {
   return await apiFetch('/api/gforce') || [];
-};
\ No newline at end of file
+};
+
+// Subscribe to pushed telemetry, alert, alert resolution and KPI deltas (Server-Sent Events).
+// Returns a function that closes the stream, or null when unsupported.
+export const subscribeToUpdates = ({ onTelemetry, onAlerts, onResolved, onKpis, onResync }) => {
+  if (typeof EventSource === 'undefined') {
+    return null;
+  }
+
+  const source = new EventSource(`${API_BASE_URL}/api/stream`);
+  const parse = (handler) => (event) => {
+    try {
+      handler(JSON.parse(event.data));
+    } catch (error) {
+      console.error(`Error handling ${event.type} stream event:`, error.message);
+    }
+  };
+
+  source.addEventListener('telemetry', parse(onTelemetry));
+  source.addEventListener('alerts', parse(onAlerts));
+  source.addEventListener('resolved', parse(onResolved));
+  source.addEventListener('kpis', parse(onKpis));
+  source.addEventListener('resync', () => onResync());
+
+  // The browser reconnects on its own; refetch so nothing missed while offline is lost
+  let disconnected = false;
+  source.onerror = () => {
+    disconnected = true;
+  };
+  source.onopen = () => {
+    if (disconnected) {
+      disconnected = false;
+      onResync();
+    }
+  };
+
+  return () => source.close();
+};
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Chisifai fleet load generator
+
+Drives thousands of virtual trackers from one process (or several, with
+--processes) over a few shared MQTT connections, to reproduce production
+load on the broker and the ingest path.
+
+Messages follow an open-loop schedule at the target aggregate rate: each
+one is published when it is due, whether or not earlier ones have been
+acknowledged, and its latency is measured from the scheduled time to the
+PUBACK. A slow broker therefore shows up as latency instead of quietly
+lowering the rate. Bursts multiply the rate for a few seconds at a fixed
+period, and incidents push a share of the fleet into heat or impact
+excursions for a time window. --format bin|msgpack publishes the compact
+binary payloads of backend/wire_format.py instead of JSON.
+
+Example:
+    python fleet.py --broker localhost --packages 5000 --rate 2500 --connections 4 --duration 60
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+# The payload formats are defined once, next to the ingest decoder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from wire_format import FORMATS, encode, topic_for
+
+from sensor_simulator import DEFAULT_BROKER, DEFAULT_PORT, DEFAULT_TOPIC, Tracker
+
+# Configuration
+DEFAULT_PACKAGES = 1000
+DEFAULT_RATE = 500.0  # messages per second across the whole fleet
+DEFAULT_DURATION = 60.0  # seconds
+DEFAULT_CONNECTIONS = 1
+DEFAULT_MAX_INFLIGHT = 1000  # unacknowledged QoS 1 messages per connection
+DEFAULT_DRAIN_TIMEOUT = 10.0  # seconds to wait for outstanding acks after the run
+CONNECT_TIMEOUT = 10.0  # seconds
+MAX_SLEEP = 0.01  # the scheduler never sleeps longer than this, so it can stop on time
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Connection:
+    """One MQTT client shared by a shard of the fleet; records the latency of every publish."""
+
+    def __init__(self, broker, port, max_inflight):
+        self.broker = broker
+        self.port = port
+        self.client_id = f"chisifai_fleet_{uuid.uuid4().hex[:8]}"
+        self.client = mqtt.Client(client_id=self.client_id)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_publish = self.on_publish
+        self.connected = threading.Event()
+
+        # Scheduled time per message id until its ack arrives; acks can beat
+        # publish() back to the caller, so those are parked in `early`
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.early = {}
+        self.latencies = []
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected.set()
+        else:
+            print(f"✗ Failed to connect to MQTT broker. Error code: {rc}")
+
+    def on_publish(self, client, userdata, mid):
+        acked = time.perf_counter()
+        with self.lock:
+            scheduled = self.pending.pop(mid, None)
+            if scheduled is None:
+                self.early[mid] = acked
+            else:
+                self.latencies.append(acked - scheduled)
+
+    def connect(self):
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()
+        return self.connected.wait(CONNECT_TIMEOUT)
+
+    def publish(self, topic, payload, qos, scheduled):
+        """Publish without waiting for the ack; returns False if paho refused the message"""
+        info = self.client.publish(topic, payload, qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        with self.lock:
+            acked = self.early.pop(info.mid, None)
+            if acked is None:
+                self.pending[info.mid] = scheduled
+            else:
+                self.latencies.append(acked - scheduled)
+        return True
+
+    def outstanding(self):
+        with self.lock:
+            return len(self.pending)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def rate_at(t, rate, burst_factor, burst_every, burst_duration):
+    """Target messages per second `t` seconds into the run; bursts start at every multiple of burst_every"""
+    if burst_every and t >= burst_every and t % burst_every < burst_duration:
+        return rate * burst_factor
+    return rate
+
+
+def run_fleet(package_ids, rate, duration, broker=DEFAULT_BROKER, port=DEFAULT_PORT, topic=DEFAULT_TOPIC,
+              connections=DEFAULT_CONNECTIONS, qos=1, max_inflight=DEFAULT_MAX_INFLIGHT,
+              burst_factor=1.0, burst_every=0.0, burst_duration=0.0,
+              incident=None, incident_fraction=0.0, incident_start=0.0, incident_duration=0.0,
+              drain_timeout=DEFAULT_DRAIN_TIMEOUT, seed=None, payload_format="json"):
+    """
+    Publish readings for `package_ids` at `rate` messages/s for `duration`
+    seconds, round-robin over the packages and spread over `connections`
+    MQTT clients, encoded as `payload_format`. Returns counters, the send-phase wall time and every
+    publish latency in seconds.
+    """
+    rng = random.Random(seed)
+    trackers = [Tracker(package_id, rng=rng) for package_id in package_ids]
+    incident_trackers = set(rng.sample(range(len(trackers)), round(len(trackers) * incident_fraction))) if incident else set()
+
+    topic = topic_for(topic, payload_format)
+    clients = [Connection(broker, port, max_inflight) for _ in range(connections)]
+    stats = {"sent": 0, "failed": 0, "unacked": 0, "elapsed": 0.0, "maxLag": 0.0, "latencies": []}
+    try:
+        for client in clients:
+            if not client.connect():
+                raise ConnectionError(f"no CONNACK from {broker}:{port} within {CONNECT_TIMEOUT:.0f}s")
+
+        start = time.perf_counter()
+        next_at = 0.0  # offset of the next due message from start
+        sequence = 0
+        try:
+            while next_at < duration:
+                now = time.perf_counter() - start
+
+                # Open loop: everything due by now goes out, stamped with its own due time
+                while next_at <= now and next_at < duration:
+                    index = sequence % len(trackers)
+                    tracker = trackers[index]
+                    in_incident = incident_start <= next_at < incident_start + incident_duration
+                    tracker.incident = incident if in_incident and index in incident_trackers else None
+
+                    payload = encode([tracker.generate_telemetry_data()], payload_format)
+                    if clients[index % len(clients)].publish(topic, payload, qos, start + next_at):
+                        stats["sent"] += 1
+                    else:
+                        stats["failed"] += 1
+                    stats["maxLag"] = max(stats["maxLag"], now - next_at)
+
+                    sequence += 1
+                    next_at += 1 / rate_at(next_at, rate, burst_factor, burst_every, burst_duration)
+
+                time.sleep(min(MAX_SLEEP, max(0.0, next_at - (time.perf_counter() - start))))
+        except KeyboardInterrupt:
+            print("\n⚠ Fleet interrupted by user, draining outstanding acks...")
+        stats["elapsed"] = time.perf_counter() - start
+
+        # Give the broker a moment to ack what is still in flight
+        deadline = time.perf_counter() + drain_timeout
+        while time.perf_counter() < deadline and any(client.outstanding() for client in clients):
+            time.sleep(0.05)
+    finally:
+        for client in clients:
+            client.close()
+
+    for client in clients:
+        stats["unacked"] += client.outstanding()
+        stats["latencies"].extend(client.latencies)
+    return stats
+
+
+def _run_shard(kwargs):
+    return run_fleet(**kwargs)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chisifai fleet load generator')
+    parser.add_argument('--broker', default=DEFAULT_BROKER,
+                        help=f'MQTT broker address (default: {DEFAULT_BROKER})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'MQTT broker port (default: {DEFAULT_PORT})')
+    parser.add_argument('--topic', default=DEFAULT_TOPIC,
+                        help=f'MQTT topic to publish to (default: {DEFAULT_TOPIC})')
+    parser.add_argument('--packages', type=int, default=DEFAULT_PACKAGES,
+                        help=f'Virtual trackers in the fleet (default: {DEFAULT_PACKAGES})')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help=f'Target messages per second across the fleet (default: {DEFAULT_RATE:.0f})')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help=f'Seconds to publish for (default: {DEFAULT_DURATION:.0f})')
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help='MQTT connections shared by the fleet; packages are sharded over them '
+                             f'(default: {DEFAULT_CONNECTIONS})')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes, each driving an equal slice of packages, rate and connections (default: 1)')
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1,
+                        help='MQTT QoS level (default: 1)')
+    parser.add_argument('--max-inflight', type=int, default=DEFAULT_MAX_INFLIGHT,
+                        help=f'Unacknowledged messages per connection before paho queues (default: {DEFAULT_MAX_INFLIGHT})')
+    parser.add_argument('--burst-factor', type=float, default=1.0,
+                        help='Rate multiplier during bursts (default: 1, no bursts)')
+    parser.add_argument('--burst-every', type=float, default=0.0,
+                        help='Seconds between burst starts (default: 0, no bursts)')
+    parser.add_argument('--burst-duration', type=float, default=5.0,
+                        help='Seconds each burst lasts (default: 5)')
+    parser.add_argument('--incident', choices=('heat', 'impact'),
+                        help='Push part of the fleet into a temperature or g-force excursion')
+    parser.add_argument('--incident-fraction', type=float, default=0.1,
+                        help='Share of packages affected by the incident (default: 0.1)')
+    parser.add_argument('--incident-start', type=float, default=10.0,
+                        help='Seconds into the run the incident starts (default: 10)')
+    parser.add_argument('--incident-duration', type=float, default=30.0,
+                        help='Seconds the incident lasts (default: 30)')
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help=f'Seconds to wait for outstanding acks at the end (default: {DEFAULT_DRAIN_TIMEOUT:.0f})')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for reproducible readings and incident selection')
+    parser.add_argument('--format', choices=FORMATS, default="json",
+                        help='Payload format; bin and msgpack publish to <topic>/<format> (default: json)')
+
+    args = parser.parse_args()
+    if args.rate <= 0 or args.packages <= 0:
+        parser.error("--rate and --packages must be positive")
+    try:
+        encode([Tracker().generate_telemetry_data()], args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    processes = max(1, min(args.processes, args.packages))
+    connections = max(processes, args.connections)
+    package_ids = [f"PKG-{i + 1:05d}" for i in range(args.packages)]
+
+    # Each process gets an equal slice of the fleet and of the target rate
+    shards = []
+    for i in range(processes):
+        shards.append({
+            "package_ids": package_ids[i::processes],
+            "rate": args.rate / processes,
+            "duration": args.duration,
+            "broker": args.broker,
+            "port": args.port,
+            "topic": args.topic,
+            "connections": connections // processes + (1 if i < connections % processes else 0),
+            "qos": args.qos,
+            "max_inflight": args.max_inflight,
+            "burst_factor": args.burst_factor,
+            "burst_every": args.burst_every,
+            "burst_duration": args.burst_duration,
+            "incident": args.incident,
+            "incident_fraction": args.incident_fraction,
+            "incident_start": args.incident_start,
+            "incident_duration": args.incident_duration,
+            "drain_timeout": args.drain_timeout,
+            "seed": None if args.seed is None else args.seed + i,
+            "payload_format": args.format,
+        })
+
+    print(f"✓ Fleet of {args.packages} packages over {connections} connections in {processes} process(es)")
+    print(f"✓ Target rate: {args.rate:.0f} msg/s for {args.duration:.0f} s to {args.broker}:{args.port} ({topic_for(args.topic, args.format)})")
+    if args.burst_every:
+        print(f"✓ Bursts of {args.burst_factor:g}x every {args.burst_every:g} s for {args.burst_duration:g} s")
+    if args.incident:
+        print(f"✓ {args.incident.capitalize()} incident on {args.incident_fraction:.0%} of the fleet "
+              f"from {args.incident_start:g} s for {args.incident_duration:g} s")
+    print("-" * 60)
+
+    try:
+        if processes == 1:
+            results = [run_fleet(**shards[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_run_shard, shards))
+    except (ConnectionError, OSError) as e:
+        print(f"✗ Error connecting to MQTT broker: {e}")
+        return
+
+    sent = sum(r["sent"] for r in results)
+    failed = sum(r["failed"] for r in results)
+    unacked = sum(r["unacked"] for r in results)
+    elapsed = max(r["elapsed"] for r in results)
+    latencies = sorted(latency for r in results for latency in r["latencies"])
+    acked = len(latencies)
+
+    target = f"target {args.rate:.1f} msg/s" + (" plus bursts" if args.burst_every else "")
+    print(f"✓ Sent {sent} messages in {elapsed:.1f} s: {sent / elapsed:.1f} msg/s ({target})")
+    print(f"✓ Acknowledged {acked} messages: {acked / elapsed:.1f} msg/s")
+    if failed:
+        print(f"✗ {failed} messages refused by the client")
+    if unacked:
+        print(f"✗ {unacked} messages still unacknowledged after {args.drain_timeout:g} s")
+    print("Publish latency (scheduled time to ack): " +
+          "  ".join(f"p{p:g} {percentile(latencies, p) * 1000:.1f} ms" for p in PERCENTILES) +
+          f"  max {(latencies[-1] if latencies else 0) * 1000:.1f} ms")
+    print(f"Scheduler lag: max {max(r['maxLag'] for r in results) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
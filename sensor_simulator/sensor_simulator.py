@@ -4,90 +4,91 @@ Chisifai IoT Sensor Simulator
 
 This script simulates an IoT device that generates and sends telemetry data
 for cheese cake shipment monitoring including temperature, g-force, and GPS location.
+Readings go out as JSON, or with --format bin|msgpack as the compact binary
+payloads described in backend/wire_format.py.
+
+Like the tracker firmware, the simulator can report adaptively: --batch sends
+N readings per message, --temperature-delta / --gforce-delta skip readings
+that moved less than the deadband since the last one reported, readings past
+an alert threshold go out at once, and readings taken while the broker is
+unreachable (or during a simulated --outage-every outage) are buffered and
+sent on reconnect.
 """
 
 import json
 import time
 import random
 import uuid
+from collections import deque
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import argparse
 import sys
 import os
 
+# The payload formats are defined once, next to the ingest decoder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from wire_format import FORMATS, encode, topic_for
+from rules import GFORCE_THRESHOLD, TEMPERATURE_THRESHOLD
+
 # Configuration
 DEFAULT_BROKER = "test.mosquitto.org"  # Public MQTT broker for testing
 DEFAULT_PORT = 1883
 DEFAULT_TOPIC = "chisifai/trackers/telemetry"
 DEFAULT_INTERVAL = 2  # seconds between readings
+DEFAULT_HEARTBEAT = 60.0  # seconds a deadband may keep the tracker silent
+DEFAULT_OFFLINE_LIMIT = 10000  # readings buffered while offline before the oldest are dropped
+BACKLOG_BATCH = 50  # readings per message when sending the offline buffer
+CONNECT_TIMEOUT = 10.0  # seconds to wait for the broker before sampling into the offline buffer
+
+class Tracker:
+    """One simulated package: its identity, position and the readings it produces."""
+
+    def __init__(self, package_id=None, rng=random):
+        self.rng = rng
+        self.package_id = package_id or f"PKG-{rng.randint(100, 999)}"
 
-class SensorSimulator:
-    def __init__(self, broker=DEFAULT_BROKER, port=DEFAULT_PORT, topic=DEFAULT_TOPIC, interval=DEFAULT_INTERVAL):
-        self.broker = broker
-        self.port = port
-        self.topic = topic
-        self.interval = interval
-        self.client_id = f"chisifai_sensor_{uuid.uuid4().hex[:8]}"
-        self.package_id = f"PKG-{random.randint(100, 999)}"
-        
         # Starting location (Madrid, Spain)
-        self.current_lat = 40.4168 + (random.random() - 0.5) * 0.1  # Small variance around Madrid
-        self.current_lng = -3.7038 + (random.random() - 0.5) * 0.1
+        self.current_lat = 40.4168 + (rng.random() - 0.5) * 0.1  # Small variance around Madrid
+        self.current_lng = -3.7038 + (rng.random() - 0.5) * 0.1
         self.moving = True
-        
-        # Initialize MQTT client
-        self.client = mqtt.Client(client_id=self.client_id)
-        self.client.on_connect = self.on_connect
-        self.client.on_disconnect = self.on_disconnect
-        self.client.on_publish = self.on_publish
-        
-    def on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
-            print(f"✓ Connected to MQTT broker at {self.broker}:{self.port}")
-            print(f"✓ Client ID: {self.client_id}")
-            print(f"✓ Publishing to topic: {self.topic}")
-        else:
-            print(f"✗ Failed to connect to MQTT broker. Error code: {rc}")
-    
-    def on_disconnect(self, client, userdata, rc):
-        print(f"✗ Disconnected from MQTT broker. Reason: {rc}")
-    
-    def on_publish(self, client, userdata, mid):
-        print(f"✓ Message {mid} published successfully")
-    
+
+        # "heat" or "impact" forces the matching excursion on every reading (fleet incident scenarios)
+        self.incident = None
+
     def generate_telemetry_data(self):
         """Generate realistic telemetry data for cheese cake shipment monitoring."""
-        
+        rng = self.rng
+
         # Simulate realistic temperature variation (should be 18-24°C for cheese cake at room temperature)
         # Add some variation based on time, location, and potential issues
         base_temp = 21.0  # Optimal temperature for cheesecake (midpoint of 18-24°C)
-        temp_variation = (random.random() - 0.5) * 4.0  # ±2°C variation gives us 19-23°C range
-        
+        temp_variation = (rng.random() - 0.5) * 4.0  # ±2°C variation gives us 19-23°C range
+
         # Occasionally simulate temperature issues (2% of the time)
-        if random.random() < 0.02:
-            temp_variation = 5.0 + random.random() * 8.0  # Could go up to 34°C to simulate heating issues
-            
+        if self.incident == "heat" or rng.random() < 0.02:
+            temp_variation = 5.0 + rng.random() * 8.0  # Could go up to 34°C to simulate heating issues
+
         temperature = max(15.0, min(35.0, base_temp + temp_variation))  # Clamp between 15-35°C for realistic range
-        
+
         # Simulate realistic G-force (should normally be close to 1.0G)
         base_gforce = 1.0
-        gforce_variation = (random.random() - 0.5) * 0.5  # ±0.25G variation
-        
+        gforce_variation = (rng.random() - 0.5) * 0.5  # ±0.25G variation
+
         # Occasionally simulate impact events (5% of the time)
-        if random.random() < 0.05:
-            gforce_variation = 1.5 + random.random() * 2.0  # Could go up to 4G+
-            
+        if self.incident == "impact" or rng.random() < 0.05:
+            gforce_variation = 1.5 + rng.random() * 2.0  # Could go up to 4G+
+
         g_force = max(0.1, base_gforce + gforce_variation)  # Don't go below 0.1G
-        
+
         # Simulate movement
         if self.moving:
             # Move the sensor slightly (simulating delivery vehicle movement)
-            lat_change = (random.random() - 0.5) * 0.001  # Small change in latitude
-            lng_change = (random.random() - 0.5) * 0.001  # Small change in longitude
+            lat_change = (rng.random() - 0.5) * 0.001  # Small change in latitude
+            lng_change = (rng.random() - 0.5) * 0.001  # Small change in longitude
             self.current_lat += lat_change
             self.current_lng += lng_change
-        
+
         # Create the telemetry data packet
         telemetry_data = {
             "id": str(uuid.uuid4()),
@@ -97,11 +98,145 @@ class SensorSimulator:
             "latitude": round(self.current_lat, 6),
             "longitude": round(self.current_lng, 6),
             "timestamp": datetime.now().isoformat(),
-            "batteryLevel": round(100 - (random.random() * 5), 2),  # Simulate slight battery drain
-            "signalStrength": random.randint(-80, -40)  # dBm signal strength
+            "batteryLevel": round(100 - (rng.random() * 5), 2),  # Simulate slight battery drain
+            "signalStrength": rng.randint(-80, -40)  # dBm signal strength
         }
-        
+
         return telemetry_data
+
+
+class EdgeReporter:
+    """
+    Firmware-style reporting policy: decides which readings to send and when.
+
+    A reading is reported when temperature or g-force moved more than its
+    deadband (a delta of 0 disables that check) since the last reported
+    reading, or after `heartbeat` seconds without a report; with no deadband
+    every reading is reported. Reported readings go out `batch_size` per
+    message, except that a reading past an alert threshold, or the first one
+    back under them, flushes the batch at once. Readings that cannot be sent
+    are held, up to `offline_limit` (oldest dropped first), until the link is
+    back.
+    """
+
+    def __init__(self, batch_size=1, temperature_delta=0.0, gforce_delta=0.0, heartbeat=DEFAULT_HEARTBEAT,
+                 temperature_limit=TEMPERATURE_THRESHOLD, gforce_limit=GFORCE_THRESHOLD,
+                 offline_limit=DEFAULT_OFFLINE_LIMIT):
+        self.batch_size = batch_size
+        self.temperature_delta = temperature_delta
+        self.gforce_delta = gforce_delta
+        self.heartbeat = heartbeat
+        self.temperature_limit = temperature_limit
+        self.gforce_limit = gforce_limit
+        self.offline_limit = offline_limit
+
+        self.batch = []
+        self.backlog = deque()
+        self.last_reported = None
+        self.last_reported_at = None
+        self.alarm = False
+        self.stats = {"sampled": 0, "reported": 0, "suppressed": 0, "urgent": 0, "held": 0, "dropped": 0}
+
+    def changed(self, reading, now):
+        """Whether a reading falls outside the deadband of the last reported one"""
+        last = self.last_reported
+        if last is None or now - self.last_reported_at >= self.heartbeat:
+            return True
+        if not self.temperature_delta and not self.gforce_delta:
+            return True
+        return ((self.temperature_delta and abs(reading["temperature"] - last["temperature"]) > self.temperature_delta) or
+                (self.gforce_delta and abs(reading["gForce"] - last["gForce"]) > self.gforce_delta))
+
+    def add(self, reading, now):
+        """Take one sampled reading at `now` (seconds); returns the readings to send as one message, if any"""
+        self.stats["sampled"] += 1
+        alarm = reading["temperature"] > self.temperature_limit or reading["gForce"] > self.gforce_limit
+        # The first reading back under the thresholds is always reported, so the alert can clear
+        cleared = self.alarm and not alarm
+        self.alarm = alarm
+
+        if not (alarm or cleared or self.changed(reading, now)):
+            self.stats["suppressed"] += 1
+            return []
+
+        self.stats["reported"] += 1
+        self.last_reported = reading
+        self.last_reported_at = now
+        self.batch.append(reading)
+        if alarm:
+            self.stats["urgent"] += 1
+        # The alert opens and clears on the server as soon as the tracker sees it
+        if alarm or cleared or len(self.batch) >= self.batch_size:
+            batch, self.batch = self.batch, []
+            return batch
+        return []
+
+    def hold(self, readings):
+        """Keep readings that could not be sent, dropping the oldest beyond offline_limit"""
+        self.backlog.extend(readings)
+        self.stats["held"] += len(readings)
+        while len(self.backlog) > self.offline_limit:
+            self.backlog.popleft()
+            self.stats["dropped"] += 1
+
+    def take_backlog(self, size):
+        """Remove and return up to `size` of the oldest held readings"""
+        return [self.backlog.popleft() for _ in range(min(size, len(self.backlog)))]
+
+
+class SensorSimulator:
+    def __init__(self, broker=DEFAULT_BROKER, port=DEFAULT_PORT, topic=DEFAULT_TOPIC, interval=DEFAULT_INTERVAL,
+                 payload_format="json", reporter=None, outage_every=0.0, outage_duration=0.0):
+        self.broker = broker
+        self.port = port
+        self.payload_format = payload_format
+        # Binary payloads go to a subtopic that names their format
+        self.topic = topic_for(topic, payload_format)
+        self.interval = interval
+        self.client_id = f"chisifai_sensor_{uuid.uuid4().hex[:8]}"
+        self.tracker = Tracker()
+        self.reporter = reporter or EdgeReporter()
+
+        # Link state: readings are held while disconnected or in a simulated outage
+        self.connected = False
+        self.outage_every = outage_every
+        self.outage_duration = outage_duration
+        self.started = time.monotonic()
+        self.last_publish = None
+        
+        # Initialize MQTT client
+        self.client = mqtt.Client(client_id=self.client_id)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+
+    @property
+    def package_id(self):
+        return self.tracker.package_id
+
+    @package_id.setter
+    def package_id(self, value):
+        self.tracker.package_id = value
+        
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.connected = True
+            print(f"✓ Connected to MQTT broker at {self.broker}:{self.port}")
+            print(f"✓ Client ID: {self.client_id}")
+            print(f"✓ Publishing to topic: {self.topic}")
+        else:
+            print(f"✗ Failed to connect to MQTT broker. Error code: {rc}")
+    
+    def on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        print(f"✗ Disconnected from MQTT broker. Reason: {rc}")
+    
+    def on_publish(self, client, userdata, mid):
+        print(f"✓ Message {mid} published successfully")
+    
+    def generate_telemetry_data(self):
+        """Generate realistic telemetry data for cheese cake shipment monitoring."""
+        return self.tracker.generate_telemetry_data()
     
     def connect(self):
         """Connect to the MQTT broker."""
@@ -113,19 +248,56 @@ class SensorSimulator:
             print(f"✗ Error connecting to MQTT broker: {e}")
             return False
     
+    def online(self):
+        """Whether messages can go out now: connected and outside any simulated outage."""
+        if not self.connected:
+            return False
+        elapsed = time.monotonic() - self.started
+        return not (self.outage_every and elapsed >= self.outage_every
+                    and elapsed % self.outage_every < self.outage_duration)
+
     def publish_telemetry(self):
-        """Publish a single telemetry reading to the MQTT topic."""
-        data = self.generate_telemetry_data()
-        
+        """Take a reading and publish what the reporting policy says is due; returns messages sent."""
+        readings = self.reporter.add(self.generate_telemetry_data(), time.monotonic())
+        return self.send(readings) if readings else 0
+
+    def send(self, readings):
+        """Publish readings as one message, or hold them until the link is back; returns messages sent."""
+        # Behind any held readings, so they still arrive in order
+        if self.online() and not self.reporter.backlog and self.publish_readings(readings):
+            return 1
+        self.reporter.hold(readings)
+        return 0
+
+    def flush_backlog(self):
+        """Send the readings held while offline, oldest first; returns messages sent."""
+        sent = 0
+        while self.reporter.backlog and self.online():
+            readings = self.reporter.take_backlog(max(self.reporter.batch_size, BACKLOG_BATCH))
+            if not self.publish_readings(readings):
+                self.reporter.backlog.extendleft(reversed(readings))
+                break
+            sent += 1
+        return sent
+
+    def publish_readings(self, readings):
+        """Publish readings to the MQTT topic as one message."""
         try:
             # Convert to JSON string
-            json_payload = json.dumps(data)
+            json_payload = json.dumps(readings[0] if len(readings) == 1 else readings)
+            payload = json_payload if self.payload_format == "json" else encode(readings, self.payload_format)
             
             # Publish to MQTT topic
-            result = self.client.publish(self.topic, json_payload, qos=1)
+            result = self.client.publish(self.topic, payload, qos=1)
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"Published: {json_payload}")
+                self.last_publish = result
+                if len(readings) > 1:
+                    print(f"Published {len(readings)} readings in {len(payload)} bytes ({self.payload_format})")
+                elif payload is json_payload:
+                    print(f"Published: {json_payload}")
+                else:
+                    print(f"Published {len(payload)} bytes ({self.payload_format}): {json_payload}")
                 return True
             else:
                 print(f"✗ Failed to publish message. Error code: {result.rc}")
@@ -142,23 +314,33 @@ class SensorSimulator:
         
         # Start the network loop
         self.client.loop_start()
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while not self.connected and time.monotonic() < deadline:
+            time.sleep(0.05)
         
         print(f"✓ Sensor simulator started!")
         print(f"✓ Package ID: {self.package_id}")
         print(f"✓ Publishing interval: {self.interval} seconds")
-        print(f"✓ Location: {self.current_lat:.6f}, {self.current_lng:.6f}")
+        print(f"✓ Location: {self.tracker.current_lat:.6f}, {self.tracker.current_lng:.6f}")
+        reporter = self.reporter
+        if reporter.batch_size > 1 or reporter.temperature_delta or reporter.gforce_delta:
+            print(f"✓ Reporting: {reporter.batch_size} reading(s) per message, deadband "
+                  f"±{reporter.temperature_delta:g}°C / ±{reporter.gforce_delta:g}G, heartbeat {reporter.heartbeat:g} s")
+        if self.outage_every:
+            print(f"✓ Simulated outage of {self.outage_duration:g} s every {self.outage_every:g} s")
         print("Press Ctrl+C to stop the simulator...")
         print("-" * 60)
         
         message_count = 0
+        self.started = time.monotonic()
         try:
             while True:
-                # Publish telemetry data
-                if self.publish_telemetry():
-                    message_count += 1
-                    if max_messages and message_count >= max_messages:
-                        print(f"\n✓ Reached maximum message count ({max_messages}). Stopping...")
-                        break
+                # Publish telemetry data, then anything held while offline
+                message_count += self.publish_telemetry()
+                message_count += self.flush_backlog()
+                if max_messages and message_count >= max_messages:
+                    print(f"\n✓ Reached maximum message count ({max_messages}). Stopping...")
+                    break
                 
                 # Wait for the specified interval
                 time.sleep(self.interval)
@@ -168,6 +350,26 @@ class SensorSimulator:
         except Exception as e:
             print(f"\n✗ Error in simulator loop: {e}")
         finally:
+            # Send the partial batch and the offline buffer if the link allows
+            readings, self.reporter.batch = self.reporter.batch, []
+            if readings:
+                message_count += self.send(readings)
+            message_count += self.flush_backlog()
+            if self.last_publish is not None:
+                try:
+                    self.last_publish.wait_for_publish(timeout=5)
+                except (RuntimeError, ValueError):
+                    pass
+
+            stats = self.reporter.stats
+            print(f"✓ Sampled {stats['sampled']} readings, reported {stats['reported']} "
+                  f"({stats['suppressed']} inside the deadband, {stats['urgent']} past an alert threshold) "
+                  f"in {message_count} messages")
+            if stats["held"]:
+                print(f"✓ {stats['held']} readings held while offline")
+            if self.reporter.backlog or stats["dropped"]:
+                print(f"✗ {len(self.reporter.backlog)} readings still held offline, {stats['dropped']} dropped")
+
             # Stop the network loop and disconnect
             print("Disconnecting from MQTT broker...")
             self.client.loop_stop()
@@ -188,15 +390,55 @@ def main():
                         help='Number of messages to send (default: infinite)')
     parser.add_argument('--package-id', 
                         help='Specific package ID to use (default: auto-generated)')
+    parser.add_argument('--format', choices=FORMATS, default="json",
+                        help='Payload format; bin and msgpack publish to <topic>/<format> (default: json)')
+    parser.add_argument('--batch', type=int, default=1,
+                        help='Readings per message (default: 1)')
+    parser.add_argument('--temperature-delta', type=float, default=0.0,
+                        help='Report only when temperature moved more than this many °C (default: 0, off)')
+    parser.add_argument('--gforce-delta', type=float, default=0.0,
+                        help='Report only when g-force moved more than this many G (default: 0, off)')
+    parser.add_argument('--heartbeat', type=float, default=DEFAULT_HEARTBEAT,
+                        help=f'Report at least this often in seconds, whatever the deadband (default: {DEFAULT_HEARTBEAT:g})')
+    parser.add_argument('--alert-temperature', type=float, default=TEMPERATURE_THRESHOLD,
+                        help=f'Send readings above this temperature at once (default: {TEMPERATURE_THRESHOLD:g})')
+    parser.add_argument('--alert-gforce', type=float, default=GFORCE_THRESHOLD,
+                        help=f'Send readings above this g-force at once (default: {GFORCE_THRESHOLD:g})')
+    parser.add_argument('--offline-limit', type=int, default=DEFAULT_OFFLINE_LIMIT,
+                        help=f'Readings buffered while offline before dropping the oldest (default: {DEFAULT_OFFLINE_LIMIT})')
+    parser.add_argument('--outage-every', type=float, default=0.0,
+                        help='Simulate a connectivity outage every this many seconds (default: 0, never)')
+    parser.add_argument('--outage-duration', type=float, default=10.0,
+                        help='Seconds each simulated outage lasts (default: 10)')
     
     args = parser.parse_args()
+    if args.batch < 1 or args.offline_limit < 1:
+        parser.error("--batch and --offline-limit must be at least 1")
+    
+    # Fail early if the format's encoder is not available
+    try:
+        encode([Tracker().generate_telemetry_data()], args.format)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Create and run the simulator
     simulator = SensorSimulator(
         broker=args.broker,
         port=args.port,
         topic=args.topic,
-        interval=args.interval
+        interval=args.interval,
+        payload_format=args.format,
+        reporter=EdgeReporter(
+            batch_size=args.batch,
+            temperature_delta=args.temperature_delta,
+            gforce_delta=args.gforce_delta,
+            heartbeat=args.heartbeat,
+            temperature_limit=args.alert_temperature,
+            gforce_limit=args.alert_gforce,
+            offline_limit=args.offline_limit
+        ),
+        outage_every=args.outage_every,
+        outage_duration=args.outage_duration
     )
     
     # Override package ID if specified